@@ -0,0 +1,33 @@
+import sys
+from panda3d.core import loadPrcFile
+from pavara.headless import setup_headless, FixedStepRunner, DEFAULT_TICK_RATE, DEFAULT_SUBSTEPS
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'usage: dedicated_server.py <map.xml> [tick rate] [physics substeps] [film to record]'
+        sys.exit(1)
+    loadPrcFile('panda_config.prc')
+    setup_headless()
+
+    from pavara.constants import TCP_PORT, UDP_PORT
+    from pavara.maps import load_maps
+    from pavara.network import Server
+    from pavara.transport import ThreadedTransport
+    from pavara.films import FilmWriter
+    from pavara.world import ServerWorld
+
+    tick_rate = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TICK_RATE
+    substeps = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_SUBSTEPS
+    world = ServerWorld()
+    load_maps('Maps/%s' % sys.argv[1], world)
+    film = FilmWriter(sys.argv[4], sys.argv[1]) if len(sys.argv) > 4 else None
+    server = Server(world, TCP_PORT, transport=ThreadedTransport(TCP_PORT, UDP_PORT), film=film)
+    runner = FixedStepRunner(world, tick_rate, substeps)
+    print 'SERVING %s ON PORT %d AT %d TICKS/SEC' % (sys.argv[1], TCP_PORT, tick_rate)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        print runner.stats()
+        server.transport.close()
+        if film:
+            film.close()
@@ -1,5 +1,156 @@
+"""
+Loading of models and sounds.
+
+Every model is loaded from disk once and kept as a template; load_model hands out copies of it. A copy shares the
+template's vertex data and only duplicates the (small) scene graph above it, so it is cheap to make and can be
+recolored or reparented without touching anyone else's.
+
+Panda sounds can't be shared between emitters, so load_sound still makes a new one each time, but the first sound
+loaded for each path is kept so the audio manager holds onto the decoded samples and later loads skip the disk.
+
+preload starts loading a set of assets in the background (models through the loader's asynchronous path, sounds one
+per frame) so that nothing stalls when they are first needed.
+"""
+from panda3d.core import NodePath
+from direct.actor.Actor import Actor
+
+# What every game needs, whatever the map.
+GAME_MODELS = ('walker.egg', 'plasma.egg', 'plasma_sight.egg', 'missile.egg', 'grenade.egg')
+GAME_SOUNDS = ('Sounds/plasma.wav', 'Sounds/step_mono.wav', 'Sounds/incarnation_mono.wav')
+
+
+class AssetCache (object):
+
+    def __init__(self):
+        self.models = {}
+        self.model_bytes = {}
+        self.instances = {}
+        self.sounds = {}
+        self.model_hits = 0
+        self.model_misses = 0
+        self.sound_hits = 0
+        self.sound_misses = 0
+        self.preloading = set()
+
+    def template(self, path):
+        """
+        The template NodePath for the given model, loading it if need be. Don't change or reparent it.
+        """
+        template = self.models.get(path)
+        if template is not None:
+            self.model_hits += 1
+            return template
+        self.model_misses += 1
+        return self.add_template(path, loader.loadModel(path))
+
+    def add_template(self, path, model):
+        self.models[path] = model
+        self.model_bytes[path] = vertex_bytes(model)
+        self.instances[path] = 0
+        return model
+
+    def model(self, path):
+        template = self.template(path)
+        self.instances[path] += 1
+        return template.copy_to(NodePath())
+
+    def actor(self, path):
+        template = self.template(path)
+        self.instances[path] += 1
+        return Actor(template)
+
+    def sound(self, audio3d, path):
+        if path in self.sounds:
+            self.sound_hits += 1
+        else:
+            self.sound_misses += 1
+            self.sounds[path] = audio3d.loadSfx(path)
+        return audio3d.loadSfx(path)
+
+    def preload(self, models=(), sounds=(), audio3d=None):
+        """
+        Starts loading the given models and sounds in the background. Anything already loaded is skipped.
+        """
+        for path in models:
+            if path in self.models or path in self.preloading:
+                continue
+            self.preloading.add(path)
+            loader.loadModel(path, callback=self._preloaded, extraArgs=[path])
+        sounds = [path for path in sounds if path not in self.sounds]
+        if sounds and audio3d:
+            taskMgr.add(self._preload_sounds, 'preloadSoundsTask', extraArgs=[audio3d, sounds], appendTask=True)
+
+    def _preloaded(self, model, path):
+        self.preloading.discard(path)
+        if model is not None and path not in self.models:
+            self.add_template(path, model)
+
+    def _preload_sounds(self, audio3d, paths, task):
+        path = paths.pop()
+        if path not in self.sounds:
+            self.sounds[path] = audio3d.loadSfx(path)
+        return task.cont if paths else task.done
+
+    def stats(self):
+        """
+        Returns a dict of hit and miss counts, how many assets are loaded, how many bytes of vertex data the loaded
+        models hold, and how many bytes copying rather than reloading has saved.
+        """
+        return {
+            'model_hits': self.model_hits,
+            'model_misses': self.model_misses,
+            'sound_hits': self.sound_hits,
+            'sound_misses': self.sound_misses,
+            'models': len(self.models),
+            'sounds': len(self.sounds),
+            'model_bytes': sum(self.model_bytes.values()),
+            'saved_bytes': sum(self.model_bytes[path] * max(0, count - 1)
+                               for path, count in self.instances.iteritems()),
+        }
+
+    def clear(self):
+        for model in self.models.values():
+            model.remove_node()
+        self.__init__()
+
+
+def vertex_bytes(model):
+    """
+    The number of bytes of vertex data in all the geometry under the given NodePath.
+    """
+    total = 0
+    for geom_np in model.find_all_matches('**/+GeomNode'):
+        geom_node = geom_np.node()
+        for i in xrange(geom_node.get_num_geoms()):
+            vdata = geom_node.get_geom(i).get_vertex_data()
+            for j in xrange(vdata.get_num_arrays()):
+                total += vdata.get_array(j).get_data_size_bytes()
+    return total
+
+
+cache = AssetCache()
+
+
 def load_model(path):
     """
-    Wrapper around direct.showbase.Loader.loadModel, for now. May handle remote asset loading in the future.
+    Returns a new copy of the model at path, which may be changed freely.
+    """
+    return cache.model(path)
+
+
+def load_actor(path):
+    """
+    Returns a new Actor built from a copy of the model at path.
+    """
+    return cache.actor(path)
+
+
+def load_sound(audio3d, path):
+    """
+    Returns a new sound for the given 3D audio manager, playing the file at path.
     """
-    return loader.loadModel(path)
+    return cache.sound(audio3d, path)
+
+
+def preload(models=(), sounds=(), audio3d=None):
+    cache.preload(models, sounds, audio3d)
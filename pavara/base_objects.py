@@ -1,7 +1,39 @@
 from pavara.constants import *
-from panda3d.core import GeomNode, NodePath
+from panda3d.core import GeomNode, NodePath, TransformState, Vec3
 from pavara.utils.geom import GeomBuilder
-from panda3d.bullet import BulletRigidBodyNode, BulletManifoldPoint
+from pavara.snapshots import quantize
+from panda3d.bullet import BulletRigidBodyNode, BulletManifoldPoint, BulletBoxShape, BulletConvexHullShape
+
+
+def solid_shapes(node):
+    """
+    The shapes added to a physics node through add_box and add_hull, as a list of ('box', half extents, transform)
+    and ('hull', geom, transform) tuples. Compiled maps save these rather than the Bullet shapes themselves.
+    """
+    shapes = node.get_python_tag('shapes')
+    if shapes is None:
+        shapes = []
+        node.set_python_tag('shapes', shapes)
+    return shapes
+
+def add_box(node, half_extents, xform=None):
+    """
+    Adds a box shape with the given half extents to a physics node, optionally transformed.
+    """
+    xform = xform or TransformState.make_identity()
+    node.add_shape(BulletBoxShape(Vec3(*half_extents)), xform)
+    solid_shapes(node).append(('box', tuple(half_extents), xform))
+
+def add_hull(node, geom, xform=None):
+    """
+    Adds a convex hull around the vertices of the given Geom to a physics node, optionally transformed.
+    """
+    xform = xform or TransformState.make_identity()
+    mesh = BulletConvexHullShape()
+    mesh.add_geom(geom)
+    node.add_shape(mesh, xform)
+    solid_shapes(node).append(('hull', geom, xform))
+
 
 class WorldObject (object):
     """
@@ -11,6 +43,11 @@ class WorldObject (object):
     world = None
     last_unique_id = 0
     collide_bits = NO_COLLISION_BITS
+    # Whether the World keeps this object for reuse once it has been thrown out (see World.spawn).
+    pooled = False
+    # What kind of object this is (WALKER_FLAG and friends), and its handle in the World it is attached to.
+    flags = 0
+    handle = None
 
     def __init__(self, name=None):
         self.name = name
@@ -32,6 +69,14 @@ class WorldObject (object):
         """
         pass
 
+    def reset(self, *args, **kwargs):
+        """
+        Called on a pooled object before it is attached again, with the arguments it would otherwise have been
+        built with. By default this re-runs __init__, keeping the object's name; any node and solid are kept.
+        """
+        kwargs['name'] = self.name
+        self.__init__(*args, **kwargs)
+
     def update(self, dt):
         """
         Called each frame if the WorldObject has registered itself as updatable.
@@ -48,6 +93,11 @@ class PhysicalObject (WorldObject):
     solid = None
     collide_bits = MAP_COLLIDE_BIT
     moved = False
+    # Whether this object's node and solid are built the same way every time from its arguments, and only through
+    # add_box and add_hull, so they can be saved in a compiled map (see pavara.map_cache).
+    compilable = False
+    # Whether the World keeps this object in its spatial index (see World.objects_near).
+    indexed = True
 
     def create_node(self):
         """
@@ -98,23 +148,18 @@ class PhysicalObject (WorldObject):
 
     def position(self):
         return self.node.get_pos()
-    def add_update(self, datagram):
-        if not self.moved:
-            return
-        pos = self.position()
-        hpr = self.node.get_hpr()
-        datagram.addString(self.name)
-        datagram.addFloat32(pos.x)
-        datagram.addFloat32(pos.y)
-        datagram.addFloat32(pos.z)
-        datagram.addFloat32(hpr.x)
-        datagram.addFloat32(hpr.y)
-        datagram.addFloat32(hpr.z)
-        self.moved = False
+
+    def snapshot_state(self):
+        """
+        Returns this object's position and rotation, quantized for network snapshots.
+        """
+        return quantize(self.position(), self.node.get_hpr())
 
 
 class CompositeObject (PhysicalObject):
 
+    compilable = True
+
     def __init__(self, name=None):
         super(CompositeObject, self).__init__(name)
         self.objects = []
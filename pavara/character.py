@@ -0,0 +1,99 @@
+"""
+Moving walkers through the world.
+
+Every frame a walker probes down from its hips for the ground, sweeps its collision cylinder along its move
+(again and again, to slide along whatever it hits), and probes down under each foot for the leg IK. A
+CharacterController makes all of one walker's physics queries, and avoids what it can:
+
+- A ray cast from the same place as last time, that hit something which can't move, would hit it again (unless it
+  has since been destroyed), so the last hit is used instead. A walker standing still on the map doesn't cast any
+  rays at all.
+- A move too short to matter isn't swept, and sliding stops as soon as what is left of the move is too short to
+  matter, rather than always trying ten times.
+"""
+from panda3d.core import TransformState, Vec3
+
+# Moves and differences in position shorter than this are treated as nothing at all.
+CONVERGED = 0.001
+# Most times a move is swept again to slide along what it hit.
+SLIDE_ITERATIONS = 10
+
+
+class CharacterController (object):
+    """
+    The physics queries of one walker in world. Probes are cast against collide_mask, and slides sweep shape,
+    offset from the walker's position by offset.
+    """
+
+    def __init__(self, world, shape, collide_mask, offset):
+        self.world = world
+        self.physics = world.physics
+        self.shape = shape
+        self.collide_mask = collide_mask
+        self.offset = Vec3(offset)
+        # The last ray cast for each probe: key -> (start, hit position, World.static_version if the hit can be
+        # reused, otherwise None).
+        self.probes = {}
+        self.casts = 0
+        self.reused = 0
+        self.sweeps = 0
+
+    def probe(self, key, start, end):
+        """
+        Returns where the ray from start to end first hits something, or None. If the last ray cast for key started
+        at the same place and hit something that can't move, that hit is returned again.
+        """
+        last = self.probes.get(key)
+        if last is not None and last[2] == self.world.static_version and \
+                (last[0] - start).length_squared() < CONVERGED * CONVERGED:
+            self.reused += 1
+            return last[1]
+        self.casts += 1
+        result = self.physics.ray_test_closest(start, end, self.collide_mask)
+        if not result.has_hit():
+            self.probes[key] = (start, None, None)
+            return None
+        hit = result.get_hit_pos()
+        # Kinematic bodies (walkers, projectiles) have no mass and so count as static to Bullet, but they are moved
+        # by hand every frame; only the map's own bodies really stay put.
+        node = result.get_node()
+        reusable = node.is_static() and not node.is_kinematic()
+        self.probes[key] = (start, hit, self.world.static_version if reusable else None)
+        return hit
+
+    def ground(self, pos):
+        """
+        Where the ground is under a walker at pos, if it is close enough to stand on.
+        """
+        return self.probe(self, pos + Vec3(0, 1, 0), pos + Vec3(0, -0.1, 0))
+
+    def floor(self, key, foot):
+        """
+        Where the floor is under a foot at foot, if it is within reach.
+        """
+        return self.probe(key, foot + Vec3(0, 1, 0), foot + Vec3(0, -0.7, 0))
+
+    def slide(self, start, goal, velocity):
+        """
+        Moves from start towards goal, sliding along whatever is in the way. Returns where the move ends up, and
+        velocity with the parts going into whatever was hit taken out.
+        """
+        distance = (goal - start).length()
+        if distance < CONVERGED:
+            return goal, velocity
+        pos = goal
+        from_ts = TransformState.make_pos(start + self.offset)
+        for i in xrange(SLIDE_ITERATIONS):
+            self.sweeps += 1
+            result = self.physics.sweep_test_closest(self.shape, from_ts, TransformState.make_pos(pos + self.offset),
+                                                     self.collide_mask, 0)
+            if not result.has_hit():
+                break
+            normal = result.get_hit_normal()
+            velocity = -velocity.cross(normal).cross(normal)
+            push = distance * (1 - result.get_hit_fraction())
+            normal.normalize()
+            pos = pos + normal * push
+            if push < CONVERGED:
+                break
+        return pos, velocity
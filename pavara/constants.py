@@ -17,13 +17,25 @@ NO_COLLISION_BITS = BitMask32.all_off()
 MAP_COLLIDE_BIT =   BitMask32.bit(0)
 SOLID_COLLIDE_BIT = BitMask32.bit(1)
 GHOST_COLLIDE_BIT = BitMask32.bit(2)
+PROJECTILE_COLLIDE_BIT = BitMask32.bit(3)
+# What the paths of swept projectiles are tested against (see World.sweep).
+SWEEP_COLLIDE_BITS = MAP_COLLIDE_BIT | SOLID_COLLIDE_BIT | GHOST_COLLIDE_BIT
+
+# object kind flags, kept with each object's handle (see pavara.handles)
+
+WALKER_FLAG = 1
+INCARNATOR_FLAG = 2
+PROJECTILE_FLAG = 4
+UNPUSHABLE_FLAG = 8
 
 # physics contstants
 
-EXPLOSIONS_DONT_PUSH = ["expl", "ground"]
+EXPLOSIONS_DONT_PUSH = WALKER_FLAG | UNPUSHABLE_FLAG
 DEFAULT_GRAVITY = Vec3(0, -9.81, 0)
 DEFAULT_FRICTION = 1
 AIR_FRICTION = 0.02
+# Size of the cells of the world's spatial index (see World.index).
+SPATIAL_CELL_SIZE = 8.0
 
 # weapons stuff
 
@@ -34,7 +46,10 @@ WALKER_ENERGY_TO_GUN_CHARGE = (.10,.36)
 WALKER_MIN_CHARGE_ENERGY = .2
 PLASMA_LIFESPAN = 900
 PLASMA_SOUND_FALLOFF = 20
+PLASMA_SPEED = 15
 MISSILE_LIFESPAN = 600
+MISSILE_ACCELERATION = 30
+MISSILE_MAX_SPEED = 30
 
 # missile/grenade engine color lists in rgb decimal format
 
@@ -45,4 +60,4 @@ ENGINE_COLORS = [ [173.0/255.0, 0, 0, 1] # dark red
                 ]
 
 TCP_PORT = 19567
-
+UDP_PORT = 19568
@@ -0,0 +1,219 @@
+"""
+Debris: the triangles that fly out of explosions.
+
+Every shard in the world lives in one fixed-size pool, drawn as a single Geom whose vertex buffer is rewritten each
+frame. Shards aren't physics objects; they fall under gravity, tumble, and bounce off a floor, which is all anyone
+watching them can tell. Each shard's floor is found once, when it is emitted, by casting a ray down onto the map
+from where it starts, so shards land on blocks and ramps as well as the ground; if the ray finds nothing, they bounce
+off the ground height the pool was given. When the pool is full, new shards replace the oldest ones.
+"""
+from array import array
+from math import sin, cos, sqrt
+import random
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexArrayFormat, GeomVertexFormat, GeomVertexData, \
+    InternalName, OmniBoundingVolume, Point3
+from pavara.base_objects import WorldObject
+from pavara.constants import DEFAULT_GRAVITY, MAP_COLLIDE_BIT
+
+MAX_DEBRIS = 512
+DEBRIS_GROUND = 0.0
+# How far below the ground the floor ray for a shard reaches, in case it starts a little under it.
+DEBRIS_FLOOR_REACH = 1.0
+DEBRIS_BOUNCE = 0.4
+DEBRIS_GROUND_FRICTION = 0.6
+DEBRIS_SPEED = 4.0
+DEBRIS_SPIN = 8.0
+
+_format = None
+_collapsed = array('f', [0.0] * 9)
+
+
+def _debris_format():
+    # Positions, normals and colors each get their own array, so each can be rewritten in one go.
+    global _format
+    if _format is None:
+        fmt = GeomVertexFormat()
+        for name, components, contents in ((InternalName.get_vertex(), 3, Geom.CPoint),
+                                           (InternalName.get_normal(), 3, Geom.CVector),
+                                           (InternalName.get_color(), 4, Geom.CColor)):
+            array_format = GeomVertexArrayFormat()
+            array_format.add_column(name, components, Geom.NTFloat32, contents)
+            fmt.add_array(array_format)
+        _format = GeomVertexFormat.register_format(fmt)
+    return _format
+
+
+def _unit(v):
+    length = sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2]) or 1.0
+    return (v[0] / length, v[1] / length, v[2] / length)
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+
+class Debris (WorldObject):
+    """
+    The pool of every debris shard in a world.
+    """
+
+    def __init__(self, capacity=MAX_DEBRIS, gravity=None, ground=DEBRIS_GROUND, name='debris'):
+        super(Debris, self).__init__(name)
+        self.capacity = capacity
+        self.gravity = (gravity or DEFAULT_GRAVITY).get_y()
+        # The height shards bounce at when there's nothing under them; the map's Ground sets it.
+        self.ground = ground
+        n = capacity
+        self.pos = array('f', [0.0] * (n * 3))
+        self.vel = array('f', [0.0] * (n * 3))
+        # Each shard's frame: its normal and two in-plane axes. It tumbles about the second.
+        self.axes = array('f', [0.0] * (n * 9))
+        self.angle = array('f', [0.0] * n)
+        self.spin = array('f', [0.0] * n)
+        self.size = array('f', [0.0] * n)
+        self.age = array('f', [0.0] * n)
+        self.lifetime = array('f', [0.0] * n)
+        self.floor = array('f', [0.0] * n)
+        self.color = array('f', [0.0] * (n * 4))
+        self.alive = [False] * n
+        # The slots of the shards still flying, so a frame only costs as much as there is debris.
+        self.live = []
+        self.cursor = 0
+        self.vertices = array('f', [0.0] * (n * 9))
+        self.normals = array('f', [0.0] * (n * 9))
+        self.colors = array('f', [0.0] * (n * 12))
+        self.node = None
+
+    def attached(self):
+        self.vdata = GeomVertexData(self.name, _debris_format(), Geom.UHDynamic)
+        self.vdata.set_num_rows(self.capacity * 3)
+        tris = GeomTriangles(Geom.UHStatic)
+        for i in xrange(self.capacity):
+            tris.add_consecutive_vertices(i * 3, 3)
+            tris.close_primitive()
+        geom = Geom(self.vdata)
+        geom.add_primitive(tris)
+        geom_node = GeomNode(self.name)
+        geom_node.add_geom(geom)
+        # Shards are everywhere; don't bother working out bounds that change every frame.
+        geom_node.set_bounds(OmniBoundingVolume())
+        geom_node.set_final(True)
+        self.node = self.world.scene.attach_new_node(geom_node)
+        self.node.set_two_sided(True)
+        self.upload()
+        self.world.register_updater(self)
+
+    def emit(self, position, velocity, size, color, lifetime):
+        """
+        Adds a shard at position, moving at velocity. lifetime is in 60ths of a second, like the rest of the
+        effects; the shard fades out over the second half of it.
+        """
+        i = self.cursor
+        self.cursor = (self.cursor + 1) % self.capacity
+        if not self.alive[i]:
+            self.alive[i] = True
+            self.live.append(i)
+        self.pos[i * 3:i * 3 + 3] = array('f', position)
+        self.vel[i * 3:i * 3 + 3] = array('f', velocity)
+        normal = _unit([random.uniform(-1, 1) for _ in xrange(3)])
+        u = _unit(_cross(normal, (0.0, 1.0, 0.0) if abs(normal[1]) < 0.9 else (1.0, 0.0, 0.0)))
+        v = _cross(normal, u)
+        self.axes[i * 9:i * 9 + 9] = array('f', normal + u + v)
+        self.angle[i] = 0.0
+        self.spin[i] = random.uniform(-DEBRIS_SPIN, DEBRIS_SPIN)
+        self.size[i] = size
+        self.age[i] = 0.0
+        self.lifetime[i] = lifetime
+        self.floor[i] = self.floor_under(position)
+        self.color[i * 4:i * 4 + 4] = array('f', color)
+
+    def floor_under(self, position):
+        """
+        The height of the map right under position, or the ground height if there's nothing there.
+        """
+        if self.world is None:
+            return self.ground
+        start = Point3(*position)
+        end = Point3(start.x, min(start.y, self.ground) - DEBRIS_FLOOR_REACH, start.z)
+        result = self.world.physics.ray_test_closest(start, end, MAP_COLLIDE_BIT)
+        if not result.has_hit():
+            return self.ground
+        return result.get_hit_pos().y
+
+    def update(self, dt):
+        if not self.live:
+            return
+        pos, vel, axes, alive = self.pos, self.vel, self.axes, self.alive
+        vertices, normals, colors = self.vertices, self.normals, self.colors
+        fall = self.gravity * dt
+        ticks = dt * 60
+        first = min(self.live)
+        last = max(self.live)
+        live = []
+        for i in self.live:
+            age = self.age[i] + ticks
+            lifetime = self.lifetime[i]
+            p = i * 3
+            if age > lifetime:
+                alive[i] = False
+                # Collapse it to a point so it draws nothing.
+                vertices[p * 3:p * 3 + 9] = _collapsed
+                continue
+            live.append(i)
+            self.age[i] = age
+
+            vel[p + 1] += fall
+            x = pos[p] + vel[p] * dt
+            y = pos[p + 1] + vel[p + 1] * dt
+            z = pos[p + 2] + vel[p + 2] * dt
+            size = self.size[i]
+            floor = self.floor[i] + size * 0.5
+            if y < floor:
+                y = floor
+                vel[p + 1] = -vel[p + 1] * DEBRIS_BOUNCE
+                vel[p] *= DEBRIS_GROUND_FRICTION
+                vel[p + 2] *= DEBRIS_GROUND_FRICTION
+                self.spin[i] *= DEBRIS_GROUND_FRICTION
+            pos[p] = x
+            pos[p + 1] = y
+            pos[p + 2] = z
+
+            angle = self.angle[i] + self.spin[i] * dt
+            self.angle[i] = angle
+            c = cos(angle)
+            s = sin(angle)
+            a = i * 9
+            nx, ny, nz, ux, uy, uz, vx, vy, vz = axes[a:a + 9]
+            # Tumbling about v turns u towards the normal.
+            ux, uy, uz, nx, ny, nz = (c * ux + s * nx, c * uy + s * ny, c * uz + s * nz,
+                                      c * nx - s * ux, c * ny - s * uy, c * nz - s * uz)
+            extent = size * 0.5
+            # The same triangle a Shrapnel used to be: (-e, -e), (e, e), (-e, e) in the shard's plane.
+            vertices[a:a + 9] = array('f', (
+                x - extent * ux - extent * vx, y - extent * uy - extent * vy, z - extent * uz - extent * vz,
+                x + extent * ux + extent * vx, y + extent * uy + extent * vy, z + extent * uz + extent * vz,
+                x - extent * ux + extent * vx, y - extent * uy + extent * vy, z - extent * uz + extent * vz))
+            normals[a:a + 9] = array('f', (nx, ny, nz) * 3)
+
+            fade = 1.0
+            halflife = lifetime / 2
+            if age > lifetime - halflife:
+                fade = (lifetime - age) / halflife
+            k = i * 4
+            r, g, b = self.color[k] * fade, self.color[k + 1] * fade, self.color[k + 2] * fade
+            colors[i * 12:i * 12 + 12] = array('f', (r, g, b, 1.0) * 3)
+        self.live = live
+        self.upload(first, last + 1)
+
+    def upload(self, first=0, end=None):
+        """
+        Copies the shards in slots first up to end into the vertex data, or all of them.
+        """
+        if end is None:
+            end = self.capacity
+        for index, data in enumerate((self.vertices, self.normals, self.colors)):
+            # Each shard is three vertices of the same number of floats in every array.
+            stride = len(data) / self.capacity
+            handle = self.vdata.modify_array(index).modify_handle()
+            piece = data[first * stride:end * stride].tostring()
+            handle.set_subdata(first * stride * data.itemsize, len(piece), piece)
@@ -1,8 +1,8 @@
 from pavara.constants import *
 from pavara.utils.geom import GeomBuilder
 from pavara.base_objects import WorldObject, PhysicalObject
+from pavara.debris import DEBRIS_SPEED
 from direct.interval.LerpInterval import LerpFunc
-from panda3d.bullet import BulletRigidBodyNode, BulletBoxShape
 from panda3d.core import Point3, TransparencyAttrib
 import math
 import random
@@ -124,7 +124,7 @@ class Mortal(Effect):
 
     def dead(self):
         c = getattr(self, 'color', [1,1,1,1])
-        expl_pos = self.node.get_pos(self.world.render)
+        expl_pos = self.node.get_pos(self.world.scene)
         size = getattr(self, 'size', None)
         width = getattr(self, 'width', None)
         radius = getattr(self, 'radius', None)
@@ -140,10 +140,14 @@ class Mortal(Effect):
             reduced = radius * .6
             count = int(reduced)
 
-        self.world.attach(TriangleExplosion(expl_pos, count, size=reduced, color=c, lifetime=60, debris_area=size))
+        self.world.spawn(TriangleExplosion, expl_pos, count, size=reduced, color=c, lifetime=60, debris_area=size)
 
 
 class TriangleExplosion(WorldObject):
+    # Explosions only exist long enough to hand their shards to the world's debris, then go back to the pool.
+    pooled = True
+    node = None
+
     def __init__(self, pos, count, hit_normal=None, lifetime=40, color=[1,1,1,1], size=.2, amount=5, name=None, debris_area=None):
         super(TriangleExplosion, self).__init__(name)
         self.pos = Vec3(*pos)
@@ -152,15 +156,14 @@ class TriangleExplosion(WorldObject):
         self.color = color
         self.size = size
         self.count = count
-        self.shrapnels = []
         self.debris_area = debris_area
 
-
-    def create_node(self):
-        self.pos_node = self.world.render.attachNewNode(self.name+"_node")
-        return self.pos_node
-
     def attached(self):
+        # Debris is purely for show, so worlds that aren't drawn don't have any.
+        debris = getattr(self.world, 'debris', None)
+        self.world.garbage.add(self)
+        if not debris:
+            return
         for i in xrange(self.count):
             #if self.hit_normal:
                 #vector = Vec3(*[random.uniform(x+.7, x-.7) for x in self.hit_normal])
@@ -171,52 +174,6 @@ class TriangleExplosion(WorldObject):
             else:
                 position = Vec3(*[random.uniform(x+self.size, x-self.size) for x in self.pos])
 
-            if position.y < 0:
-                position.y = self.size+.1
-            self.shrapnels.append(self.world.attach(Shrapnel(position, self.size, self.color, vector, self.lifetime)))
-
-
-class Shrapnel(PhysicalObject):
-    def __init__(self, pos, size, color, vector, lifetime, name=None):
-        super(Shrapnel, self).__init__(name)
-        self.pos = pos
-        self.vector = vector
-        self.lifetime = lifetime
-        self.size = size
-        self.color = color
-        self.mass = .01
-        self.age = 0
-
-    def create_node(self):
-        extent = self.size/2.0
-        geom_points = [Point3(0,-extent,-extent), Point3(0,extent,extent), Point3(0,-extent,extent)]
-        self.geom = GeomBuilder('tri').add_tri(self.color, geom_points).get_geom_node()
-        self.node = self.world.render.attach_new_node(self.geom)
-        self.colorhandle = self.node.find('**/*')
-        return self.node
-
-    def create_solid(self):
-        node = BulletRigidBodyNode(self.name)
-        node_shape = BulletBoxShape(Vec3(.01, self.size, self.size))
-        node.add_shape(node_shape)
-        node.set_mass(3)
-        node.set_angular_damping(.7)
-        return node
-
-    def attached(self):
-        self.world.register_collider(self)
-        self.world.register_updater_later(self)
-        self.node.set_pos(self.pos)
-        self.solid.apply_impulse(Vec3(*self.vector)*12, Point3(*self.pos))
-        self.solid.setIntoCollideMask(NO_COLLISION_BITS)
-
-    def update(self, dt):
-        self.age += dt*60
-        halflife = self.lifetime/2
-        if self.age > self.lifetime-halflife:
-            newcolor = [x*((self.lifetime-self.age)/halflife) for x in self.color]
-            newcolor[3] = 1 #changing the alpha channel doesn't work
-            if self.node:
-                self.node.set_color(*newcolor)
-        if self.age > self.lifetime:
-            self.world.garbage.add(self)
+            if position.y < debris.ground:
+                position.y = debris.ground + self.size + .1
+            debris.emit(position, vector * DEBRIS_SPEED, self.size, self.color, self.lifetime)
@@ -0,0 +1,244 @@
+"""
+Films: recordings of whole matches.
+
+A film is an append-only binary file. After a short header naming the map, it is a sequence of records, each a
+type, a time (seconds since the start of the film) and a length-prefixed payload:
+
+    RECORD_OBJECT    an object id being given to a named object, with its kind flags (WALKER_FLAG and friends)
+    RECORD_INPUT     one player's input frame, as packed by pavara.inputs
+    RECORD_KEYFRAME  every object's name, kind flags and state
+    RECORD_SNAPSHOT  the objects that changed since the previous snapshot or keyframe
+
+Keyframes are written every few seconds, so playback can jump to any time by starting from the keyframe before it
+and applying the snapshots after, rather than simulating the match from the start. Nothing in the file refers
+forward, so a film that was cut short (the server crashed, say) is still playable up to where it stops.
+"""
+import struct
+from bisect import bisect_right
+from pavara.constants import WALKER_FLAG
+from pavara.snapshots import encode_fragments, decode_fragment, dequantize
+from pavara.interpolation import Interpolator
+
+FILM_MAGIC = 'PAVARAFILM'
+FILM_VERSION = 3
+
+RECORD_OBJECT = 1
+RECORD_INPUT = 2
+RECORD_KEYFRAME = 3
+RECORD_SNAPSHOT = 4
+
+KEYFRAME_INTERVAL = 5.0
+# How far past the playback time records are read, so there is always a later sample to interpolate towards.
+READ_AHEAD = 0.25
+
+# Film snapshots are never sent anywhere, so they go in one piece.
+_UNLIMITED = 1 << 30
+
+_file_header = struct.Struct('<10sH')
+_record = struct.Struct('<BdI')
+# oid, flags
+_object = struct.Struct('<HH')
+_input = struct.Struct('<H')
+_count = struct.Struct('<H')
+
+
+def _pack_string(s):
+    return chr(len(s)) + s
+
+
+def _unpack_string(data, offset):
+    size = ord(data[offset])
+    return data[offset + 1:offset + 1 + size], offset + 1 + size
+
+
+class FilmWriter (object):
+    """
+    Records a match as it is played. The server calls introduce, input and snapshot as things happen.
+    """
+
+    def __init__(self, path, map_name, keyframe_interval=KEYFRAME_INTERVAL):
+        self.file = open(path, 'wb')
+        self.file.write(_file_header.pack(FILM_MAGIC, FILM_VERSION) + _pack_string(map_name))
+        self.keyframe_interval = keyframe_interval
+        self.start = None
+        self.names = {}
+        self.flags = {}
+        self.last_state = None
+        self.last_keyframe = None
+        self.seq = 0
+
+    def _time(self, time):
+        if self.start is None:
+            self.start = time
+        return time - self.start
+
+    def _write(self, kind, time, payload):
+        self.file.write(_record.pack(kind, time, len(payload)) + payload)
+
+    def introduce(self, time, oid, name, flags=0):
+        self.names[oid] = name
+        self.flags[oid] = flags
+        self._write(RECORD_OBJECT, self._time(time), _object.pack(oid, flags) + _pack_string(name))
+
+    def input(self, time, pid, frame):
+        self._write(RECORD_INPUT, self._time(time), _input.pack(pid) + frame.pack())
+
+    def snapshot(self, time, state):
+        """
+        Records the state of every networked object ({id: quantized state}) at the given time.
+        """
+        time = self._time(time)
+        self.seq += 1
+        if self.last_keyframe is None or time - self.last_keyframe >= self.keyframe_interval:
+            names = [(oid, self.names[oid]) for oid in state if oid in self.names]
+            parts = [_count.pack(len(names))]
+            for oid, name in names:
+                parts.append(_object.pack(oid, self.flags.get(oid, 0)) + _pack_string(name))
+            fragments, _, _ = encode_fragments(self.seq, 0, {}, state, mtu=_UNLIMITED, budget=_UNLIMITED)
+            self._write(RECORD_KEYFRAME, time, ''.join(parts) + fragments[0])
+            self.last_keyframe = time
+            # Anything buffered up to a keyframe is worth keeping if we go down.
+            self.file.flush()
+        else:
+            fragments, _, _ = encode_fragments(self.seq, self.seq - 1, self.last_state, state, mtu=_UNLIMITED,
+                                               budget=_UNLIMITED)
+            self._write(RECORD_SNAPSHOT, time, fragments[0])
+        self.last_state = state
+
+    def close(self):
+        self.file.close()
+
+
+class FilmReader (object):
+    """
+    Reads a film. Opening one scans it once to index its keyframes; the records themselves are read as needed.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        magic, version = _file_header.unpack(self.file.read(_file_header.size))
+        if magic != FILM_MAGIC or version != FILM_VERSION:
+            raise ValueError('%s is not a version %d film' % (path, FILM_VERSION))
+        size = ord(self.file.read(1))
+        self.map_name = self.file.read(size)
+        self.start = self.file.tell()
+        self.keyframe_times = []
+        self.keyframe_offsets = []
+        self.length = 0.0
+        for kind, time, offset, payload in self.records(self.start, load=False):
+            if kind == RECORD_KEYFRAME:
+                self.keyframe_times.append(time)
+                self.keyframe_offsets.append(offset)
+            self.length = time
+
+    def records(self, offset=None, load=True):
+        """
+        Yields (kind, time, offset, payload) for each record from the given file offset on. A truncated last
+        record is ignored. If load is false, payloads are skipped over and None is given instead.
+        """
+        self.file.seek(self.start if offset is None else offset)
+        while True:
+            offset = self.file.tell()
+            header = self.file.read(_record.size)
+            if len(header) < _record.size:
+                return
+            kind, time, size = _record.unpack(header)
+            if load:
+                payload = self.file.read(size)
+                if len(payload) < size:
+                    return
+            else:
+                self.file.seek(size, 1)
+                payload = None
+            yield kind, time, offset, payload
+
+    def keyframe_before(self, time):
+        """
+        The file offset of the last keyframe at or before the given time (or the first keyframe).
+        """
+        if not self.keyframe_offsets:
+            return self.start
+        return self.keyframe_offsets[max(0, bisect_right(self.keyframe_times, time) - 1)]
+
+    def close(self):
+        self.file.close()
+
+
+class FilmPlayer (object):
+    """
+    Plays a film back into a ClientWorld, drawing objects the same way a networked client does.
+    """
+
+    def __init__(self, world, reader, speed=1.0):
+        self.world = world
+        self.reader = reader
+        self.speed = speed
+        self.seek(0.0)
+
+    def seek(self, time):
+        """
+        Jumps to the given time, starting from the keyframe before it.
+        """
+        self.time = max(0.0, min(time, self.reader.length))
+        self.names = {}
+        self.state = {}
+        self.interpolator = Interpolator(delay=0.0)
+        self.interpolator.offset = 0.0
+        self.pending = self.reader.records(self.reader.keyframe_before(self.time))
+        self.next = None
+        self.read(self.time + READ_AHEAD)
+
+    def read(self, until):
+        while True:
+            if self.next is None:
+                self.next = next(self.pending, None)
+                if self.next is None:
+                    return
+            kind, time, offset, payload = self.next
+            if time > until:
+                return
+            self.next = None
+            self.apply_record(kind, time, payload)
+
+    def apply_record(self, kind, time, payload):
+        if kind == RECORD_OBJECT:
+            oid, flags = _object.unpack_from(payload)
+            self.introduce(oid, _unpack_string(payload, _object.size)[0], flags)
+        elif kind == RECORD_KEYFRAME:
+            count = _count.unpack_from(payload)[0]
+            offset = _count.size
+            for i in xrange(count):
+                oid, flags = _object.unpack_from(payload, offset)
+                name, offset = _unpack_string(payload, offset + _object.size)
+                self.introduce(oid, name, flags)
+            self.state = {}
+            self.apply_snapshot(time, payload, offset)
+            for oid in self.interpolator.buffers.keys():
+                if oid not in self.state:
+                    self.interpolator.remove(oid)
+        elif kind == RECORD_SNAPSHOT:
+            self.apply_snapshot(time, payload, 0)
+
+    def apply_snapshot(self, time, payload, offset):
+        seq, updates, removed = decode_fragment(payload, self.state, offset)
+        for oid, state in updates.iteritems():
+            pos, hpr = dequantize(state)
+            self.interpolator.add(oid, time, pos, hpr)
+        for oid in removed:
+            self.interpolator.remove(oid)
+        self.interpolator.hold(time, self.state)
+
+    def introduce(self, oid, name, flags):
+        self.names[oid] = name
+        if flags & WALKER_FLAG and name not in self.world.objects:
+            self.world.create_walker(name)
+
+    def update(self, task):
+        self.time = min(self.time + globalClock.getDt() * self.speed, self.reader.length)
+        self.read(self.time + READ_AHEAD)
+        for oid, pos, hpr in self.interpolator.sample(self.time):
+            obj = self.world.objects.get(self.names.get(oid))
+            if obj:
+                obj.move(pos)
+                obj.rotate(*hpr)
+        return task.cont
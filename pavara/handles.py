@@ -0,0 +1,70 @@
+"""
+Integer handles for world objects.
+
+Every object attached to a World is given a small integer handle, an index into the world's HandleTable, and every
+physics node it owns is tagged with that handle. Resolving a Bullet node back to its object is then a list index
+rather than a dict lookup by name, and what kind of object it is can be read from the flags kept alongside each
+handle (WALKER_FLAG and friends, see pavara.constants) instead of by looking at its name.
+
+Handles are also the ids networked objects go by in snapshots, so a freed handle is only reused once enough others
+have been freed that no client is likely to still be holding on to its old meaning.
+"""
+from collections import deque
+
+HANDLE_REUSE_DELAY = 1024
+# Handles are sent over the network as unsigned 16-bit ints.
+MAX_HANDLE = 0xFFFF
+
+
+class HandleTable (object):
+    """
+    A dense table of objects and their flags, indexed by handle. Handle 0 is never given out, so a handle is
+    always true.
+    """
+
+    def __init__(self, reuse_delay=HANDLE_REUSE_DELAY):
+        self.reuse_delay = reuse_delay
+        self.objects = [None]
+        self.flags = [0]
+        self.free = deque()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for obj in self.objects:
+            if obj is not None:
+                yield obj
+
+    def add(self, obj, flags=0):
+        """
+        Returns a new handle for obj.
+        """
+        if len(self.free) > self.reuse_delay or (self.free and len(self.objects) > MAX_HANDLE):
+            handle = self.free.popleft()
+            self.objects[handle] = obj
+            self.flags[handle] = flags
+        else:
+            assert len(self.objects) <= MAX_HANDLE, 'out of object handles'
+            handle = len(self.objects)
+            self.objects.append(obj)
+            self.flags.append(flags)
+        self.count += 1
+        return handle
+
+    def remove(self, handle):
+        if not handle or self.objects[handle] is None:
+            return
+        self.objects[handle] = None
+        self.flags[handle] = 0
+        self.free.append(handle)
+        self.count -= 1
+
+    def get(self, handle):
+        """
+        Returns the object with the given handle, or None.
+        """
+        if not handle or handle >= len(self.objects):
+            return None
+        return self.objects[handle]
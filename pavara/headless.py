@@ -0,0 +1,106 @@
+"""
+Running a ServerWorld without ShowBase or a graphics pipe, stepped at a fixed tick rate.
+"""
+import __builtin__
+import time
+from panda3d.core import loadPrcFileData, ClockObject
+from direct.showbase.Loader import Loader
+from direct.task.TaskManagerGlobal import taskMgr
+
+DEFAULT_TICK_RATE = 60
+DEFAULT_SUBSTEPS = 1
+MAX_TICKS_PER_ADVANCE = 5
+
+
+def setup_headless():
+    """
+    Configures Panda to run without a window or audio device, and installs the builtins (taskMgr, globalClock,
+    loader) that ShowBase would normally provide, so the rest of pavara can run unchanged.
+    """
+    loadPrcFileData('headless', 'window-type none\naudio-library-name null\n')
+    __builtin__.taskMgr = taskMgr
+    __builtin__.globalClock = ClockObject.get_global_clock()
+    __builtin__.loader = Loader(None)
+
+
+class FixedStepRunner (object):
+    """
+    Steps a World at a fixed rate from a plain loop, rather than from a render task. Wall time is accumulated and
+    consumed in whole ticks, so every tick costs the same amount of simulation no matter how fast the loop spins.
+    """
+
+    def __init__(self, world, tick_rate=DEFAULT_TICK_RATE, substeps=DEFAULT_SUBSTEPS, max_ticks=MAX_TICKS_PER_ADVANCE):
+        self.world = world
+        self.tick_dt = 1.0 / tick_rate
+        self.substeps = substeps
+        self.max_ticks = max_ticks
+        self.accumulator = 0.0
+        self.ticks = 0
+        self.overruns = 0
+        self.dropped_ticks = 0
+        self.worst_tick = 0.0
+        self.running = False
+
+    def tick(self):
+        """
+        Runs a single simulation tick, returning the wall time it took.
+        """
+        start = time.time()
+        self.world.step(self.tick_dt, self.substeps)
+        self.ticks += 1
+        elapsed = time.time() - start
+        self.worst_tick = max(self.worst_tick, elapsed)
+        if elapsed > self.tick_dt:
+            self.overruns += 1
+            self.report_overrun(elapsed)
+        return elapsed
+
+    def report_overrun(self, elapsed):
+        print 'TICK %d OVER BUDGET: %.2fms (budget %.2fms)' % (self.ticks, elapsed * 1000.0, self.tick_dt * 1000.0)
+
+    def advance(self, elapsed):
+        """
+        Adds elapsed wall time to the accumulator and runs as many whole ticks as it covers. If the server has
+        fallen more than max_ticks behind, the rest of the backlog is dropped instead of spiralling.
+        """
+        self.accumulator += elapsed
+        ran = 0
+        while self.accumulator >= self.tick_dt:
+            if ran >= self.max_ticks:
+                behind = int(self.accumulator / self.tick_dt)
+                self.dropped_ticks += behind
+                self.accumulator -= behind * self.tick_dt
+                print 'SERVER FELL BEHIND, DROPPED %d TICKS' % behind
+                break
+            self.tick()
+            self.accumulator -= self.tick_dt
+            ran += 1
+        return ran
+
+    def run(self):
+        """
+        Runs until stop() is called, servicing Panda tasks (networking) between ticks and sleeping off any
+        time left before the next one is due.
+        """
+        self.running = True
+        last = time.time()
+        while self.running:
+            taskMgr.step()
+            now = time.time()
+            self.advance(now - last)
+            last = now
+            remaining = self.tick_dt - self.accumulator
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'dropped_ticks': self.dropped_ticks,
+            'worst_tick_ms': self.worst_tick * 1000.0,
+            'budget_ms': self.tick_dt * 1000.0,
+        }
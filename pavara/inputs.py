@@ -0,0 +1,118 @@
+"""
+Fixed-size input frames.
+
+Each frame of local input is packed into 14 bytes: which movement buttons are held, which weapons were fired this
+frame, how long the frame lasted, the time the player was seeing, and a sequence number. The client sends its last few
+frames in every datagram, so a lost datagram doesn't lose any input, and the server skips the ones it has seen.
+
+There is no aim in a frame. A walker turns with the left and right buttons and fires wherever its barrels point, so
+the buttons already say where it is aiming; the camera is free-flying and says nothing about the walker.
+"""
+import math
+import struct
+
+# Held buttons.
+BUTTON_FORWARD = 1 << 0
+BUTTON_BACKWARD = 1 << 1
+BUTTON_LEFT = 1 << 2
+BUTTON_RIGHT = 1 << 3
+BUTTON_CROUCH = 1 << 4
+
+# Fired this frame.
+FIRE_PLASMA = 1 << 0
+FIRE_MISSILE = 1 << 1
+FIRE_GRENADE = 1 << 2
+TOGGLE_GRENADE = 1 << 3
+
+BUTTON_COMMANDS = (
+    (BUTTON_FORWARD, 'forward'),
+    (BUTTON_BACKWARD, 'backward'),
+    (BUTTON_LEFT, 'left'),
+    (BUTTON_RIGHT, 'right'),
+    (BUTTON_CROUCH, 'crouch'),
+)
+
+FIRE_COMMANDS = (
+    (FIRE_PLASMA, 'fire'),
+    (FIRE_MISSILE, 'missile'),
+    (FIRE_GRENADE, 'grenade_fire'),
+    (TOGGLE_GRENADE, 'grenade'),
+)
+
+# How many of the latest frames go in each datagram.
+INPUT_REDUNDANCY = 3
+
+# The longest a single frame can move a walker for.
+MAX_FRAME_DT = 0.2
+
+# seq, dt, view time, buttons, fire
+_frame = struct.Struct('<IffBB')
+FRAME_SIZE = _frame.size
+
+
+class InputFrame (object):
+
+    def __init__(self, seq, dt, buttons=0, fire=0, view_time=0.0):
+        self.seq = seq
+        self.dt = dt
+        self.buttons = buttons
+        self.fire = fire
+        self.view_time = view_time
+
+    def __repr__(self):
+        return 'InputFrame(%s, %.3f, %s, %s)' % (self.seq, self.dt, self.buttons, self.fire)
+
+    def pack(self):
+        return _frame.pack(self.seq, self.dt, self.view_time, self.buttons, self.fire)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        seq, dt, view_time, buttons, fire = _frame.unpack_from(data, offset)
+        return cls(seq, dt, buttons, fire, view_time)
+
+    def valid(self):
+        """
+        Whether this frame's times are real numbers, which frames from a broken or hostile client may not be.
+        """
+        return not (math.isnan(self.dt) or math.isinf(self.dt) or
+                    math.isnan(self.view_time) or math.isinf(self.view_time))
+
+
+def pack_frames(frames):
+    """
+    Packs a list of frames, newest first, into one payload.
+    """
+    return chr(len(frames)) + ''.join(f.pack() for f in frames)
+
+
+def unpack_frames(data, offset=0):
+    """
+    The inverse of pack_frames. Returns the list of frames, newest first, or None if data is too short for the
+    frames it claims to hold or any of them is invalid.
+    """
+    if len(data) < offset + 1:
+        return None
+    count = ord(data[offset])
+    offset += 1
+    if len(data) < offset + count * FRAME_SIZE:
+        return None
+    frames = [InputFrame.unpack(data, offset + i * FRAME_SIZE) for i in xrange(count)]
+    for frame in frames:
+        if not frame.valid():
+            return None
+    return frames
+
+
+def apply_input(walker, previous, frame, fire=True):
+    """
+    Gives the walker the commands implied by going from held buttons previous to the given frame. Only buttons
+    that changed are passed on, so walker state driven by presses and releases (like jumping) behaves. Weapons are
+    only fired if fire is set.
+    """
+    for bit, cmd in BUTTON_COMMANDS:
+        if (frame.buttons ^ previous) & bit:
+            walker.handle_command(cmd, bool(frame.buttons & bit))
+    if fire:
+        for bit, cmd in FIRE_COMMANDS:
+            if frame.fire & bit:
+                walker.handle_command(cmd, True)
@@ -0,0 +1,62 @@
+from panda3d.core import Vec3
+from pavara.constants import MAP_COLLIDE_BIT
+from pavara.base_objects import CompositeObject
+from pavara.static import StaticGeometry
+
+INTEREST_RADIUS = 120.0
+# Anything this close to a walker is relevant whether or not it can be seen, so it doesn't pop in around corners.
+OCCLUSION_GRACE_RADIUS = 15.0
+
+class InterestManager (object):
+    """
+    Decides which networked objects each player needs to hear about: those within a radius of their walker and,
+    optionally, not hidden behind static map geometry.
+    """
+
+    def __init__(self, world, radius=INTEREST_RADIUS, occlusion=False, grace_radius=OCCLUSION_GRACE_RADIUS):
+        self.world = world
+        self.radius = radius
+        self.occlusion = occlusion
+        self.grace_radius = grace_radius
+        self.objects = {}
+        self.ids = {}
+        # Networked objects the world doesn't index, which have to be checked one by one.
+        self.unindexed = []
+
+    def update(self, objects):
+        """
+        Takes the current networked objects ({id: object}). Called once per snapshot, before any queries.
+        """
+        self.objects = objects
+        self.ids = dict((obj, oid) for oid, obj in objects.iteritems())
+        self.unindexed = [obj for obj in self.ids if obj not in self.world.index]
+
+    def relevant(self, walker):
+        """
+        Returns the ids of the objects relevant to the given walker.
+        """
+        center = walker.position()
+        oids = [self.ids[obj] for obj in self.world.objects_near(center, self.radius) if obj in self.ids]
+        oids.extend(self.ids[obj] for obj in self.unindexed if (obj.position() - center).length() <= self.radius)
+        if self.occlusion:
+            oids = [oid for oid in oids if not self.occluded(walker, self.objects[oid])]
+        return oids
+
+    def occluded(self, walker, obj):
+        """
+        Whether static map geometry blocks the line of sight from the walker's head to the object.
+        """
+        if obj is walker:
+            return False
+        eye = walker.position() + walker.head_height
+        target = obj.position() + getattr(obj, 'head_height', Vec3(0, 0, 0))
+        if (target - eye).length() < self.grace_radius:
+            return False
+        result = self.world.physics.ray_test_closest(eye, target, MAP_COLLIDE_BIT)
+        if not result.has_hit():
+            return False
+        blocker = self.world.object_for_node(result.get_node())
+        # Map objects may be wrapped in effects; look through them for the underlying object.
+        while hasattr(blocker, 'effected'):
+            blocker = blocker.effected
+        return isinstance(blocker, (CompositeObject, StaticGeometry))
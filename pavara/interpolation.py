@@ -0,0 +1,133 @@
+"""
+Client-side smoothing of networked object motion.
+
+Snapshot states are buffered per object with the server time they were taken at. Objects are drawn slightly in
+the past, interpolating between the two buffered states around the render time, so a late or lost snapshot doesn't
+show up as a stutter. If the buffer runs dry, motion is extrapolated from the last known velocity for a short,
+bounded time and then held.
+"""
+
+INTERPOLATION_DELAY = 0.2
+MAX_EXTRAPOLATION = 0.25
+BUFFER_SIZE = 8
+CLOCK_SMOOTHING = 0.1
+CLOCK_RESYNC = 0.5
+
+
+def _lerp(a, b, t):
+    return tuple(x + (y - x) * t for x, y in zip(a, b))
+
+
+def _lerp_angles(a, b, t):
+    # Always go the short way around.
+    return tuple(x + (((y - x + 180.0) % 360.0) - 180.0) * t for x, y in zip(a, b))
+
+
+class SnapshotBuffer (object):
+    """
+    The last few (time, position, hpr) samples of one object, oldest first.
+    """
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.samples = []
+        self.settled = False
+
+    def add(self, time, pos, hpr):
+        if self.samples and time <= self.samples[-1][0]:
+            return
+        self.settled = False
+        self.samples.append((time, pos, hpr))
+        if len(self.samples) > self.size:
+            del self.samples[0]
+
+    def hold(self, time):
+        """
+        Records that the object was still where it last was at the given time.
+        """
+        if self.samples and time > self.samples[-1][0]:
+            last = self.samples[-1]
+            moving = len(self.samples) > 1 and self.samples[-2][1] != last[1]
+            settled = self.settled
+            self.add(time, last[1], last[2])
+            # An object at rest stays settled; one whose buffer ran dry mid-motion needs pulling back.
+            self.settled = settled and not moving
+
+    def sample(self, time, max_extrapolation=MAX_EXTRAPOLATION):
+        """
+        Returns (pos, hpr) at the given server time.
+        """
+        samples = self.samples
+        if time <= samples[0][0]:
+            return samples[0][1], samples[0][2]
+        for i in range(len(samples) - 1, 0, -1):
+            t0, p0, h0 = samples[i - 1]
+            t1, p1, h1 = samples[i]
+            if t0 <= time <= t1:
+                f = (time - t0) / (t1 - t0)
+                return _lerp(p0, p1, f), _lerp_angles(h0, h1, f)
+        t1, p1, h1 = samples[-1]
+        if len(samples) < 2:
+            return p1, h1
+        t0, p0, h0 = samples[-2]
+        ahead = min(time - t1, max_extrapolation)
+        f = ahead / (t1 - t0)
+        return _lerp(p1, tuple(2 * y - x for x, y in zip(p0, p1)), f), h1
+
+
+class Interpolator (object):
+    """
+    Buffers networked object states and works out where to draw each object each frame. Also keeps an estimate
+    of the offset between the server's clock and ours.
+    """
+
+    def __init__(self, delay=INTERPOLATION_DELAY, max_extrapolation=MAX_EXTRAPOLATION):
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.buffers = {}
+        self.offset = None
+
+    def sync_clock(self, server_time, local_time):
+        sample = server_time - local_time
+        if self.offset is None or abs(sample - self.offset) > CLOCK_RESYNC:
+            self.offset = sample
+        else:
+            self.offset += (sample - self.offset) * CLOCK_SMOOTHING
+
+    def add(self, oid, server_time, pos, hpr):
+        buf = self.buffers.get(oid)
+        if buf is None:
+            buf = self.buffers[oid] = SnapshotBuffer()
+        buf.add(server_time, pos, hpr)
+
+    def hold(self, server_time, oids):
+        """
+        Called with every object id in a complete snapshot. Objects that weren't sent were unchanged, so they
+        get a sample at their last state rather than being extrapolated.
+        """
+        for oid in oids:
+            buf = self.buffers.get(oid)
+            if buf:
+                buf.hold(server_time)
+
+    def remove(self, oid):
+        self.buffers.pop(oid, None)
+
+    def render_time(self, local_time):
+        return local_time + self.offset - self.delay
+
+    def sample(self, local_time):
+        """
+        Yields (id, pos, hpr) for every buffered object that may have moved at the current render time. Objects
+        past the end of their buffer are reported once more and then left alone.
+        """
+        if self.offset is None:
+            return
+        time = self.render_time(local_time)
+        for oid, buf in self.buffers.iteritems():
+            if buf.settled:
+                continue
+            if time >= buf.samples[-1][0] + self.max_extrapolation:
+                buf.settled = True
+            pos, hpr = buf.sample(time, self.max_extrapolation)
+            yield oid, pos, hpr
@@ -0,0 +1,144 @@
+"""
+Server-side lag compensation.
+
+A player aims at other walkers where their client draws them, which is some time in the past: the round trip plus
+the client's interpolation delay. The server keeps a short history of where every walker's hit shapes were, and
+tests shots against the walkers as that player saw them rather than as they are now.
+
+Rather than moving the walkers' physics nodes back in time (and having to put them back), each rewound test moves
+the projectile instead, by the inverse of how far the hit shape has moved since then, and tests it against the
+hit shape where it is now. The two are equivalent.
+"""
+from array import array
+from panda3d.core import Point3, Quat, TransformState
+
+# How far back shots can be rewound. Lag beyond this is the shooter's problem.
+MAX_REWIND = 0.5
+# Samples kept per walker; at 60 ticks a second this covers a little over MAX_REWIND.
+HISTORY_SIZE = 40
+# pos (3) + quat (4) per hit shape per sample.
+_FLOATS_PER_SHAPE = 7
+
+
+def _interpolate(a, b, t):
+    return a + (b - a) * t
+
+
+class TransformHistory (object):
+    """
+    A fixed-size ring buffer of the transforms of one walker's hit shapes, stored as flat arrays of floats so its
+    size stays put no matter how long the walker lives.
+    """
+
+    def __init__(self, nodes, size=HISTORY_SIZE):
+        self.nodes = nodes
+        self.size = size
+        self.stride = len(nodes) * _FLOATS_PER_SHAPE
+        self.times = array('d', [0.0] * size)
+        self.data = array('f', [0.0] * (size * self.stride))
+        self.head = 0
+        self.count = 0
+
+    def record(self, time, scene):
+        offset = self.head * self.stride
+        data = self.data
+        for np in self.nodes:
+            pos = np.get_pos(scene)
+            quat = np.get_quat(scene)
+            data[offset:offset + _FLOATS_PER_SHAPE] = array('f', (pos[0], pos[1], pos[2],
+                                                                  quat[0], quat[1], quat[2], quat[3]))
+            offset += _FLOATS_PER_SHAPE
+        self.times[self.head] = time
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def _slot(self, age):
+        # age 0 is the newest sample.
+        return (self.head - 1 - age) % self.size
+
+    def _transforms(self, slot_a, slot_b, t):
+        result = []
+        a = slot_a * self.stride
+        b = slot_b * self.stride
+        data = self.data
+        for i in xrange(len(self.nodes)):
+            pos = Point3(*[_interpolate(data[a + k], data[b + k], t) for k in xrange(3)])
+            quat = Quat(*[_interpolate(data[a + k], data[b + k], t) for k in xrange(3, 7)])
+            quat.normalize()
+            result.append(TransformState.make_pos_quat_scale(pos, quat, (1, 1, 1)))
+            a += _FLOATS_PER_SHAPE
+            b += _FLOATS_PER_SHAPE
+        return result
+
+    def sample(self, time):
+        """
+        Returns the list of the hit shapes' transforms (relative to the scene) at the given time, or None if
+        there's no history yet. Times older than the history are clamped to the oldest sample.
+        """
+        if not self.count:
+            return None
+        newer = self._slot(0)
+        if time >= self.times[newer]:
+            return self._transforms(newer, newer, 0.0)
+        for age in xrange(1, self.count):
+            older = self._slot(age)
+            if self.times[older] <= time:
+                span = self.times[newer] - self.times[older]
+                t = (time - self.times[older]) / span if span > 0 else 0.0
+                return self._transforms(older, newer, t)
+            newer = older
+        return self._transforms(newer, newer, 0.0)
+
+
+class LagCompensator (object):
+    """
+    Records walker hit shape histories every server tick, and runs projectile hit tests against the past.
+    """
+
+    def __init__(self, world, size=HISTORY_SIZE, max_rewind=MAX_REWIND):
+        self.world = world
+        self.size = size
+        self.max_rewind = max_rewind
+        self.histories = {}
+        self.time = 0.0
+
+    def record(self, time, walkers):
+        self.time = time
+        scene = self.world.scene
+        current = {}
+        for walker in walkers:
+            history = self.histories.get(walker)
+            if history is None:
+                history = TransformHistory(walker.hit_nodes, self.size)
+            history.record(time, scene)
+            current[walker] = history
+        # Walkers that have gone away take their history with them.
+        self.histories = current
+
+    def rewound_hits(self, projectile, lag):
+        """
+        Returns (walker, manifold point) for each walker other than its shooter the projectile would be touching
+        were the walkers where they were lag seconds ago.
+        """
+        physics = self.world.physics
+        scene = self.world.scene
+        lag = min(lag, self.max_rewind)
+        node = projectile.node
+        saved = node.get_transform(scene)
+        hits = []
+        for walker, history in self.histories.iteritems():
+            if walker is projectile.shooter:
+                continue
+            past = history.sample(self.time - lag)
+            if not past:
+                continue
+            for i, np in enumerate(history.nodes):
+                # Where the projectile would be relative to the shape now, were the shape where it was then.
+                now = np.get_transform(scene)
+                node.set_transform(scene, now.compose(past[i].invert_compose(saved)))
+                contacts = physics.contact_test_pair(projectile.solid, np.node()).get_contacts()
+                if contacts:
+                    hits.append((walker, contacts[0].get_manifold_point()))
+                    break
+        node.set_transform(scene, saved)
+        return hits
@@ -4,10 +4,13 @@ from pavara.walker import Walker
 from pavara.keymaps import KeyMaps
 from pavara.map_objects import Block 
 from pavara.effects import FreeSolid
+from pavara.inputs import BUTTON_COMMANDS, FIRE_COMMANDS, InputFrame, apply_input
 
 
 class LocalPlayer (object):
-    def __init__(self, mapobj, showbase):
+    def __init__(self, mapobj, showbase, client=None):
+        self.client = client
+        self.buttons = 0
         self.x = None
         self.y = None
         self.win = showbase.win
@@ -28,7 +31,11 @@ class LocalPlayer (object):
             "body_primary_color": [44.0/255, 31.0/255, 54.0/255],
             "body_secondary_color": [80.0/255, 44.0/255, 62.0/255]
         }
-        self.walker = self.map.world.attach(Walker(incarn, colordict=walker_color_dict, player=True))
+        if client:
+            # The server hands us our walker once we've connected.
+            self.walker = None
+        else:
+            self.walker = self.map.world.attach(Walker(incarn, colordict=walker_color_dict, player=True))
         taskMgr.add(self.move, 'move')
 
     def setup_input(self):
@@ -98,20 +105,26 @@ class LocalPlayer (object):
             print "CAMERA: Pos - %s, Hpr - %s" % (self.camera.get_pos(), self.camera.get_hpr())
             self.key_map['print_cam'] = 0
 
-        self.walker.handle_command('forward', self.key_map['forward'])
-        self.walker.handle_command('left', self.key_map['left'])
-        self.walker.handle_command('backward', self.key_map['backward'])
-        self.walker.handle_command('right', self.key_map['right'])
-        self.walker.handle_command('crouch', self.key_map['crouch'])
+        if self.client:
+            self.walker = self.client.walker
+        if not self.walker:
+            return task.cont
+
+        buttons = 0
+        for bit, key in BUTTON_COMMANDS:
+            if self.key_map[key]:
+                buttons |= bit
+        fire = 0
+        for bit, key in FIRE_COMMANDS:
+            if self.key_map[key]:
+                fire |= bit
+                self.key_map[key] = 0
 
-        self.walker.handle_command('fire', self.key_map['fire'])
-        if self.key_map['fire']: self.key_map['fire'] = 0
-        self.walker.handle_command('missile', self.key_map['missile'])
-        if self.key_map['missile']: self.key_map['missile'] = 0
-        self.walker.handle_command('grenade_fire', self.key_map['grenade_fire'])
-        if self.key_map['grenade_fire']: self.key_map['grenade_fire'] = 0
-        self.walker.handle_command('grenade', self.key_map['grenade'])
-        if self.key_map['grenade']: self.key_map['grenade'] = 0
+        if self.client:
+            self.client.input(dt, buttons, fire)
+        else:
+            apply_input(self.walker, self.buttons, InputFrame(0, dt, buttons, fire))
+        self.buttons = buttons
 
         return task.cont
 
@@ -0,0 +1,168 @@
+"""
+Compiled maps.
+
+Parsing a map's XML is quick; building its geometry with GeomBuilder and its collision hulls from that geometry is
+what makes loading one slow. So the first time a map file is loaded, the finished node and physics shapes of each of
+its pieces are saved to a BAM file in the cache directory, named after a hash of the map file, and later loads of
+the same file read them back in one go instead of building anything. Compiled maps are also kept in memory, so
+going back to a map that has already been played doesn't touch the disk at all.
+
+Pieces are numbered in the order the map creates them, which is the same every time the same file is read. Only
+pieces whose class is marked compilable are cached; anything else is still built normally.
+"""
+import hashlib
+import os
+from panda3d.core import BamFile, Filename, GeomNode, NodePath, Vec3
+from panda3d.bullet import BulletBoxShape, BulletConvexHullShape, BulletRigidBodyNode
+from pavara.base_objects import solid_shapes
+from pavara.effects import Effect
+
+MAP_CACHE_DIR = 'Cache'
+# Bump this whenever the geometry or shapes built for map pieces change, so stale compiled maps aren't used.
+CACHE_VERSION = 2
+
+
+class CompiledMap (object):
+    """
+    The saved nodes and shapes of a map file's pieces. A new one records pieces as they are built; one read from
+    the cache hands them back out.
+    """
+
+    def __init__(self, key, root=None):
+        self.key = key
+        self.recording = root is None
+        self.root = NodePath('compiled') if root is None else root
+        self.entries = dict((entry.get_name(), entry) for entry in self.root.get_children())
+        self.count = 0
+
+    def next_index(self):
+        self.count += 1
+        return self.count
+
+    def entry(self, index):
+        entry = self.entries.get(str(index))
+        if entry is None and self.recording:
+            entry = self.entries[str(index)] = self.root.attach_new_node(str(index))
+        return entry
+
+    def record_node(self, index, node):
+        node.copy_to(self.entry(index).attach_new_node('node'))
+
+    def record_solid(self, index, solid):
+        shapes = self.entry(index).attach_new_node('solid')
+        for kind, value, xform in solid_shapes(solid):
+            if kind == 'box':
+                shape = shapes.attach_new_node('box')
+                shape.set_tag('half_extents', ' '.join(repr(v) for v in value))
+            else:
+                geom_node = GeomNode('hull')
+                geom_node.add_geom(value)
+                shape = shapes.attach_new_node(geom_node)
+            shape.set_transform(xform)
+
+    def load_node(self, index):
+        entry = self.entry(index)
+        if entry is None or entry.find('node').is_empty():
+            return None
+        return entry.find('node').get_child(0).copy_to(NodePath())
+
+    def load_solid(self, index, name):
+        entry = self.entry(index)
+        if entry is None or entry.find('solid').is_empty():
+            return None
+        node = BulletRigidBodyNode(name)
+        for shape in entry.find('solid').get_children():
+            if shape.get_name() == 'box':
+                half_extents = [float(v) for v in shape.get_tag('half_extents').split()]
+                node.add_shape(BulletBoxShape(Vec3(*half_extents)), shape.get_transform())
+            else:
+                mesh = BulletConvexHullShape()
+                mesh.add_geom(shape.node().get_geom(0))
+                node.add_shape(mesh, shape.get_transform())
+        return node
+
+
+class Compiled (Effect):
+    """
+    Wraps a map piece so its node and solid come from a CompiledMap, or are recorded into it the first time.
+    """
+
+    def __init__(self, effected, compiled_map, index):
+        Effect.__init__(self, effected, lambda effected: Compiled(effected, compiled_map, index))
+        self.compiled_map = compiled_map
+        self.compiled_index = index
+
+    def create_node(self):
+        node = None if self.compiled_map.recording else self.compiled_map.load_node(self.compiled_index)
+        if node is None:
+            node = self.effected.create_node()
+            if node is not None and self.compiled_map.recording:
+                self.compiled_map.record_node(self.compiled_index, node)
+        return node
+
+    def create_solid(self):
+        solid = None if self.compiled_map.recording else self.compiled_map.load_solid(self.compiled_index, self.name)
+        if solid is None:
+            solid = self.effected.create_solid()
+            if solid is not None and self.compiled_map.recording:
+                self.compiled_map.record_solid(self.compiled_index, solid)
+        return solid
+
+
+class MapCache (object):
+
+    def __init__(self, directory=MAP_CACHE_DIR):
+        self.directory = directory
+        self.compiled = {}
+
+    def open(self, path):
+        """
+        Returns the CompiledMap for the map file at path: one already in memory, one read from the cache
+        directory, or a new one to record into if the file hasn't been compiled.
+        """
+        with open(path, 'rb') as f:
+            key = hashlib.sha1('%d:%s' % (CACHE_VERSION, f.read())).hexdigest()
+        compiled = self.compiled.get(key)
+        if compiled:
+            return compiled
+        root = self.read(self.cache_path(key))
+        return CompiledMap(key, root)
+
+    def finish(self, compiled):
+        """
+        Called once a map file has been loaded through compiled. Saves it if it was being recorded.
+        """
+        if compiled.recording:
+            self.write(self.cache_path(compiled.key), compiled.root)
+            compiled.recording = False
+        compiled.count = 0
+        self.compiled[compiled.key] = compiled
+
+    def cache_path(self, key):
+        return os.path.join(self.directory, key + '.bam')
+
+    def read(self, path):
+        if not os.path.exists(path):
+            return None
+        bam = BamFile()
+        if not bam.open_read(Filename.from_os_specific(path)):
+            return None
+        node = bam.read_node()
+        bam.close()
+        if node is None:
+            print 'COMPILED MAP %s IS UNREADABLE, REBUILDING' % path
+            return None
+        return NodePath(node)
+
+    def write(self, path, root):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        except OSError, e:
+            print 'COULD NOT CREATE MAP CACHE %s: %s' % (self.directory, e)
+            return
+        if not root.write_bam_file(Filename.from_os_specific(path)):
+            print 'COULD NOT WRITE COMPILED MAP %s' % path
+
+
+map_cache = MapCache()
@@ -1,9 +1,8 @@
 from pavara.base_objects import *
 from pavara.utils.geom import GeomBuilder, to_cartesian
 from panda3d.core import Shader, NodePath, LRotationf, LRotation, TransformState, Point2, Point3, Vec2, Vec3
-from pavara.assets import load_model
+from pavara.assets import load_model, load_actor, load_sound
 from panda3d.bullet import BulletBoxShape, BulletGhostNode, BulletSphereShape, BulletPlaneShape, BulletRigidBodyNode, BulletConvexHullShape
-from direct.actor.Actor import Actor
 import math
 
 class Block (PhysicalObject):
@@ -11,6 +10,8 @@ class Block (PhysicalObject):
     A block.
     """
 
+    compilable = True
+
     def __init__(self, size, color, mass, center, hpr, name=None):
         super(Block, self).__init__(name)
         self.size = size
@@ -24,11 +25,11 @@ class Block (PhysicalObject):
 
     def create_solid(self):
         node = BulletRigidBodyNode(self.name)
-        node.add_shape(BulletBoxShape(Vec3(self.size[0] / 2.0, self.size[1] / 2.0, self.size[2] / 2.0)))
+        add_box(node, (self.size[0] / 2.0, self.size[1] / 2.0, self.size[2] / 2.0))
         return node
 
     def add_solid(self, node):
-        node.add_shape(BulletBoxShape(Vec3(self.size[0] / 2.0, self.size[1] / 2.0, self.size[2] / 2.0)), TransformState.make_pos_hpr(Point3(*self.center), self.hpr))
+        add_box(node, (self.size[0] / 2.0, self.size[1] / 2.0, self.size[2] / 2.0), TransformState.make_pos_hpr(Point3(*self.center), self.hpr))
 
     def add_to(self, geom_builder):
         rot = LRotationf()
@@ -44,6 +45,8 @@ class Ramp (PhysicalObject):
     A ramp.
     """
 
+    compilable = True
+
     def __init__(self, base, top, width, thickness, color, mass, hpr, name=None):
         super(Ramp, self).__init__(name)
         self.base = Point3(*base)
@@ -63,15 +66,11 @@ class Ramp (PhysicalObject):
 
     def create_solid(self):
         node = BulletRigidBodyNode(self.name)
-        mesh = BulletConvexHullShape()
-        mesh.add_geom(self.geom.get_geom(0))
-        node.add_shape(mesh)
+        add_hull(node, self.geom.get_geom(0))
         return node
 
     def add_solid(self, node):
-        mesh = BulletConvexHullShape()
-        mesh.add_geom(GeomBuilder().add_ramp(self.color, self.base, self.top, self.width, self.thickness, LRotationf(*self.hpr)).get_geom())
-        node.add_shape(mesh)
+        add_hull(node, GeomBuilder().add_ramp(self.color, self.base, self.top, self.width, self.thickness, LRotationf(*self.hpr)).get_geom())
         return node
 
     def add_to(self, geom_builder):
@@ -86,6 +85,8 @@ class Wedge (PhysicalObject):
     Ramps with some SERIOUS 'tude.
     """
 
+    compilable = True
+
     def __init__(self, base, top, width, color, mass, hpr, name=None):
         super(Wedge, self).__init__(name)
         self.base = Point3(*base)
@@ -104,15 +105,11 @@ class Wedge (PhysicalObject):
 
     def create_solid(self):
         node = BulletRigidBodyNode(self.name)
-        mesh = BulletConvexHullShape()
-        mesh.add_geom(self.geom.get_geom(0))
-        node.add_shape(mesh)
+        add_hull(node, self.geom.get_geom(0))
         return node
 
     def add_solid(self, node):
-        mesh = BulletConvexHullShape()
-        mesh.add_geom(GeomBuilder().add_wedge(self.color, self.base, self.top, self.width, LRotationf(*self.hpr)).get_geom())
-        node.add_shape(mesh)
+        add_hull(node, GeomBuilder().add_wedge(self.color, self.base, self.top, self.width, LRotationf(*self.hpr)).get_geom())
         return node
 
     def add_to(self, geom_builder):
@@ -128,6 +125,8 @@ class BlockRamp (PhysicalObject):
     rotated, and specified differently in XML. Should maybe be a Block subclass?
     """
 
+    compilable = True
+
     def __init__(self, base, top, width, thickness, color, mass, hpr, name=None):
         super(BlockRamp, self).__init__(name)
         self.base = Point3(*base)
@@ -232,11 +231,11 @@ class BlockRamp (PhysicalObject):
 
     def create_solid(self):
         node = BulletRigidBodyNode(self.name)
-        node.add_shape(BulletBoxShape(Vec3(self.thickness / 2.0, self.width / 2.0, self.length / 2.0)))
+        add_box(node, (self.thickness / 2.0, self.width / 2.0, self.length / 2.0))
         return node
 
     def add_solid(self, node):
-        node.add_shape(BulletBoxShape(Vec3(self.thickness / 2.0, self.width / 2.0, self.length / 2.0)), TransformState.make_pos_hpr(Point3(*self.midpoint), self.hpr))
+        add_box(node, (self.thickness / 2.0, self.width / 2.0, self.length / 2.0), TransformState.make_pos_hpr(Point3(*self.midpoint), self.hpr))
 
     def add_to(self, geom_builder):
         # honestly i don't understand this at all
@@ -265,6 +264,8 @@ class Dome (PhysicalObject):
     A dome.
     """
 
+    compilable = True
+
     def __init__(self, radius, samples, planes, color, mass, center, hpr, name=None):
         super(Dome, self).__init__(name)
         self.radius = radius
@@ -281,15 +282,11 @@ class Dome (PhysicalObject):
 
     def create_solid(self):
         node = BulletRigidBodyNode(self.name)
-        mesh = BulletConvexHullShape()
-        mesh.add_geom(self.geom.get_geom(0))
-        node.add_shape(mesh)
+        add_hull(node, self.geom.get_geom(0))
         return node
 
     def add_solid(self, node):
-        mesh = BulletConvexHullShape()
-        mesh.add_geom(GeomBuilder().add_dome(self.color, self.center, self.radius, self.samples, self.planes, LRotationf(*self.hpr)).get_geom())
-        node.add_shape(mesh)
+        add_hull(node, GeomBuilder().add_dome(self.color, self.center, self.radius, self.samples, self.planes, LRotationf(*self.hpr)).get_geom())
         return node
 
     def add_to(self, geom_builder):
@@ -300,6 +297,13 @@ class Dome (PhysicalObject):
         self.move(self.center)
         self.rotate_by(*self.hpr)
 
+# The model file for each kind of goody, by the name maps give it. Anything else is drawn as a cube.
+GOODY_MODELS = {
+    'Grenade': 'grenade.egg',
+    'Missile': 'missile.egg',
+    None: 'misc/rgbCube',
+}
+
 class Goody (PhysicalObject):
     def __init__(self, pos, model, items, respawn, spin, name=None):
         super(Goody, self).__init__(name)
@@ -317,7 +321,7 @@ class Goody (PhysicalObject):
 
     def create_node(self):
         if self.model == "Grenade":
-            m = Actor('grenade.egg')
+            m = load_actor(GOODY_MODELS['Grenade'])
             shell = m.find('**/shell')
             shell.setColor(1,.3,.3,1)
             inner_top = m.find('**/inner_top')
@@ -328,7 +332,7 @@ class Goody (PhysicalObject):
             m.set_scale(GRENADE_SCALE)
 
         elif self.model == "Missile":
-            m = load_model('missile.egg')
+            m = load_model(GOODY_MODELS['Missile'])
             body = m.find('**/bodywings')
             body.set_color(.3,.3,1,1)
             main_engines = m.find('**/mainengines')
@@ -337,7 +341,7 @@ class Goody (PhysicalObject):
             wing_engines.set_color(.1,.1,.1,1)
             m.set_scale(MISSILE_SCALE)
         else:
-            m = load_model('misc/rgbCube')
+            m = load_model(GOODY_MODELS[None])
             m.set_scale(.5)
             m.set_hpr(45,45,45)
         return m
@@ -367,14 +371,12 @@ class Goody (PhysicalObject):
             self.spin_bone.set_hpr(self.spin_bone, self.spin[2]*dt, self.spin[1]*dt, self.spin[0]*dt)
         else:
             self.rotate_by(*[x * dt for x in self.spin])
-        result = self.world.physics.contact_test(self.solid)
-        for contact in result.getContacts():
-            node_1 = contact.getNode0()
-            node_2 = contact.getNode1()
-            if "Walker" in node_2.get_name():
-               # TODO: identify which player and credit them with the items.
-               self.active = False
-               self.node.hide()
+
+    def collision(self, other, manifold, first):
+        if self.active and other.flags & WALKER_FLAG:
+            # TODO: identify which player and credit them with the items.
+            self.active = False
+            self.node.hide()
 
 class Sky (WorldObject):
     """
@@ -433,6 +435,9 @@ class Ground (PhysicalObject):
     The ground. This is not a visible object, but does create a physical solid.
     """
 
+    flags = UNPUSHABLE_FLAG
+    indexed = False
+
     def __init__(self, radius, color, name=None):
         super(Ground, self).__init__(name)
         self.color = color
@@ -446,8 +451,15 @@ class Ground (PhysicalObject):
         self.move((0, -1.0, 0))
         # We need to tell the sky shader what color we are.
         self.world.sky.set_ground(self.color)
+        # Shards with nothing else under them bounce off us; the plane is a unit above the node.
+        debris = getattr(self.world, 'debris', None)
+        if debris:
+            debris.ground = self.node.get_y(self.world.scene) + 1
 
 class Incarnator (PhysicalObject):
+
+    flags = INCARNATOR_FLAG
+
     def __init__(self, pos, heading, name=None):
         super(Incarnator, self).__init__(name)
         self.pos = Vec3(*pos)
@@ -457,7 +469,7 @@ class Incarnator (PhysicalObject):
         self.dummy_node = self.world.scene.attach_new_node("incarnator"+self.name)
         self.dummy_node.set_pos(self.world.scene, self.pos)
         if self.world.audio3d:
-            self.sound = self.world.audio3d.loadSfx('Sounds/incarnation_mono.wav')
+            self.sound = load_sound(self.world.audio3d, 'Sounds/incarnation_mono.wav')
         else: self.sound = False
 
     def was_used(self):
@@ -2,8 +2,9 @@ from pavara.utils import drill
 from pavara.map_objects import *
 from pavara.effects import *
 from pavara.world import World
+from pavara.assets import GAME_MODELS, GAME_SOUNDS
+from pavara.map_cache import Compiled, map_cache
 from panda3d.core import ColorAttrib
-import random
 import math
 
 def parse_int(s, default=0):
@@ -45,7 +46,8 @@ class Map (object):
     has_celestials = False
     effects = []
 
-    def __init__(self, root, world):
+    def __init__(self, root, world, compiled=None):
+        self.compiled = compiled
         self.name = root['name'] or 'Untitled Map'
         self.author = root['author'] or 'Unknown Author'
         self.tagline = root['tagline']
@@ -114,6 +116,9 @@ class Map (object):
         self.effects.pop()
 
     def wrap_object(self, obj):
+        # Pieces of a static object are only drawn and collided with as part of it, so only it gets compiled.
+        if self.compiled and obj.compilable and isinstance(self.world, World):
+            obj = Compiled(obj, self.compiled, self.compiled.next_index())
         for effect in reversed(self.effects):
             obj = effect(obj)
         return obj
@@ -225,56 +230,32 @@ class Map (object):
             max_size = parse_float(child['maxSize'], 1.0)
             mode = child['mode'] or 'default'
             mode = mode.strip().lower()
-            min_r = min_color[0]
-            delta_r = max_color[0] - min_r
-            min_g = min_color[1]
-            delta_g = max_color[1] - min_g
-            min_b = min_color[2]
-            delta_b = max_color[2] - min_b
-            delta_size = max_size - min_size
-            two_pi = math.pi * 2
-            half_pi = math.pi / 2
-            if seed:
-                random.seed(seed)
-            for s in range(count):
-                theta = two_pi * random.random()
-                phi = abs(half_pi - math.acos(random.random()))
-                if mode == 'realistic':
-                    star_type = random.randint(0,2)
-                    if star_type == 0: # white star
-                        r = g = b = 1
-                    elif star_type == 1: # orange/yellow
-                        r = 1
-                        g = 0.5 + random.random() * 0.5
-                        b = g / 2
-                    elif star_type == 2: # blue
-                        b = 1
-                        g = b * (1 - random.random() * 0.30)
-                        r = g * (1 - random.random() * 0.30)
-                elif mode == 'monochrome':
-                    dice = random.random()
-                    r = min_r + dice * delta_r
-                    g = min_g + dice * delta_g
-                    b = min_b + dice * delta_b
-                else:
-                    r = min_r + random.random() * delta_r
-                    g = min_g + random.random() * delta_g
-                    b = min_b + random.random() * delta_b
-                color = (r, g, b, 1 - (1 - phi/math.pi)**6)
-                size = min_size + random.random() * delta_size
-                self.world.add_celestial(theta, phi, color, 0, size, True)
-            # Reset the seed.
-            random.seed()
-
-def load_maps(path, world):
+            self.world.add_starfield(seed, count, min_color, max_color, min_size, max_size, mode)
+
+def map_assets(path):
+    """
+    Given a path to an XML file, returns the models and sounds a game on its maps will need, for preloading.
+    """
+    root = drill.parse(path)
+    models = set(GAME_MODELS)
+    for node in root.iter('goody'):
+        models.add(GOODY_MODELS.get(node['model'], GOODY_MODELS[None]))
+    return sorted(models), list(GAME_SOUNDS)
+
+def load_maps(path, world, cache=map_cache):
     """
-    Given a path to an XML file and the world, returns a list of parsed/populated Map objects.
+    Given a path to an XML file and the world, returns a list of parsed/populated Map objects. Map geometry comes
+    from the given MapCache when the file has been compiled before (pass cache=None to always build it).
     """
     root = drill.parse(path)
+    compiled = cache.open(path) if cache else None
     if root.tagname.lower() == 'map':
-        return [Map(root, world)]
+        maps = [Map(root, world, compiled)]
     else:
         maps = []
         for map_root in root.find('map'):
-            maps.append(Map(map_root, world))
-        return maps
+            maps.append(Map(map_root, world, compiled))
+    if cache:
+        cache.finish(compiled)
+    world.batch_static()
+    return maps
@@ -8,78 +8,250 @@ from direct.distributed.PyDatagramIterator import PyDatagramIterator
 #from direct.gui.DirectGui import *
 import random
 
+from pavara.constants import UDP_PORT, WALKER_FLAG
+from pavara.base_objects import PhysicalObject
+from pavara.interest import InterestManager
+from pavara.snapshots import SnapshotHistory, SnapshotReceiver, dequantize
+from pavara.interpolation import Interpolator
+from pavara.prediction import Predictor
+from pavara.inputs import INPUT_REDUNDANCY, MAX_FRAME_DT, apply_input, pack_frames, unpack_frames
+from pavara.transport import PandaTransport, EVENT_CONNECT, EVENT_DISCONNECT, EVENT_UDP
 from pavara.walker import Walker
 
+# Every datagram starts with one of these. Object introductions go over the reliable TCP connection, everything
+# else over UDP. Datagrams from clients carry the token they were welcomed with, since anyone can claim a player id.
+MSG_WELCOME = 1   # server -> client (tcp): player id, token, walker name
+MSG_OBJECT = 2    # server -> client (tcp): object id, kind flags, object name
+MSG_HELLO = 4     # client -> server (udp): player id, token
+MSG_SNAPSHOT = 5  # server -> client (udp): one fragment of a delta-encoded snapshot
+MSG_ACK = 6       # client -> server (udp): player id, token, snapshot sequence
+MSG_INPUT = 7     # client -> server (udp): player id, token, the latest few input frames (see pavara.inputs)
+MSG_STATE = 8     # server -> client (udp): last input sequence applied, the player's walker's motion state
+
+# Message type, player id and token.
+CLIENT_HEADER_SIZE = 7
+
+# Seconds between snapshots. Clients interpolate between them, so this can be fairly coarse.
+SNAPSHOT_INTERVAL = 0.1
+
+# Input frames a player can have waiting before the oldest are dropped.
+INPUT_QUEUE_LIMIT = 60
+# Seconds of input a player can have banked beyond the time that has really passed, to ride out network jitter.
+INPUT_TIME_SLACK = 0.25
+
+RELEVANCE_SELF = 1000.0
+RELEVANCE_WALKER_FACTOR = 4.0
+
 class Player (object):
-    def __init__(self, pid, walker):
+    def __init__(self, pid, walker, session):
         self.pid = pid
         self.walker = walker
+        self.session = session
+        # A secret shared with the player's client over TCP, which its UDP datagrams have to repeat.
+        self.token = random.SystemRandom().getrandbits(32)
+        self.address = None
+        self.snapshots = SnapshotHistory()
+        self.last_input = 0
+        self.inputs = []
+        self.buttons = 0
+        # How much simulated time the player's inputs may still use up, and when that was last topped up.
+        self.input_time = INPUT_TIME_SLACK
+        self.input_clock = None
+        # The player's client predicts their walker's movement, and feeds us the inputs to move it by.
+        walker.input_driven = True
 
     def __repr__(self):
         return 'Player %s' % self.pid
 
-    def handle_command(self, direction, pressed):
-        print 'PLAYER %s GOT CMD %s %s' % (self.pid, direction, pressed)
-        self.walker.handle_command(direction, pressed)
+    def queue_inputs(self, frames):
+        """
+        Queues the frames we haven't seen yet from a redundant batch, newest first.
+        """
+        newest = self.inputs[-1].seq if self.inputs else self.last_input
+        fresh = [f for f in frames if f.seq > newest]
+        fresh.reverse()
+        self.inputs.extend(fresh)
+        if len(self.inputs) > INPUT_QUEUE_LIMIT:
+            del self.inputs[:-INPUT_QUEUE_LIMIT]
+
+    def consume_inputs(self):
+        """
+        Moves the walker by every input frame that has arrived since the last tick, in order. Altogether, the frames
+        can't move it for longer than has really gone by, whatever their own times say.
+        """
+        now = globalClock.getFrameTime()
+        if self.input_clock is not None:
+            self.input_time = min(self.input_time + now - self.input_clock, INPUT_TIME_SLACK + MAX_FRAME_DT)
+        self.input_clock = now
+        for frame in self.inputs:
+            # The client draws everything else at view_time on our clock; shots it fires are tested against then.
+            if frame.view_time > 0:
+                self.walker.view_lag = max(0.0, now - frame.view_time)
+            apply_input(self.walker, self.buttons, frame)
+            dt = min(max(frame.dt, 0.0), MAX_FRAME_DT, self.input_time)
+            self.input_time -= dt
+            self.walker.simulate(dt)
+            self.buttons = frame.buttons
+            self.last_input = frame.seq
+        self.inputs = []
 
 class Server (object):
-    def __init__(self, world, port):
+    def __init__(self, world, port, udp_port=UDP_PORT, occlusion=False, transport=None, film=None):
         self.world = world
-        self.manager = QueuedConnectionManager()
-        self.listener = QueuedConnectionListener(self.manager, 0)
-        self.reader = QueuedConnectionReader(self.manager, 0)
-        self.writer = ConnectionWriter(self.manager, 0)
-        self.connections = []
+        self.film = film
+        self.interest = InterestManager(world, occlusion=occlusion)
+        self.transport = transport or PandaTransport(port, udp_port)
         self.players = {}
+        self.players_by_pid = {}
         self.last_pid = 0
-        sock = self.manager.openTCPServerRendezvous(port, 1000)
-        self.listener.addConnection(sock)
-        taskMgr.doMethodLater(0.05, self.server_task, 'serverManagementTask')
+        # Networked objects go by their world handles; these are the ones clients have been told about.
+        self.introduced = {}
+        self.snapshot_seq = 0
+        self.snapshot_objects = {}
+        taskMgr.add(self.server_task, 'serverManagementTask')
+        taskMgr.doMethodLater(SNAPSHOT_INTERVAL, self.snapshot_task, 'serverSnapshotTask')
 
     def server_task(self, task):
-        if self.listener.newConnectionAvailable():
-            rendezvous = PointerToConnection()
-            netAddress = NetAddress()
-            newConnection = PointerToConnection()
-            if self.listener.getNewConnection(rendezvous, netAddress, newConnection):
-                print 'GOT CONNECTION FROM', netAddress
-                newConnection = newConnection.p()
-                newConnection.setNoDelay(True)
-                self.connections.append(newConnection)
-                self.reader.addConnection(newConnection)
+        for event, who, data in self.transport.poll():
+            if event == EVENT_UDP:
+                # Every datagram starts with its message type, the sender's pid and token; anything shorter is noise.
+                if len(data) < CLIENT_HEADER_SIZE:
+                    continue
+                dataIter = PyDatagramIterator(PyDatagram(data))
+                self.handle_udp(dataIter.getUint8(), dataIter, who, data)
+            elif event == EVENT_CONNECT:
+                print 'GOT CONNECTION FROM', who
                 self.last_pid += 1
-                self.players[netAddress.getIpString()] = Player(self.last_pid, self.world.create_walker())
-        while self.manager.resetConnectionAvailable():
-            connPointer = PointerToConnection()
-            self.manager.getResetConnection(connPointer)
-            connection = connPointer.p()
-            print 'LOST CONNECTION FROM', connection
-            # Remove the connection we just found to be "reset" or "disconnected"
-            self.reader.removeConnection(connection)
-            # Loop through the activeConnections till we find the connection we just deleted
-            # and remove it from our activeConnections list
-            for idx in range(0, len(self.connections)):
-                if self.connections[idx] == connection:
-                    del self.connections[idx]
-                    break
-        while self.reader.dataAvailable():
-            datagram = NetDatagram()
-            if self.reader.getData(datagram):
-                conn = datagram.getConnection()
-                dataIter = PyDatagramIterator(datagram)
-                addr = conn.getAddress()
-                player = self.players[addr.getIpString()]
-                player.handle_command(dataIter.getString(), dataIter.getBool())
-        update = PyDatagram()
-        update.addInt8(len([o for o in self.world.updatables if o.moved]))
-        for obj in self.world.updatables:
-            obj.add_update(update)
-        for conn in self.connections:
-            self.writer.send(update, conn)
+                player = Player(self.last_pid, self.world.create_walker(), who)
+                self.players[who] = player
+                self.players_by_pid[player.pid] = player
+                self.welcome(player)
+            elif event == EVENT_DISCONNECT:
+                print 'LOST CONNECTION FROM', who
+                player = self.players.pop(who, None)
+                if player:
+                    del self.players_by_pid[player.pid]
+        for player in self.players_by_pid.itervalues():
+            if self.film:
+                now = globalClock.getFrameTime()
+                for frame in player.inputs:
+                    self.film.input(now, player.pid, frame)
+            player.consume_inputs()
+        return task.cont
+
+    def snapshot_task(self, task):
+        self.send_snapshots()
         return task.again
 
+    def handle_udp(self, msg, dataIter, address, data):
+        player = self.players_by_pid.get(dataIter.getUint16())
+        if not player or dataIter.getUint32() != player.token:
+            return
+        player.address = address
+        if msg == MSG_ACK and len(data) >= CLIENT_HEADER_SIZE + 4:
+            player.snapshots.ack(dataIter.getUint32())
+        elif msg == MSG_INPUT:
+            frames = unpack_frames(data, CLIENT_HEADER_SIZE)
+            if frames is not None:
+                player.queue_inputs(frames)
+
+    def welcome(self, player):
+        datagram = PyDatagram()
+        datagram.addUint8(MSG_WELCOME)
+        datagram.addUint16(player.pid)
+        datagram.addUint32(player.token)
+        datagram.addString(player.walker.name)
+        self.transport.send(player.session, datagram.getMessage())
+        for oid, obj in self.introduced.iteritems():
+            self.transport.send(player.session, self.object_datagram(oid, obj).getMessage())
+
+    def object_datagram(self, oid, obj):
+        datagram = PyDatagram()
+        datagram.addUint8(MSG_OBJECT)
+        datagram.addUint16(oid)
+        datagram.addUint16(obj.flags)
+        datagram.addString(obj.name)
+        return datagram
+
+    def gather_snapshot(self):
+        """
+        Collects the quantized state of every networked object, keyed by object id (its world handle). Objects
+        that have gone away are forgotten, and new objects are introduced to every client.
+        """
+        current = {}
+        self.snapshot_objects = {}
+        for obj in self.world.updatables:
+            if not isinstance(obj, PhysicalObject) or not obj.node:
+                continue
+            oid = obj.handle
+            if self.introduced.get(oid) is not obj:
+                self.introduced[oid] = obj
+                introduction = self.object_datagram(oid, obj).getMessage()
+                for session in self.players:
+                    self.transport.send(session, introduction)
+                if self.film:
+                    self.film.introduce(globalClock.getFrameTime(), oid, obj.name, obj.flags)
+            current[oid] = obj.snapshot_state()
+            self.snapshot_objects[oid] = obj
+        for oid in self.introduced.keys():
+            if oid not in current:
+                del self.introduced[oid]
+        return current
+
+    def relevance(self, player, oids):
+        """
+        Scores how much each of the given networked objects matters to the given player: their own walker above
+        all, then other walkers, then everything else, falling off with distance.
+        """
+        center = player.walker.position()
+        scores = {}
+        for oid in oids:
+            obj = self.snapshot_objects[oid]
+            if obj is player.walker:
+                scores[oid] = RELEVANCE_SELF
+                continue
+            score = 1.0 / (1.0 + (obj.position() - center).length())
+            if isinstance(obj, Walker):
+                score *= RELEVANCE_WALKER_FACTOR
+            scores[oid] = score
+        return scores
+
+    def send_snapshots(self):
+        self.snapshot_seq += 1
+        now = globalClock.getFrameTime()
+        current = self.gather_snapshot()
+        if self.film:
+            self.film.snapshot(now, current)
+        self.interest.update(self.snapshot_objects)
+        for player in self.players_by_pid.itervalues():
+            if not player.address:
+                continue
+            # Objects outside the player's area of interest are left out, which the client sees as them being
+            # removed; they are sent in full again when they come back into view.
+            oids = self.interest.relevant(player.walker)
+            visible = dict((oid, current[oid]) for oid in oids)
+            for fragment in player.snapshots.encode(self.snapshot_seq, now, visible, self.relevance(player, oids)):
+                datagram = PyDatagram()
+                datagram.addUint8(MSG_SNAPSHOT)
+                datagram.appendData(fragment)
+                self.transport.send_udp(player.address, datagram.getMessage())
+            self.transport.send_udp(player.address, self.state_datagram(player).getMessage())
+
+    def state_datagram(self, player):
+        """
+        The authoritative state of the player's walker, for their client to reconcile its prediction with.
+        """
+        pos, h, xz_velocity, y_velocity, on_ground = player.walker.get_motion_state()
+        datagram = PyDatagram()
+        datagram.addUint8(MSG_STATE)
+        datagram.addUint32(player.last_input)
+        for v in (pos.x, pos.y, pos.z, h, xz_velocity.x, xz_velocity.y, xz_velocity.z, y_velocity.y):
+            datagram.addFloat32(v)
+        datagram.addBool(on_ground)
+        return datagram
+
 class Client (object):
-    def __init__(self, world, host, port, timeout=3000):
+    def __init__(self, world, host, port, timeout=3000, udp_port=UDP_PORT):
         self.world = world
         self.manager = QueuedConnectionManager()
         self.reader = QueuedConnectionReader(self.manager, 0)
@@ -89,34 +261,120 @@ class Client (object):
             self.connection.setNoDelay(True)
             self.reader.addConnection(self.connection)
             self.connected = True
+        self.udp = self.manager.openUDPConnection(0)
+        self.reader.addConnection(self.udp)
+        self.server_address = NetAddress()
+        self.server_address.setHost(host, udp_port)
+        self.pid = None
+        self.token = None
+        self.walker = None
+        self.predictor = None
+        self.names = {}
+        # The local objects the server's object ids have turned out to mean.
+        self.remote_objects = {}
+        self.snapshots = SnapshotReceiver()
+        self.interpolator = Interpolator()
         self.players = {}
         taskMgr.add(self.update, 'clientUpdatesFromServer')
 
-    def send(self, cmd, onoff):
-        print 'CLIENT SEND', cmd, onoff
+    def input(self, dt, buttons, fire):
+        """
+        Applies a frame of input (see pavara.inputs) to our walker right away, and sends it to the server along
+        with the few before it, in case any of those went missing.
+        """
+        if not self.predictor or self.pid is None:
+            return
+        self.predictor.input(dt, buttons, fire, self.view_time())
         datagram = PyDatagram()
-        datagram.addString(cmd)
-        datagram.addBool(onoff)
-        self.writer.send(datagram, self.connection)
+        datagram.addUint8(MSG_INPUT)
+        datagram.addUint16(self.pid)
+        datagram.addUint32(self.token)
+        datagram.appendData(pack_frames(self.predictor.recent(INPUT_REDUNDANCY)))
+        self.writer.send(datagram, self.udp, self.server_address)
+
+    def view_time(self):
+        """
+        The server time of the world we're currently drawing, or 0 before we know the server's clock.
+        """
+        if self.interpolator.offset is None:
+            return 0.0
+        return self.interpolator.render_time(globalClock.getFrameTime())
+
+    def send_udp(self, msg, seq=None):
+        datagram = PyDatagram()
+        datagram.addUint8(msg)
+        datagram.addUint16(self.pid)
+        datagram.addUint32(self.token)
+        if seq is not None:
+            datagram.addUint32(seq)
+        self.writer.send(datagram, self.udp, self.server_address)
 
     def update(self, task):
         while self.reader.dataAvailable():
             datagram = NetDatagram()
             if self.reader.getData(datagram):
                 update = PyDatagramIterator(datagram)
-                num_objects = update.getInt8()
-                for i in range(num_objects):
-                    name = update.getString()
-                    x = update.getFloat32()
-                    y = update.getFloat32()
-                    z = update.getFloat32()
-                    h = update.getFloat32()
-                    p = update.getFloat32()
-                    r = update.getFloat32()
-                    if name.startswith('Walker') and name not in self.world.objects:
-                        self.world.create_walker(name)
-                    obj = self.world.objects.get(name)
-                    if obj:
-                        obj.move((x, y, z))
-                        obj.rotate(h, p, r)
+                msg = update.getUint8()
+                if msg == MSG_WELCOME:
+                    self.pid = update.getUint16()
+                    self.token = update.getUint32()
+                    self.welcome(update.getString())
+                elif msg == MSG_OBJECT:
+                    oid = update.getUint16()
+                    flags = update.getUint16()
+                    self.introduce(oid, update.getString(), flags)
+                elif msg == MSG_SNAPSHOT:
+                    self.handle_snapshot(datagram.getMessage())
+                elif msg == MSG_STATE:
+                    self.handle_state(update)
+        if self.pid is not None and not self.snapshots.latest:
+            # Until snapshots start arriving, keep telling the server where to send them.
+            self.send_udp(MSG_HELLO)
+        for oid, pos, hpr in self.interpolator.sample(globalClock.getFrameTime()):
+            self.apply(oid, pos, hpr)
         return task.cont
+
+    def welcome(self, name):
+        self.walker = self.world.objects.get(name) or self.world.create_walker(name, player=True)
+        self.predictor = Predictor(self.walker)
+
+    def handle_state(self, update):
+        seq = update.getUint32()
+        x, y, z, h, vx, vy, vz, fall = [update.getFloat32() for i in xrange(8)]
+        on_ground = update.getBool()
+        if self.predictor:
+            self.predictor.reconcile(seq, (Point3(x, y, z), h, Vec3(vx, vy, vz), Vec3(0, fall, 0), on_ground))
+
+    def introduce(self, oid, name, flags):
+        self.names[oid] = name
+        self.remote_objects.pop(oid, None)
+        if flags & WALKER_FLAG and name not in self.world.objects:
+            self.world.create_walker(name)
+        buf = self.interpolator.buffers.get(oid)
+        if buf:
+            # The object may already be settled where it was before we knew what it was.
+            buf.settled = False
+
+    def handle_snapshot(self, data):
+        result = self.snapshots.receive(data, 1)
+        if result is None:
+            return
+        seq, time, updates, removed, complete = result
+        self.interpolator.sync_clock(time, globalClock.getFrameTime())
+        for oid, state in updates.iteritems():
+            pos, hpr = dequantize(state)
+            self.interpolator.add(oid, time, pos, hpr)
+        for oid in removed:
+            self.interpolator.remove(oid)
+        if complete:
+            self.send_udp(MSG_ACK, seq)
+            self.interpolator.hold(time, self.snapshots.state())
+
+    def apply(self, oid, pos, hpr):
+        obj = self.remote_objects.get(oid)
+        if obj is None:
+            obj = self.remote_objects[oid] = self.world.objects.get(self.names.get(oid))
+        # Our own walker is predicted, not interpolated.
+        if obj and obj is not self.walker:
+            obj.move(pos)
+            obj.rotate(*hpr)
@@ -0,0 +1,44 @@
+"""
+Pools of released world objects, kept for reuse.
+
+Things that come and go all the time, like projectiles, are expensive to build: a model to load, physics nodes to
+create, a sound to load. Instead of tearing them down when they expire, the World detaches them and keeps them in
+a pool per class; the next World.spawn of that class resets and reattaches one rather than building a new one.
+"""
+
+POOL_SIZE = 64
+
+
+class ObjectPool (object):
+    """
+    Released instances of one class, up to a limit. Anything released past the limit is thrown away.
+    """
+
+    def __init__(self, cls, limit=POOL_SIZE):
+        self.cls = cls
+        self.limit = limit
+        self.free = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self):
+        """
+        Returns a released instance, or None if there are none.
+        """
+        if self.free:
+            self.hits += 1
+            return self.free.pop()
+        self.misses += 1
+        return None
+
+    def release(self, obj):
+        """
+        Keeps obj for reuse. Returns False if the pool is full and obj should be destroyed instead.
+        """
+        if len(self.free) >= self.limit:
+            return False
+        self.free.append(obj)
+        return True
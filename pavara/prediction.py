@@ -0,0 +1,85 @@
+"""
+Client-side prediction for the local player's walker.
+
+Rather than waiting a round trip for the server to move our walker, the client moves it straight away and
+remembers each frame's input under a sequence number. The server moves its copy of the walker with the same inputs
+and reports back its state along with the sequence number of the last input it applied. The client then resets the
+walker to that state and replays the inputs the server hasn't seen yet, so it agrees with the server without
+visibly waiting on it.
+"""
+from pavara.inputs import InputFrame, apply_input
+
+INPUT_HISTORY = 240
+
+
+class PredictedFrame (object):
+    """
+    An input frame, along with how the walker's controls stood before it, to rewind to.
+    """
+
+    def __init__(self, frame, previous, movement, crouching, can_jump):
+        self.frame = frame
+        self.previous = previous
+        self.movement = movement
+        self.crouching = crouching
+        self.can_jump = can_jump
+
+
+class Predictor (object):
+    """
+    Keeps the input history of the local walker and reconciles it with authoritative server states.
+    """
+
+    def __init__(self, walker, size=INPUT_HISTORY):
+        self.walker = walker
+        self.size = size
+        self.history = []
+        self.seq = 0
+        self.acked = 0
+        self.buttons = 0
+
+    def controls(self):
+        return dict(self.walker.movement), self.walker.crouching, self.walker.can_jump
+
+    def input(self, dt, buttons, fire, view_time=0.0):
+        """
+        Applies a frame of input to the local walker right away, and remembers it. Returns the new InputFrame.
+        """
+        self.seq += 1
+        frame = InputFrame(self.seq, dt, buttons, fire, view_time)
+        movement, crouching, can_jump = self.controls()
+        self.history.append(PredictedFrame(frame, self.buttons, movement, crouching, can_jump))
+        if len(self.history) > self.size:
+            del self.history[0]
+        apply_input(self.walker, self.buttons, frame)
+        self.buttons = buttons
+        return frame
+
+    def recent(self, count):
+        """
+        The latest count frames, newest first.
+        """
+        return [p.frame for p in reversed(self.history[-count:])]
+
+    def reconcile(self, ack_seq, state):
+        """
+        Resets the walker to the server's state after it applied input ack_seq, then replays every input since.
+        """
+        if ack_seq <= self.acked:
+            return
+        self.acked = ack_seq
+        while self.history and self.history[0].frame.seq <= ack_seq:
+            del self.history[0]
+        walker = self.walker
+        walker.set_motion_state(state)
+        if not self.history:
+            return
+        current = self.controls()
+        first = self.history[0]
+        walker.movement = dict(first.movement)
+        walker.crouching = first.crouching
+        walker.can_jump = first.can_jump
+        for predicted in self.history:
+            apply_input(walker, predicted.previous, predicted.frame, fire=False)
+            walker.simulate(predicted.frame.dt)
+        walker.movement, walker.crouching, walker.can_jump = current
@@ -1,20 +1,54 @@
 from pandac.PandaModules import Point3
 from panda3d.bullet import BulletGhostNode, BulletSphereShape, BulletRigidBodyNode
-from direct.actor.Actor import Actor
 from pavara.base_objects import PhysicalObject
 from pavara.effects import TriangleExplosion
-from pavara.utils.integrator import Integrator
-from pavara.assets import load_model
+from pavara.assets import load_model, load_actor, load_sound
 from pavara.constants import *
 import math
 import random
 
 class Projectile(PhysicalObject):
-    pass
+
+    collide_bits = PROJECTILE_COLLIDE_BIT
+    flags = PROJECTILE_FLAG
+    # Projectiles come and go constantly, so spent ones are kept and reused by World.spawn. Anything that differs
+    # between shots has to be set up in attached rather than create_node.
+    pooled = True
+    sound = None
+    # Seconds behind the server the shooter saw the world when firing. Hits are tested against the world as it
+    # was then.
+    lag = 0.0
+    # The walker that fired this, which rewound hit tests leave out.
+    shooter = None
+    # Whether the path flown each step is ray tested too, so a fast shot can't pass through something thin between
+    # one step and the next (see World.sweep).
+    swept = True
+
+    def start_sound(self, path):
+        """
+        Loads and loops a sound attached to this projectile, if the world has audio (servers don't). A pooled
+        projectile keeps the sound it loaded the first time.
+        """
+        if not self.world.audio3d:
+            return None
+        if not self.sound:
+            self.sound = load_sound(self.world.audio3d, path)
+        self.sound.set_balance(0)
+        self.world.audio3d.attachSoundToObject(self.sound, self.node)
+        self.sound.set_loop(True)
+        self.sound.play()
+        return self.sound
+
+    def stop_sound(self):
+        if self.sound:
+            self.sound.stop()
+            self.world.audio3d.detachSound(self.sound)
 
 class Plasma (Projectile):
-    def __init__(self, pos, hpr, energy, name=None):
+    def __init__(self, pos, hpr, energy, name=None, lag=0.0, shooter=None):
         super(Plasma, self).__init__(name)
+        self.lag = lag
+        self.shooter = shooter
         self.pos = Vec3(*pos)
         self.hpr = hpr
         self.energy = energy
@@ -23,9 +57,7 @@ class Plasma (Projectile):
     def create_node(self):
         m = load_model('plasma.egg')
         m.set_shader_auto()
-        p = m.find('**/plasma')
-        cf = self.energy
-        p.setColor(1,(150/255.0)*cf,(150/255.0)*cf)
+        self.plasma = m.find('**/plasma')
         m.set_scale(PLASMA_SCALE)
         return m
 
@@ -39,6 +71,8 @@ class Plasma (Projectile):
     def attached(self):
         self.node.set_pos(self.pos)
         self.node.set_hpr(self.hpr)
+        cf = self.energy
+        self.plasma.setColor(1,(150/255.0)*cf,(150/255.0)*cf)
         #light = PointLight(self.name+"_light")
         #cf  = self.energy
         #light.set_color(VBase4(.9*cf,0,0,1))
@@ -48,55 +82,43 @@ class Plasma (Projectile):
         #self.world.scene.set_light(self.light_node)
         self.world.register_updater(self)
         self.world.register_collider(self)
-        self.solid.setIntoCollideMask(NO_COLLISION_BITS)
-        self.sound = self.world.audio3d.loadSfx('Sounds/plasma.wav')
-        self.sound.set_balance(0)
-        self.world.audio3d.attachSoundToObject(self.sound, self.node)
-        self.world.audio3d.setSoundVelocity(self.sound, self.world.scene.get_relative_vector(self.node, Vec3(0,0,400)))
-        self.sound.set_loop(True)
-        self.sound.play()
+        self.world.ballistics.add(self, self.world.scene.get_relative_vector(self.node, Vec3(0,0,PLASMA_SPEED)))
+        if self.start_sound('Sounds/plasma.wav'):
+            self.world.audio3d.setSoundVelocity(self.sound, self.world.scene.get_relative_vector(self.node, Vec3(0,0,400)))
 
     def update(self, dt):
-        self.move_by(0,0,(dt*60)/4)
         self.rotate_by(0,0,(dt*60)*3)
-        result = self.world.physics.contact_test(self.solid)
         self.age += dt*60
-        contacts = result.getContacts()
-        if len(contacts) > 0:
-            #self.world.scene.clear_light(self.light_node)
-            cf = self.energy
-            expl_color = [1,(150/255.0)*cf,(150/255.0)*cf, 1]
-            expl_pos = self.node.get_pos(self.world.scene)
-            expl = self.world.attach(TriangleExplosion(expl_pos, 5, size=.1, color=expl_color))
-            contact = contacts[0]
-            contact.getManifoldPoint().getLocalPointB()
-            n1_name = contact.getNode1().get_name()
-            self.world.do_plasma_push(self, n1_name, self.energy)
-            self.sound.stop()
-            self.world.audio3d.detachSound(self.sound)
-            self.world.garbage.add(self)
-
         if self.age > PLASMA_LIFESPAN:
-            self.sound.stop()
-            self.world.audio3d.detachSound(self.sound)
+            self.stop_sound()
             self.world.garbage.add(self)
 
+    def collision(self, other, manifold, first):
+        #self.world.scene.clear_light(self.light_node)
+        cf = self.energy
+        expl_color = [1,(150/255.0)*cf,(150/255.0)*cf, 1]
+        expl_pos = self.node.get_pos(self.world.scene)
+        self.world.spawn(TriangleExplosion, expl_pos, 5, size=.1, color=expl_color)
+        self.world.do_plasma_push(self, other, self.energy)
+        self.stop_sound()
+        self.world.garbage.add(self)
+
     def decompose(self):
         pass
 
 class Missile (Projectile):
-    def __init__(self, pos, hpr, color, name=None):
+    def __init__(self, pos, hpr, color, name=None, lag=0.0, shooter=None):
         super(Missile, self).__init__(name)
+        self.lag = lag
+        self.shooter = shooter
         self.pos = Vec3(*pos)
         self.hpr = hpr
         self.age = 0
         self.color = color
-        self.velocity = Vec3(0,0,0)
 
     def create_node(self):
         self.model = load_model('missile.egg')
         self.body = self.model.find('**/bodywings')
-        self.body.set_color(*self.color)
         self.main_engines = self.model.find('**/mainengines')
         self.wing_engines = self.model.find('**/wingengines')
         self.main_engines.set_color(*random.choice(ENGINE_COLORS))
@@ -115,15 +137,13 @@ class Missile (Projectile):
     def attached(self):
         self.node.set_pos(self.pos)
         self.node.set_hpr(self.hpr)
+        self.body.set_color(*self.color)
         self.world.register_updater(self)
         self.world.register_collider(self)
-        self.solid.setIntoCollideMask(NO_COLLISION_BITS)
-        self.sound = self.world.audio3d.loadSfx('Sounds/plasma.wav')
-        self.sound.set_balance(0)
-        self.world. audio3d.attachSoundToObject(self.sound, self.node)
-        self.sound.set_loop(True)
-        self.sound.play()
-        self.integrator = Integrator(self.world.scene.get_relative_vector(self.node, Vec3(0,0,30)))
+        self.start_sound('Sounds/plasma.wav')
+        # Missiles fly straight, speeding up until they reach their top speed.
+        forward = self.world.scene.get_relative_vector(self.node, Vec3(0,0,MISSILE_ACCELERATION))
+        self.world.ballistics.add(self, Vec3(0,0,0), forward, MISSILE_MAX_SPEED)
 
     def decompose(self):
         clist = list(self.color)
@@ -132,39 +152,29 @@ class Missile (Projectile):
         expl_colors.extend(ENGINE_COLORS)
         expl_pos = self.node.get_pos(self.world.scene)
         for c in expl_colors:
-            self.world.attach(TriangleExplosion(expl_pos, 1, size=.1, color=c, lifetime=40))
+            self.world.spawn(TriangleExplosion, expl_pos, 1, size=.1, color=c, lifetime=40)
         self._remove_all()
 
     def update(self, dt):
-        current_pos = Point3(0, self.position().get_y(), 0)
-        pos, self.velocity = self.integrator.integrate(self.node.get_pos(), self.velocity, dt)
-        if self.velocity.length() > 30:
-            self.integrator.accel = Vec3(0,0,0)
-        else:
-            self.integrator.accel = self.world.scene.get_relative_vector(self.node, Vec3(0,0,30))
-        self.move(self.position() + (pos - self.node.get_pos()))
-
         self.main_engines.set_color(*random.choice(ENGINE_COLORS))
         self.wing_engines.set_color(*random.choice(ENGINE_COLORS))
-        result = self.world.physics.contact_test(self.solid)
         self.age += dt
-        if len(result.getContacts()) > 0:
-            clist = list(self.color)
-            clist.extend([1])
-            expl_colors = [clist]
-            expl_colors.extend(ENGINE_COLORS)
-            expl_pos = self.node.get_pos(self.world.scene)
-            for c in expl_colors:
-                self.world.attach(TriangleExplosion(expl_pos, 3, size=.1, color=c, lifetime=80))
-            self.world.do_explosion(self.node, 1.5, 30)
-            self._remove_all()
-
         if self.age > MISSILE_LIFESPAN:
             self._remove_all()
 
+    def collision(self, other, manifold, first):
+        clist = list(self.color)
+        clist.extend([1])
+        expl_colors = [clist]
+        expl_colors.extend(ENGINE_COLORS)
+        expl_pos = self.node.get_pos(self.world.scene)
+        for c in expl_colors:
+            self.world.spawn(TriangleExplosion, expl_pos, 3, size=.1, color=c, lifetime=80)
+        self.world.do_explosion(self.node, 1.5, 30)
+        self._remove_all()
+
     def _remove_all(self):
-        self.sound.stop()
-        self.world.audio3d.detachSound(self.sound)
+        self.stop_sound()
         self.world.garbage.add(self)
 
 class Grenade (Projectile):
@@ -178,9 +188,8 @@ class Grenade (Projectile):
         self.walker_v = walker_v
 
     def create_node(self):
-        self.model = Actor('grenade.egg')
+        self.model = load_actor('grenade.egg')
         self.shell = self.model.find('**/shell')
-        self.shell.set_color(*self.color)
         self.inner_top = self.model.find('**/inner_top')
         self.inner_bottom = self.model.find('**/inner_bottom')
         self.inner_top.set_color(*random.choice(ENGINE_COLORS))
@@ -196,14 +205,20 @@ class Grenade (Projectile):
         node_shape = BulletSphereShape(.08)
         node.add_shape(node_shape)
         node.set_mass(.5)
+        # Grenades are moved by Bullet, so let it sweep them rather than World.sweep.
+        node.set_ccd_motion_threshold(.08)
+        node.set_ccd_swept_sphere_radius(.08)
         return node
 
     def attached(self):
         self.node.set_pos(self.pos)
         self.node.set_hpr(self.hpr)
+        self.shell.set_color(*self.color)
         self.world.register_updater(self)
         self.world.register_collider(self)
-        self.solid.setIntoCollideMask(NO_COLLISION_BITS)
+        # A reused grenade still has whatever motion it had when it went off.
+        self.solid.set_linear_velocity(Vec3(0,0,0))
+        self.solid.set_angular_velocity(Vec3(0,0,0))
         self.solid.set_gravity(DEFAULT_GRAVITY*4.5)
         grenade_iv = self.world.scene.get_relative_vector(self.node, Vec3(0,8.5,13.5))
         grenade_iv += (self.walker_v * 1/2)
@@ -216,26 +231,24 @@ class Grenade (Projectile):
         expl_colors.extend(ENGINE_COLORS)
         expl_pos = self.node.get_pos(self.world.scene)
         for c in expl_colors:
-            self.world.attach(TriangleExplosion(expl_pos, 1, size=.1, color=c, lifetime=40))
+            self.world.spawn(TriangleExplosion, expl_pos, 1, size=.1, color=c, lifetime=40)
         self.world.garbage.add(self)
 
     def update(self, dt):
         self.inner_top.set_color(*random.choice(ENGINE_COLORS))
         self.inner_bottom.set_color(*random.choice(ENGINE_COLORS))
-        result = self.world.physics.contact_test(self.solid)
         self.spin_bone.set_hpr(self.spin_bone, 0,0,10)
-        contacts = result.getContacts()
-        if len(contacts) > 0:
-            hit_node = contacts[0].get_node1().get_name()
-            if hit_node.endswith("_walker_cap"):
-                return
-            clist = list(self.color)
-            clist.extend([1])
-            expl_colors = [clist]
-            expl_colors.extend(ENGINE_COLORS)
-            expl_pos = self.node.get_pos(self.world.scene)
-            for c in expl_colors:
-                self.world.attach(TriangleExplosion(expl_pos, 3, size=.1, color=c, lifetime=80,))
-            self.world.do_explosion(self.node, 3, 100)
-            self.world.garbage.add(self)
+
+    def collision(self, other, manifold, first):
+        if other.flags & WALKER_FLAG:
+            return
+        clist = list(self.color)
+        clist.extend([1])
+        expl_colors = [clist]
+        expl_colors.extend(ENGINE_COLORS)
+        expl_pos = self.node.get_pos(self.world.scene)
+        for c in expl_colors:
+            self.world.spawn(TriangleExplosion, expl_pos, 3, size=.1, color=c, lifetime=80)
+        self.world.do_explosion(self.node, 3, 100)
+        self.world.garbage.add(self)
 
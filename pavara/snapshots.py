@@ -0,0 +1,291 @@
+"""
+Quantized, delta-compressed world snapshots.
+
+Each networked object is identified by a compact numeric id and its transform is quantized to six 16-bit
+integers. A snapshot is encoded as the difference from a baseline snapshot the client has acknowledged:
+only objects (and only fields) that changed are written, along with the ids of objects that went away.
+Snapshots are split into MTU-sized fragments that can each be applied on their own, with the most relevant
+objects first and a per-client byte budget bounding how much is sent per tick.
+"""
+import struct
+
+POSITION_SCALE = 64.0
+POSITION_LIMIT = 32767
+ANGLE_SCALE = 65536 / 360.0
+
+NUM_FIELDS = 6
+ALL_FIELDS = (1 << NUM_FIELDS) - 1
+
+SNAPSHOT_HISTORY = 32
+SNAPSHOT_MTU = 1200
+SNAPSHOT_BUDGET = 8 * SNAPSHOT_MTU
+MAX_FRAGMENTS = 255
+
+# seq, baseline seq, server time, fragment index, fragment count, changed count, removed count
+_header = struct.Struct('<IIfBBHH')
+_entry = struct.Struct('<HB')
+_field = struct.Struct('<h')
+_angle = struct.Struct('<H')
+_id = struct.Struct('<H')
+
+
+def _clamp(v):
+    return max(-POSITION_LIMIT, min(POSITION_LIMIT, v))
+
+
+def quantize(pos, hpr):
+    """
+    Quantizes a position and yaw/pitch/roll to a tuple of six ints: positions in 1/64ths of a unit, angles in
+    1/65536ths of a turn.
+    """
+    return (
+        _clamp(int(round(pos[0] * POSITION_SCALE))),
+        _clamp(int(round(pos[1] * POSITION_SCALE))),
+        _clamp(int(round(pos[2] * POSITION_SCALE))),
+        int(round((hpr[0] % 360.0) * ANGLE_SCALE)) & 0xFFFF,
+        int(round((hpr[1] % 360.0) * ANGLE_SCALE)) & 0xFFFF,
+        int(round((hpr[2] % 360.0) * ANGLE_SCALE)) & 0xFFFF,
+    )
+
+
+def dequantize(state):
+    """
+    The inverse of quantize, returning ((x, y, z), (h, p, r)).
+    """
+    pos = tuple(v / POSITION_SCALE for v in state[:3])
+    hpr = tuple(v / ANGLE_SCALE for v in state[3:])
+    return pos, hpr
+
+
+def _changed_fields(old, state):
+    if old is None:
+        return ALL_FIELDS
+    mask = 0
+    for i in range(NUM_FIELDS):
+        if state[i] != old[i]:
+            mask |= 1 << i
+    return mask
+
+
+def _pack_entry(oid, mask, state):
+    parts = [_entry.pack(oid, mask)]
+    for i in range(NUM_FIELDS):
+        if mask & (1 << i):
+            if i < 3:
+                parts.append(_field.pack(state[i]))
+            else:
+                parts.append(_angle.pack(state[i]))
+    return ''.join(parts)
+
+
+class _Fragment (object):
+
+    def __init__(self):
+        self.entries = []
+        self.removed = []
+        self.size = _header.size
+
+    def fits(self, nbytes, mtu):
+        return self.size + nbytes <= mtu or not (self.entries or self.removed)
+
+    def pack(self, seq, baseline_seq, time, index, count):
+        return _header.pack(seq, baseline_seq, time, index, count, len(self.entries), len(self.removed)) + \
+            ''.join(self.entries) + ''.join(self.removed)
+
+
+def encode_fragments(seq, baseline_seq, baseline, current, priority=None, mtu=SNAPSHOT_MTU, budget=SNAPSHOT_BUDGET,
+                     time=0.0):
+    """
+    Encodes the current snapshot ({id: state}), taken at server time time, relative to baseline ({id: state},
+    possibly empty) as a list of datagram payloads no bigger than mtu. Each fragment can be decoded on its own, so
+    a client can use whatever part of a frame arrives. Changed objects are written in descending priority
+    ({id: number}, missing ids count as 0) until budget bytes have been used; the rest are deferred to a later
+    snapshot.
+
+    Returns (fragments, sent, deferred): sent is the state the client will have once every fragment arrives, and
+    deferred is the list of ids that didn't fit.
+    """
+    sent = dict(baseline)
+    fragments = [_Fragment()]
+    used = _header.size
+    for oid in baseline:
+        if oid not in current:
+            data = _id.pack(oid)
+            if not fragments[-1].fits(len(data), mtu):
+                fragments.append(_Fragment())
+                used += _header.size
+            fragments[-1].removed.append(data)
+            fragments[-1].size += len(data)
+            used += len(data)
+            del sent[oid]
+    changed = []
+    for oid, state in current.iteritems():
+        mask = _changed_fields(baseline.get(oid), state)
+        if mask:
+            changed.append((priority.get(oid, 0) if priority else 0, oid, mask))
+    changed.sort(reverse=True)
+    deferred = []
+    for _, oid, mask in changed:
+        data = _pack_entry(oid, mask, current[oid])
+        if used + len(data) > budget:
+            deferred.append(oid)
+            continue
+        if not fragments[-1].fits(len(data), mtu):
+            if len(fragments) >= MAX_FRAGMENTS or used + _header.size + len(data) > budget:
+                deferred.append(oid)
+                continue
+            fragments.append(_Fragment())
+            used += _header.size
+        fragments[-1].entries.append(data)
+        fragments[-1].size += len(data)
+        used += len(data)
+        sent[oid] = current[oid]
+    count = len(fragments)
+    return [f.pack(seq, baseline_seq, time, i, count) for i, f in enumerate(fragments)], sent, deferred
+
+
+def read_header(data, offset=0):
+    """
+    Returns (seq, baseline_seq, time, fragment index, fragment count) of an encoded fragment without decoding it.
+    """
+    return _header.unpack_from(data, offset)[:5]
+
+
+def decode_fragment(data, state, offset=0):
+    """
+    Applies one fragment produced by encode_fragments to state ({id: state}, which should start out as a copy of
+    the fragment's baseline). Returns (seq, updates, removed), where updates maps the ids sent in this fragment
+    to their new state.
+    """
+    seq, baseline_seq, time, index, count, num_changed, num_removed = _header.unpack_from(data, offset)
+    offset += _header.size
+    updates = {}
+    for _ in range(num_changed):
+        oid, mask = _entry.unpack_from(data, offset)
+        offset += _entry.size
+        values = list(state.get(oid, (0,) * NUM_FIELDS))
+        for i in range(NUM_FIELDS):
+            if mask & (1 << i):
+                if i < 3:
+                    values[i] = _field.unpack_from(data, offset)[0]
+                    offset += _field.size
+                else:
+                    values[i] = _angle.unpack_from(data, offset)[0]
+                    offset += _angle.size
+        state[oid] = updates[oid] = tuple(values)
+    removed = []
+    for _ in range(num_removed):
+        oid = _id.unpack_from(data, offset)[0]
+        offset += _id.size
+        state.pop(oid, None)
+        removed.append(oid)
+    return seq, updates, removed
+
+
+class SnapshotHistory (object):
+    """
+    The server's record of snapshots sent to one client, used to delta-encode against the newest one the client
+    has acknowledged. Objects deferred for lack of bandwidth gain priority each time, so they can't starve.
+    """
+
+    def __init__(self, size=SNAPSHOT_HISTORY, mtu=SNAPSHOT_MTU, budget=SNAPSHOT_BUDGET):
+        self.size = size
+        self.mtu = mtu
+        self.budget = budget
+        self.sent = {}
+        self.acked = 0
+        self.starved = {}
+
+    def ack(self, seq):
+        if seq > self.acked and seq in self.sent:
+            self.acked = seq
+            for old in [s for s in self.sent if s < seq]:
+                del self.sent[old]
+
+    def encode(self, seq, time, current, relevance=None):
+        """
+        Returns the list of fragments to send for snapshot seq, taken at server time time. relevance
+        ({id: number}) says which objects matter most to this client.
+        """
+        baseline = self.sent.get(self.acked)
+        if baseline is None or len(self.sent) >= self.size:
+            # The client has stopped acknowledging, and may no longer have our baseline either. Start over with a
+            # full snapshot.
+            self.sent = {}
+            self.acked = 0
+            baseline = {}
+        priority = {}
+        for oid in current:
+            priority[oid] = (relevance.get(oid, 0) if relevance else 1) * (1 + self.starved.get(oid, 0))
+        fragments, sent, deferred = encode_fragments(seq, self.acked, baseline, current, priority, self.mtu,
+                                                     self.budget, time)
+        starved = {}
+        for oid in deferred:
+            starved[oid] = self.starved.get(oid, 0) + 1
+        self.starved = starved
+        self.sent[seq] = sent
+        return fragments
+
+
+class PartialSnapshot (object):
+
+    def __init__(self, count, baseline):
+        self.count = count
+        self.fragments = set()
+        self.state = dict(baseline)
+
+    def complete(self):
+        return len(self.fragments) == self.count
+
+
+class SnapshotReceiver (object):
+    """
+    The client's record of snapshots received. Fragments are applied as they arrive, and a frame becomes usable
+    as a baseline (and is acknowledged) once all of its fragments are in.
+    """
+
+    def __init__(self, size=SNAPSHOT_HISTORY):
+        self.size = size
+        self.received = {}
+        self.pending = {}
+        self.latest = 0
+        self.applied = {}
+
+    def state(self):
+        return self.received.get(self.latest, {})
+
+    def receive(self, data, offset=0):
+        """
+        Decodes one snapshot fragment. Returns (seq, time, updates, removed, complete), where updates maps object
+        ids to states newer than any already returned and removed lists ids that went away, or None if the
+        fragment is stale, a duplicate, or its baseline has already been forgotten.
+        """
+        seq, baseline_seq, time, index, count = read_header(data, offset)
+        if seq <= self.latest:
+            return None
+        frame = self.pending.get(seq)
+        if frame is None:
+            baseline = self.received.get(baseline_seq) if baseline_seq else {}
+            if baseline is None:
+                return None
+            frame = self.pending[seq] = PartialSnapshot(count, baseline)
+        if index in frame.fragments:
+            return None
+        frame.fragments.add(index)
+        seq, updates, removed = decode_fragment(data, frame.state, offset)
+        fresh = {}
+        for oid, state in updates.iteritems():
+            if self.applied.get(oid, 0) < seq:
+                self.applied[oid] = seq
+                fresh[oid] = state
+        for oid in removed:
+            self.applied.pop(oid, None)
+        complete = frame.complete()
+        if complete:
+            self.received[seq] = frame.state
+            self.latest = seq
+            for old in [s for s in self.pending if s <= seq]:
+                del self.pending[old]
+            for old in [s for s in self.received if s <= seq - self.size]:
+                del self.received[old]
+        return seq, time, fresh, removed, complete
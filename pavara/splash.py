@@ -8,7 +8,8 @@ from direct.interval.LerpInterval import *
 from direct.interval.IntervalGlobal import *
 from pavara.network import Server, Client
 from pavara.constants import TCP_PORT
-from pavara.maps import load_maps
+from pavara.maps import load_maps, map_assets
+from pavara.assets import preload
 from pavara.utils.geom import GeomBuilder
 from pavara.local_player import LocalPlayer
 from pavara.walker import Walker
@@ -112,6 +113,9 @@ class Splash (object):
             maps = load_maps('Maps/%s' % mapname, w)
         self.map = maps[0]
         self.map.show(self.render)
+        # Get everything the game will need loading while the map is being looked over.
+        models, sounds = map_assets('Maps/%s' % mapname)
+        preload(models, sounds, self.audio3d if audio else None)
         self.camera.setPos(*self.map.preview_cam[0])
         self.camera.setH(self.map.preview_cam[1][0])
         self.camera.setP(self.map.preview_cam[1][1])
@@ -0,0 +1,94 @@
+"""
+Starfields: skies full of little stars.
+
+Every star is a small flat disc on the sky sphere, turned to face its center. A whole starfield is generated straight
+into one vertex array and drawn as a single Geom, rather than each star being a Dome of its own.
+"""
+from array import array
+from math import pi, sin, cos, acos, sqrt
+import random
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexData, GeomVertexFormat
+from pavara.utils.geom import to_cartesian
+
+SKY_DISTANCE = 1000.0 * 255.0 / 256.0
+# Sides of the polygon each star is drawn as.
+STAR_SIDES = 6
+# A star's size is the radius of the dome it used to be, 1.5 times bigger than asked for.
+STAR_SCALE = 1.5
+
+
+def star_colors(rng, mode, min_color, max_color):
+    """
+    Picks one star's (r, g, b). 'realistic' picks white, orange/yellow or blue stars; 'monochrome' picks a single
+    point between min_color and max_color; anything else picks each channel independently.
+    """
+    if mode == 'realistic':
+        star_type = rng.randint(0, 2)
+        if star_type == 0: # white star
+            return 1, 1, 1
+        elif star_type == 1: # orange/yellow
+            g = 0.5 + rng.random() * 0.5
+            return 1, g, g / 2
+        else: # blue
+            g = 1 - rng.random() * 0.30
+            return g * (1 - rng.random() * 0.30), g, 1
+    elif mode == 'monochrome':
+        dice = rng.random()
+        return tuple(min_color[i] + dice * (max_color[i] - min_color[i]) for i in xrange(3))
+    return tuple(min_color[i] + rng.random() * (max_color[i] - min_color[i]) for i in xrange(3))
+
+
+def build_starfield(seed, count, min_color, max_color, min_size, max_size, mode='default', name='starfield'):
+    """
+    Returns a GeomNode drawing count stars scattered over the upper sky. The same seed always gives the same sky;
+    a seed of 0 gives a different one every time.
+    """
+    rng = random.Random(seed) if seed else random.Random()
+    delta_size = max_size - min_size
+    two_pi = pi * 2
+    half_pi = pi / 2
+    angles = [(cos(two_pi * i / STAR_SIDES), sin(two_pi * i / STAR_SIDES)) for i in xrange(STAR_SIDES)]
+    # Each star is a center vertex and a ring around it, every vertex a row of position and color.
+    rows = array('f')
+    for _ in xrange(count):
+        theta = two_pi * rng.random()
+        phi = abs(half_pi - acos(rng.random()))
+        r, g, b = star_colors(rng, mode, min_color, max_color)
+        color = (r, g, b, 1 - (1 - phi / pi) ** 6)
+        size = (min_size + rng.random() * delta_size) * STAR_SCALE
+
+        x, y, z = to_cartesian(theta, phi, SKY_DISTANCE)
+        # Two axes across the star's face, which looks back at the middle of the sky.
+        nx, ny, nz = x / SKY_DISTANCE, y / SKY_DISTANCE, z / SKY_DISTANCE
+        if abs(ny) < 0.99:
+            ux, uy, uz = -nz, 0.0, nx
+        else:
+            ux, uy, uz = 0.0, nz, -ny
+        length = sqrt(ux * ux + uy * uy + uz * uz)
+        ux, uy, uz = ux / length, uy / length, uz / length
+        vx, vy, vz = ny * uz - nz * uy, nz * ux - nx * uz, nx * uy - ny * ux
+
+        rows.extend((x, y, z) + color)
+        for c, s in angles:
+            rows.extend((x + size * (c * ux + s * vx), y + size * (c * uy + s * vy), z + size * (c * uz + s * vz)) +
+                        color)
+
+    stride = STAR_SIDES + 1
+    indices = array('I')
+    for star in xrange(count):
+        center = star * stride
+        for i in xrange(STAR_SIDES):
+            # Wound to face the middle of the sky, where the camera is.
+            indices.extend((center, center + 1 + (i + 1) % STAR_SIDES, center + 1 + i))
+
+    vdata = GeomVertexData(name, GeomVertexFormat.get_v3c4(), Geom.UHStatic)
+    vdata.set_num_rows(count * stride)
+    vdata.modify_array(0).modify_handle().set_data(rows.tostring())
+    tris = GeomTriangles(Geom.UHStatic)
+    tris.set_index_type(Geom.NT_uint32)
+    tris.modify_vertices(len(indices)).modify_handle().set_data(indices.tostring())
+    geom = Geom(vdata)
+    geom.add_primitive(tris)
+    node = GeomNode(name)
+    node.add_geom(geom)
+    return node
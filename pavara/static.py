@@ -0,0 +1,142 @@
+"""
+Static batching: merging everything in a world that never moves.
+
+A map is built from dozens or hundreds of pieces, and each one is a node (a draw call) and a rigid body (a broadphase
+proxy) of its own, even inside a <static> block, which only merges its own children. Once a map has loaded,
+World.batch_static gathers every immovable piece into one StaticGeometry object: their geometry is merged into one
+Geom per render state, and their collision shapes are moved into one static body.
+
+Pieces wrapped in effects (mortal, hostile, transparent and so on) are left alone, node, body and all: what the
+effect does depends on the piece staying an object of its own, whether it is hit, aimed at or drawn.
+"""
+from array import array
+from panda3d.core import Geom, GeomNode, GeomPrimitive, GeomTriangles, GeomVertexData, NodePath, TransformState
+from panda3d.bullet import BulletRigidBodyNode
+from pavara.base_objects import PhysicalObject
+from pavara.constants import *
+
+
+class StaticBatch (object):
+    """
+    Merged vertices and triangles that share one vertex format and render state.
+    """
+
+    def __init__(self, format, state):
+        self.format = format
+        self.key = str(format)
+        self.state = state
+        self.vertices = []
+        self.indices = array('I')
+        self.rows = 0
+
+    def matches(self, format, state):
+        return str(format) == self.key and self.state.compare_to(state) == 0
+
+    def add(self, vdata, triangles):
+        """
+        Appends the rows of vdata and the given triangle indices into them. Returns the first row added.
+        """
+        first = self.rows
+        self.vertices.append(vdata.get_array(0).get_handle().get_data())
+        self.indices.extend(index + first for index in triangles)
+        self.rows += vdata.get_num_rows()
+        return first
+
+    def make_geom(self, name):
+        vdata = GeomVertexData(name, self.format, Geom.UHStatic)
+        vdata.set_num_rows(self.rows)
+        vdata.modify_array(0).modify_handle().set_data(''.join(self.vertices))
+        tris = GeomTriangles(Geom.UHStatic)
+        tris.set_index_type(Geom.NT_uint32)
+        tris.modify_vertices(len(self.indices)).modify_handle().set_data(self.indices.tostring())
+        geom = Geom(vdata)
+        geom.add_primitive(tris)
+        return geom
+
+
+def batchable(obj):
+    """
+    Whether obj is a plain map piece that never moves: one built only from its arguments (see
+    PhysicalObject.compilable), not wrapped in any effect, whose rigid body has no mass and the usual collide bits.
+    """
+    return getattr(obj, 'compilable', False) and not hasattr(obj, 'effected') and obj.node is not None and \
+        isinstance(obj.solid, BulletRigidBodyNode) and obj.solid.get_mass() == 0 and \
+        obj.collide_bits in (MAP_COLLIDE_BIT, NO_COLLISION_BITS)
+
+
+class StaticGeometry (PhysicalObject):
+    """
+    The merged geometry and collision shapes of every immovable piece of a world.
+    """
+
+    flags = UNPUSHABLE_FLAG
+    # It covers the whole map, so it would be near everything.
+    indexed = False
+
+    def __init__(self, scene, name='static'):
+        super(StaticGeometry, self).__init__(name)
+        self.scene = scene
+        self.batches = []
+        self.pieces = []
+        self.shapes = []
+
+    def add(self, obj):
+        """
+        Takes obj's geometry and collision shapes. Returns False, taking nothing, if any of obj's geometry can't be
+        merged.
+        """
+        geoms = []
+        for geom_np in obj.node.find_all_matches('**/+GeomNode'):
+            geom_node = geom_np.node()
+            mat = geom_np.get_mat(self.scene)
+            state = geom_np.get_state(self.scene)
+            for i in xrange(geom_node.get_num_geoms()):
+                geom = geom_node.get_geom(i)
+                vdata = geom.get_vertex_data()
+                if vdata.get_num_arrays() != 1:
+                    return False
+                triangles = array('I')
+                for j in xrange(geom.get_num_primitives()):
+                    prim = geom.get_primitive(j).decompose()
+                    if prim.get_primitive_type() != GeomPrimitive.PT_polygons:
+                        return False
+                    prim = prim.make_copy()
+                    prim.set_index_type(Geom.NT_uint32)
+                    triangles.fromstring(prim.get_vertices().get_handle().get_data())
+                geoms.append((vdata, mat, state.compose(geom_node.get_geom_state(i)), triangles))
+
+        for vdata, mat, state, triangles in geoms:
+            vdata = GeomVertexData(vdata)
+            vdata.transform_vertices(mat)
+            for batch in self.batches:
+                if batch.matches(vdata.get_format(), state):
+                    break
+            else:
+                batch = StaticBatch(vdata.get_format(), state)
+                self.batches.append(batch)
+            batch.add(vdata, triangles)
+        self.pieces.append(obj)
+
+        if obj.collide_bits == MAP_COLLIDE_BIT:
+            body_mat = obj.node.get_mat(self.scene)
+            for i in xrange(obj.solid.get_num_shapes()):
+                xform = TransformState.make_mat(obj.solid.get_shape_mat(i) * body_mat)
+                self.shapes.append((obj.solid.get_shape(i), xform))
+        return True
+
+    def create_node(self):
+        geom_node = GeomNode(self.name)
+        for batch in self.batches:
+            geom_node.add_geom(batch.make_geom(self.name), batch.state)
+        # The merged geoms hold everything needed from here on.
+        for batch in self.batches:
+            batch.vertices = None
+            batch.indices = None
+        return NodePath(geom_node)
+
+    def create_solid(self):
+        node = BulletRigidBodyNode(self.name)
+        for shape, xform in self.shapes:
+            node.add_shape(shape, xform)
+        self.shapes = []
+        return node
@@ -0,0 +1,278 @@
+"""
+Network transports for the game server.
+
+A transport owns the server's TCP and UDP sockets and turns whatever happens on them into a list of events for the
+server to handle once per tick:
+
+    (EVENT_CONNECT, session, None)     a client connected
+    (EVENT_DISCONNECT, session, None)  a client went away
+    (EVENT_TCP, session, data)         a datagram arrived over a client's TCP connection
+    (EVENT_UDP, address, data)         a datagram arrived over UDP from the given address
+
+PandaTransport polls Panda's queued connection classes from the tick. ThreadedTransport does its socket I/O on a
+thread of its own and hands events over through a queue, so the simulation never waits on the network and the
+network is never paced by the simulation. Both speak Panda's framing on the wire, so clients can't tell them apart.
+"""
+import errno
+import select
+import socket
+import struct
+import threading
+import Queue
+from panda3d.core import QueuedConnectionManager, QueuedConnectionListener, QueuedConnectionReader, \
+    ConnectionWriter, PointerToConnection, NetAddress, NetDatagram, Datagram
+
+EVENT_CONNECT = 1
+EVENT_DISCONNECT = 2
+EVENT_TCP = 3
+EVENT_UDP = 4
+
+LISTEN_BACKLOG = 1000
+SELECT_TIMEOUT = 0.005
+MAX_UDP_SIZE = 65535
+
+# Panda prefixes TCP datagrams with their length and UDP datagrams with a checksum of their bytes.
+_tcp_header = struct.Struct('<H')
+_udp_header = struct.Struct('<H')
+
+
+class Session (object):
+    """
+    One client's connection to the server.
+    """
+
+    def __init__(self, sid, address):
+        self.sid = sid
+        self.address = address
+
+    def __repr__(self):
+        return 'Session %s (%s:%s)' % (self.sid, self.address[0], self.address[1])
+
+
+class PandaTransport (object):
+    """
+    Polls Panda's QueuedConnectionManager. Sessions are keyed by their remote address, so several players behind
+    one NAT don't get mixed up.
+    """
+
+    def __init__(self, port, udp_port):
+        self.manager = QueuedConnectionManager()
+        self.listener = QueuedConnectionListener(self.manager, 0)
+        self.reader = QueuedConnectionReader(self.manager, 0)
+        self.writer = ConnectionWriter(self.manager, 0)
+        self.sessions = {}
+        self.last_sid = 0
+        self.listener.addConnection(self.manager.openTCPServerRendezvous(port, LISTEN_BACKLOG))
+        self.udp = self.manager.openUDPConnection(udp_port)
+        self.reader.addConnection(self.udp)
+
+    def _key(self, connection):
+        address = connection.getAddress()
+        return address.getIpString(), address.getPort()
+
+    def poll(self):
+        events = []
+        while self.listener.newConnectionAvailable():
+            rendezvous = PointerToConnection()
+            address = NetAddress()
+            new_connection = PointerToConnection()
+            if not self.listener.getNewConnection(rendezvous, address, new_connection):
+                break
+            connection = new_connection.p()
+            connection.setNoDelay(True)
+            self.reader.addConnection(connection)
+            self.last_sid += 1
+            session = Session(self.last_sid, (address.getIpString(), address.getPort()))
+            session.connection = connection
+            self.sessions[self._key(connection)] = session
+            events.append((EVENT_CONNECT, session, None))
+        while self.manager.resetConnectionAvailable():
+            pointer = PointerToConnection()
+            self.manager.getResetConnection(pointer)
+            connection = pointer.p()
+            self.reader.removeConnection(connection)
+            session = self.sessions.pop(self._key(connection), None)
+            if session:
+                events.append((EVENT_DISCONNECT, session, None))
+        while self.reader.dataAvailable():
+            datagram = NetDatagram()
+            if not self.reader.getData(datagram):
+                continue
+            connection = datagram.getConnection()
+            if connection == self.udp:
+                events.append((EVENT_UDP, NetAddress(datagram.getAddress()), datagram.getMessage()))
+            else:
+                session = self.sessions.get(self._key(connection))
+                if session:
+                    events.append((EVENT_TCP, session, datagram.getMessage()))
+        return events
+
+    def send(self, session, data):
+        self.writer.send(Datagram(data), session.connection)
+
+    def send_udp(self, address, data):
+        self.writer.send(Datagram(data), self.udp, address)
+
+    def close(self):
+        for session in self.sessions.values():
+            self.manager.closeConnection(session.connection)
+        self.sessions = {}
+
+
+class SocketSession (Session):
+
+    def __init__(self, sid, address, sock):
+        super(SocketSession, self).__init__(sid, address)
+        self.sock = sock
+        self.incoming = ''
+        self.outgoing = ''
+
+    def read_datagrams(self, data):
+        """
+        Adds bytes read from the socket, and returns the list of complete datagrams they finish.
+        """
+        self.incoming += data
+        datagrams = []
+        while len(self.incoming) >= _tcp_header.size:
+            size = _tcp_header.unpack_from(self.incoming)[0]
+            end = _tcp_header.size + size
+            if len(self.incoming) < end:
+                break
+            datagrams.append(self.incoming[_tcp_header.size:end])
+            self.incoming = self.incoming[end:]
+        return datagrams
+
+
+class ThreadedTransport (object):
+    """
+    Does all socket I/O on a background thread, using select. Incoming traffic is queued as events for poll();
+    outgoing TCP data is written straight away if the socket will take it and otherwise buffered for the I/O
+    thread to finish.
+    """
+
+    def __init__(self, port, udp_port, host=''):
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((host, port))
+        self.tcp.listen(LISTEN_BACKLOG)
+        self.tcp.setblocking(0)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((host, udp_port))
+        self.udp.setblocking(0)
+        self.events = Queue.Queue()
+        self.sessions = {}
+        self.last_sid = 0
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='pavara-transport')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def poll(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Queue.Empty:
+                return events
+
+    def send(self, session, data):
+        with self.lock:
+            if session.sock not in self.sessions:
+                return
+            session.outgoing += _tcp_header.pack(len(data)) + data
+            self._flush(session)
+
+    def send_udp(self, address, data):
+        checksum = sum(bytearray(data)) & 0xFFFF
+        try:
+            self.udp.sendto(_udp_header.pack(checksum) + data, address)
+        except socket.error, e:
+            if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN):
+                print 'UDP SEND TO %s FAILED: %s' % (address, e)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for sock in self.sessions.keys():
+            sock.close()
+        self.tcp.close()
+        self.udp.close()
+
+    def _flush(self, session):
+        # Called with the lock held.
+        try:
+            sent = session.sock.send(session.outgoing)
+            session.outgoing = session.outgoing[sent:]
+        except socket.error, e:
+            if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN):
+                self._drop(session)
+
+    def _drop(self, session):
+        # Called with the lock held.
+        if self.sessions.pop(session.sock, None):
+            session.sock.close()
+            self.events.put((EVENT_DISCONNECT, session, None))
+
+    def _accept(self):
+        try:
+            sock, address = self.tcp.accept()
+        except socket.error:
+            return
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.last_sid += 1
+        session = SocketSession(self.last_sid, address, sock)
+        with self.lock:
+            self.sessions[sock] = session
+        self.events.put((EVENT_CONNECT, session, None))
+
+    def _receive_udp(self):
+        try:
+            data, address = self.udp.recvfrom(MAX_UDP_SIZE)
+        except socket.error:
+            return
+        if len(data) < _udp_header.size:
+            return
+        checksum = _udp_header.unpack_from(data)[0]
+        data = data[_udp_header.size:]
+        if sum(bytearray(data)) & 0xFFFF == checksum:
+            self.events.put((EVENT_UDP, address, data))
+
+    def _receive_tcp(self, session):
+        try:
+            data = session.sock.recv(MAX_UDP_SIZE)
+        except socket.error, e:
+            if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return
+            data = ''
+        if not data:
+            with self.lock:
+                self._drop(session)
+            return
+        for datagram in session.read_datagrams(data):
+            self.events.put((EVENT_TCP, session, datagram))
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                sockets = self.sessions.keys()
+                waiting = [s for s in sockets if self.sessions[s].outgoing]
+            try:
+                readable, writable, _ = select.select([self.tcp, self.udp] + sockets, waiting, [], SELECT_TIMEOUT)
+            except select.error:
+                continue
+            for sock in readable:
+                if sock is self.tcp:
+                    self._accept()
+                elif sock is self.udp:
+                    self._receive_udp()
+                else:
+                    session = self.sessions.get(sock)
+                    if session:
+                        self._receive_tcp(session)
+            with self.lock:
+                for sock in writable:
+                    session = self.sessions.get(sock)
+                    if session and session.outgoing:
+                        self._flush(session)
@@ -1,26 +1,34 @@
-from math import pi, sin, cos
-from panda3d.core import Vec3, Geom, GeomNode, GeomVertexFormat, GeomVertexWriter, GeomVertexData
+from array import array
+from math import pi, sin, cos, sqrt
+from panda3d.core import Vec3, Geom, GeomNode, GeomVertexFormat, GeomVertexData
 from panda3d.core import GeomTriangles, LRotationf, LVector3f, Point3
 import random
 
 class InvalidPrimitive (Exception):
     pass
 
-class VertexDataWriter (object):
-
-    def __init__(self, vdata):
-        self.count = 0
-        self.vertex = GeomVertexWriter(vdata, 'vertex')
-        self.normal = GeomVertexWriter(vdata, 'normal')
-        self.color = GeomVertexWriter(vdata, 'color')
-        self.texcoord = GeomVertexWriter(vdata, 'texcoord')
-
-    def add_vertex(self, point, normal, color, texcoord):
-        self.vertex.add_data3f(point)
-        self.normal.add_data3f(normal)
-        self.color.add_data4f(*color)
-        self.texcoord.add_data2f(*texcoord)
-        self.count += 1
+# Every vertex is one row of 12 floats: position, normal, color and texcoord, the layout of v3n3c4t2.
+ROW_SIZE = 12
+# Every vertex gets the same texcoord.
+TEXCOORD = (0.0, 1.0)
+
+def face_normal(points):
+    """
+    The normal of the polygon through the given (x, y, z) tuples, ignoring repeated points. Polygons with fewer
+    than three distinct points face up.
+    """
+    seen = set()
+    points = [p for p in points if p not in seen and not seen.add(p)]
+    if len(points) < 3:
+        return tuple(Vec3.up())
+    (x0, y0, z0), (x1, y1, z1), (x2, y2, z2) = points[:3]
+    ax, ay, az = x0 - x1, y0 - y1, z0 - z1
+    bx, by, bz = x1 - x2, y1 - y2, z1 - z2
+    nx, ny, nz = ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx
+    length = sqrt(nx * nx + ny * ny + nz * nz)
+    if not length:
+        return (nx, ny, nz)
+    return (nx / length, ny / length, nz / length)
 
 class Polygon (object):
 
@@ -28,45 +36,43 @@ class Polygon (object):
         self.points = points or []
 
     def get_normal(self):
-        seen = set()
-        points = [p for p in self.points if p not in seen and not seen.add(p)]
-        if len(points) >= 3:
-            v1 = points[0] - points[1]
-            v2 = points[1] - points[2]
-            normal = v1.cross(v2)
-            normal.normalize()
-        else:
-            normal = Vec3.up()
-        return normal
+        return Vec3(*face_normal([(p[0], p[1], p[2]) for p in self.points]))
 
 class GeomBuilder(object):
+    """
+    Builds static, indexed triangle geometry. Polygons are collected into flat arrays as they are added, and only
+    copied into Panda's vertex and index arrays, in one go each, when the Geom is asked for. Vertices that are the
+    same in every respect are shared between polygons.
+    """
 
     def __init__(self, name='tris'):
         self.name = name
-        self.vdata = GeomVertexData(name, GeomVertexFormat.get_v3n3cpt2(), Geom.UHDynamic)
-        self.writer = VertexDataWriter(self.vdata)
-        self.tris = GeomTriangles(Geom.UHDynamic)
+        self.vertices = array('f')
+        self.indices = array('I')
+        self.rows = {}
+
+    def _add_vertex(self, row):
+        index = self.rows.get(row)
+        if index is None:
+            index = self.rows[row] = len(self.vertices) // ROW_SIZE
+            self.vertices.extend(row)
+        return index
 
     def _commit_polygon(self, poly, color):
         """
         Transmutes colors and vertices for tris and quads into visible geometry.
         """
-        point_id = self.writer.count
-        for p in poly.points:
-            self.writer.add_vertex(p, poly.get_normal(), color, (0.0, 1.0))
-        if len(poly.points) == 3:
-            self.tris.add_consecutive_vertices(point_id, 3)
-            self.tris.close_primitive()
-        elif len(poly.points) == 4:
-            self.tris.add_vertex(point_id)
-            self.tris.add_vertex(point_id + 1)
-            self.tris.add_vertex(point_id + 3)
-            self.tris.close_primitive()
-            self.tris.add_consecutive_vertices(point_id + 1, 3)
-            self.tris.close_primitive()
-        else:
+        points = [(p[0], p[1], p[2]) for p in poly.points]
+        if len(points) not in (3, 4):
             raise InvalidPrimitive
-            
+        # The normal, color and texcoord are the same for every vertex of a polygon.
+        rest = face_normal(points) + tuple(color) + TEXCOORD
+        ids = [self._add_vertex(p + rest) for p in points]
+        if len(ids) == 3:
+            self.indices.extend(ids)
+        else:
+            self.indices.extend((ids[0], ids[1], ids[3], ids[1], ids[2], ids[3]))
+
     def add_tri(self, color, points):
         self._commit_polygon(Polygon(points), color)
         self._commit_polygon(Polygon(points[::-1]), color)
@@ -289,8 +295,20 @@ class GeomBuilder(object):
         return self
     
     def get_geom(self):
-        geom = Geom(self.vdata)
-        geom.add_primitive(self.tris)
+        rows = len(self.vertices) // ROW_SIZE
+        vdata = GeomVertexData(self.name, GeomVertexFormat.get_v3n3c4t2(), Geom.UHStatic)
+        vdata.set_num_rows(rows)
+        vdata.modify_array(0).modify_handle().set_data(self.vertices.tostring())
+        tris = GeomTriangles(Geom.UHStatic)
+        if rows > 0xFFFF:
+            tris.set_index_type(Geom.NT_uint32)
+            indices = self.indices
+        else:
+            tris.set_index_type(Geom.NT_uint16)
+            indices = array('H', self.indices)
+        tris.modify_vertices(len(indices)).modify_handle().set_data(indices.tostring())
+        geom = Geom(vdata)
+        geom.add_primitive(tris)
         return geom
 
     def get_geom_node(self):
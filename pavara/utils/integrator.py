@@ -1,5 +1,10 @@
+from array import array
 from panda3d.core import Point3, Vec3
 
+# Doubles kept per body by BatchIntegrator: position, velocity, acceleration, speed limit, position before the last
+# step.
+BODY_SIZE = 13
+
 
 class Integrator(object):
     """Integrator is based on a game physics article. It's supposedly much less
@@ -10,6 +15,9 @@ class Integrator(object):
 
     def __init__(self, accel):
         self.accel = accel
+        # Unless a subclass works its acceleration out from x and v, it is self.accel for the whole step (though
+        # it may change between steps), and integrate can take the exact closed-form step instead of RK4.
+        self.constant = self.__class__.acceleration.im_func is Integrator.acceleration.im_func
 
     def acceleration(self, x, v, dt):
         return self.accel
@@ -24,6 +32,8 @@ class Integrator(object):
         return dx, dv
 
     def integrate(self, x, v, dt):
+        if self.constant:
+            return x + (v + self.accel * (dt * 0.5)) * dt, v + self.accel * dt
         dxa, dva = self.evaluate(x, v, 0.0, Vec3(0, 0, 0), Vec3(0,0,0))
         dxb, dvb = self.evaluate(x, v, dt*0.5, dxa, dva)
         dxc, dvc = self.evaluate(x, v, dt*0.5, dxb, dvb)
@@ -49,3 +59,95 @@ class Friction(Integrator):
             return direction * self.friction * 70
         else:
             return direction * self.friction * 70
+
+
+class BatchIntegrator(object):
+    """
+    Moves many bodies under constant acceleration, like projectiles, all in one go. Each body's position, velocity
+    and acceleration are kept in one flat array of doubles, and step advances every body and moves its node,
+    without building any vectors along the way.
+
+    With acceleration that doesn't change over a step, RK4 (see Integrator) comes out to exactly
+    x + v*dt + a*dt*dt/2, which is what this does.
+    """
+
+    def __init__(self):
+        self.bodies = []
+        self.slots = {}
+        self.state = array('d')
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def __contains__(self, obj):
+        return obj in self.slots
+
+    def add(self, obj, velocity, accel=Vec3(0, 0, 0), limit=0.0):
+        """
+        Starts moving obj from where its node is. It only accelerates while its speed is at most limit, if a
+        limit is given.
+        """
+        if obj in self.slots:
+            self.remove(obj)
+        pos = obj.node.get_pos()
+        self.slots[obj] = len(self.bodies)
+        self.bodies.append(obj)
+        self.state.extend((pos[0], pos[1], pos[2], velocity[0], velocity[1], velocity[2],
+                           accel[0], accel[1], accel[2], limit, pos[0], pos[1], pos[2]))
+
+    def remove(self, obj):
+        slot = self.slots.pop(obj, None)
+        if slot is None:
+            return
+        # Move the last body into the gap, so the array stays packed.
+        last = self.bodies.pop()
+        start = slot * BODY_SIZE
+        end = len(self.state) - BODY_SIZE
+        if last is not obj:
+            self.bodies[slot] = last
+            self.slots[last] = slot
+            self.state[start:start + BODY_SIZE] = self.state[end:]
+        del self.state[end:]
+
+    def velocity(self, obj):
+        i = self.slots[obj] * BODY_SIZE
+        return Vec3(self.state[i + 3], self.state[i + 4], self.state[i + 5])
+
+    def place(self, obj, pos):
+        """
+        Puts obj (and its node) at pos, as though it had got there in the last step.
+        """
+        i = self.slots[obj] * BODY_SIZE
+        self.state[i:i + 3] = array('d', (pos[0], pos[1], pos[2]))
+        obj.node.set_pos(pos)
+
+    def paths(self):
+        """
+        Yields (body, start, end) for each body, where it went in the last step.
+        """
+        state = self.state
+        for slot, obj in enumerate(self.bodies):
+            i = slot * BODY_SIZE
+            yield obj, Point3(state[i + 10], state[i + 11], state[i + 12]), Point3(state[i], state[i + 1], state[i + 2])
+
+    def set_acceleration(self, obj, accel):
+        i = self.slots[obj] * BODY_SIZE + 6
+        self.state[i:i + 3] = array('d', (accel[0], accel[1], accel[2]))
+
+    def step(self, dt):
+        state = self.state
+        half_dt = dt * 0.5
+        for slot, obj in enumerate(self.bodies):
+            i = slot * BODY_SIZE
+            x, y, z, vx, vy, vz, ax, ay, az, limit = state[i:i + 10]
+            state[i + 10:i + 13] = state[i:i + 3]
+            if limit and vx * vx + vy * vy + vz * vz > limit * limit:
+                ax = ay = az = 0.0
+            x += (vx + ax * half_dt) * dt
+            y += (vy + ay * half_dt) * dt
+            z += (vz + az * half_dt) * dt
+            vx += ax * dt
+            vy += ay * dt
+            vz += az * dt
+            state[i:i + 6] = array('d', (x, y, z, vx, vy, vz))
+            obj.node.set_fluid_pos(x, y, z)
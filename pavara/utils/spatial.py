@@ -0,0 +1,157 @@
+from math import floor, sqrt
+
+
+class SpatialGrid (object):
+    """
+    A uniform grid over the ground (X/Z) plane, bucketing keys by position so that queries only look at nearby cells
+    instead of every object in the world. Each key may have a radius, making it a sphere rather than a point; keys
+    are bucketed by their centers, and queries look far enough past their edges to catch the largest sphere.
+    """
+
+    def __init__(self, cell_size=16.0):
+        self.cell_size = float(cell_size)
+        self.clear()
+
+    def _cell(self, x, z):
+        return int(floor(x / self.cell_size)), int(floor(z / self.cell_size))
+
+    def clear(self):
+        self.cells = {}
+        self.positions = {}
+        self.radii = {}
+        self.key_cells = {}
+        self.max_radius = 0.0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def insert(self, key, pos, radius=0.0):
+        if key in self.positions:
+            self.remove(key)
+        pos = (pos[0], pos[1], pos[2])
+        cell = self._cell(pos[0], pos[2])
+        self.positions[key] = pos
+        self.radii[key] = radius
+        self.key_cells[key] = cell
+        self.cells.setdefault(cell, []).append(key)
+        self.max_radius = max(self.max_radius, radius)
+
+    def move(self, key, pos):
+        """
+        Updates the position of a key that has already been inserted.
+        """
+        pos = (pos[0], pos[1], pos[2])
+        self.positions[key] = pos
+        cell = self._cell(pos[0], pos[2])
+        old = self.key_cells[key]
+        if cell != old:
+            self._unbucket(key, old)
+            self.key_cells[key] = cell
+            self.cells.setdefault(cell, []).append(key)
+
+    def remove(self, key):
+        if key not in self.positions:
+            return
+        self._unbucket(key, self.key_cells.pop(key))
+        del self.positions[key]
+        del self.radii[key]
+
+    def _unbucket(self, key, cell):
+        bucket = self.cells[cell]
+        bucket.remove(key)
+        if not bucket:
+            del self.cells[cell]
+
+    def _cells_around(self, x, z, reach):
+        min_x, min_z = self._cell(x - reach, z - reach)
+        max_x, max_z = self._cell(x + reach, z + reach)
+        for i in xrange(min_x, max_x + 1):
+            for j in xrange(min_z, max_z + 1):
+                bucket = self.cells.get((i, j))
+                if bucket:
+                    yield bucket
+
+    def distance(self, key, point):
+        """
+        How far point is from the surface of the key's sphere (zero if it is inside).
+        """
+        x, y, z = self.positions[key]
+        d = sqrt((x - point[0]) ** 2 + (y - point[1]) ** 2 + (z - point[2]) ** 2)
+        return max(0.0, d - self.radii[key])
+
+    def query_sphere(self, center, radius):
+        """
+        Returns the list of keys whose spheres come within radius of center.
+        """
+        cx, cy, cz = center[0], center[1], center[2]
+        found = []
+        for bucket in self._cells_around(cx, cz, radius + self.max_radius):
+            for key in bucket:
+                x, y, z = self.positions[key]
+                reach = radius + self.radii[key]
+                if (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2 <= reach * reach:
+                    found.append(key)
+        return found
+
+    def nearest(self, center, max_distance=None, predicate=None):
+        """
+        Returns the key whose sphere is closest to center (and for which predicate, if given, is true), or None if
+        there is none within max_distance. Searches outwards one ring of cells at a time.
+        """
+        if not self.cells:
+            return None
+        cx, cz = self._cell(center[0], center[2])
+        # How many rings out the farthest occupied cell is.
+        rings = max(max(abs(i - cx), abs(j - cz)) for i, j in self.cells)
+        if max_distance is not None:
+            rings = min(rings, int((max_distance + self.max_radius) / self.cell_size) + 1)
+        best = None
+        best_distance = max_distance
+        for ring in xrange(rings + 1):
+            # Nothing in this ring or beyond can be closer than this.
+            if best is not None and (ring - 1) * self.cell_size - self.max_radius > best_distance:
+                break
+            for i in xrange(cx - ring, cx + ring + 1):
+                step = 1 if abs(i - cx) == ring else 2 * ring
+                for j in xrange(cz - ring, cz + ring + 1, step or 1):
+                    for key in self.cells.get((i, j), ()):
+                        if predicate and not predicate(key):
+                            continue
+                        d = self.distance(key, center)
+                        if best_distance is None or d < best_distance:
+                            best, best_distance = key, d
+        return best
+
+    def query_segment(self, start, end, radius=0.0):
+        """
+        Returns (t, key) for every key whose sphere comes within radius of the segment from start to end, where t
+        is how far along the segment (0 to 1) it comes closest, sorted by t.
+        """
+        sx, sy, sz = start[0], start[1], start[2]
+        dx, dy, dz = end[0] - sx, end[1] - sy, end[2] - sz
+        length_sq = dx * dx + dy * dy + dz * dz
+        reach = radius + self.max_radius
+        # Visit every cell within reach of the segment by stepping along it half a cell at a time.
+        steps = int(sqrt(dx * dx + dz * dz) / (self.cell_size * 0.5)) + 1
+        seen = set()
+        found = []
+        for s in xrange(steps + 1):
+            f = s / float(steps)
+            for bucket in self._cells_around(sx + dx * f, sz + dz * f, reach + self.cell_size * 0.5):
+                for key in bucket:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    x, y, z = self.positions[key]
+                    t = 0.0
+                    if length_sq:
+                        t = max(0.0, min(1.0, ((x - sx) * dx + (y - sy) * dy + (z - sz) * dz) / length_sq))
+                    px, py, pz = sx + dx * t - x, sy + dy * t - y, sz + dz * t - z
+                    hit = radius + self.radii[key]
+                    if px * px + py * py + pz * pz <= hit * hit:
+                        found.append((t, key))
+        found.sort(key=lambda hit: hit[0])
+        return found
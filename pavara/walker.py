@@ -4,6 +4,7 @@ from direct.actor.Actor import Actor
 from direct.interval.IntervalGlobal import *
 from pavara.world import *
 from pavara.projectiles import *
+from pavara.character import CharacterController
 
 TOP_LEG_LENGTH = 1
 BOTTOM_LEG_LENGTH = 1.21
@@ -16,6 +17,15 @@ GRENADE_OFFSET = [0, .3, -.8]
 SIGHTS_FRIENDLY_COLOR = [14.0/255.0, 114.0/255.0, 26.0/255.0, 1]
 SIGHTS_ENEMY_COLOR = [217.0/255.0, 24.0/255.0, 24.0/255.0, 1]
 
+# Levels of detail a walker can be animated at (see Walker.detail): everything; legs without probing for the floor
+# or footstep sounds; nothing at all, leaving it frozen mid-stride.
+DETAIL_FULL = 2
+DETAIL_REDUCED = 1
+DETAIL_FROZEN = 0
+# Distances from the camera past which walkers are animated in less detail.
+REDUCED_DETAIL_DISTANCE = 40
+FROZEN_DETAIL_DISTANCE = 200
+
 MIN_WALKFUNC_SIZE_FACTOR = .001
 MAX_WALKFUNC_SIZE_FACTOR = 22
 WALKFUNC_STEPS = 14
@@ -48,11 +58,11 @@ class LoadedMissile (object):
     def can_fire(self):
         return self.missile_loaded
 
-    def fire(self, world):
+    def fire(self, world, lag=0.0, shooter=None):
         origin = self.loaded_missile.get_pos(world.scene)
         hpr = self.loaded_missile.get_hpr(world.scene)
         #hpr += head_angle
-        world.attach(Missile(origin, hpr, self.color))
+        world.spawn(Missile, origin, hpr, self.color, lag=lag, shooter=shooter)
         self.missile_loaded = False
         self.loaded_missile.hide()
 
@@ -87,7 +97,7 @@ class LoadedGrenade (object):
     def fire(self, world, walker_v):
         origin = self.loaded_grenade.get_pos(world.scene)
         hpr = self.loaded_grenade.get_hpr(world.scene)
-        world.attach(Grenade(origin, hpr, self.color, walker_v))
+        world.spawn(Grenade, origin, hpr, self.color, walker_v)
         self.grenade_loaded = False
         self.loaded_grenade.hide()
 
@@ -138,12 +148,7 @@ class Sights (object):
         result = self.physics.ray_test_closest(pfrom, pto, MAP_COLLIDE_BIT | SOLID_COLLIDE_BIT)
         if result.has_hit():
             sight.set_pos(self.scene, result.get_hit_pos())
-            obj = False
-            nodename = result.get_node().get_name()
-            try:
-                obj = self.world.objects[nodename]
-            except:
-                raise
+            obj = self.world.object_for_node(result.get_node())
             hostile = getattr(obj, 'hostile', False)
             if hostile is False:
                 self.enemy(sight)
@@ -160,7 +165,7 @@ class Sights (object):
 
 class LegBones (object):
 
-    def __init__(self, scene, physics, hip, foot, foot_ref, top, bottom):
+    def __init__(self, scene, controller, hip, foot, foot_ref, top, bottom):
         self.foot_bone = foot
         self.foot_ref = foot_ref
         self.foot_ref.set_hpr(self.foot_ref, 90, 0, 0)
@@ -176,7 +181,7 @@ class LegBones (object):
         self.hip_rest = self.hip_bone.get_pos()
         self.is_on_ground = False
         self.scene = scene
-        self.physics = physics
+        self.controller = controller
         self.top_bone_target_angle = self.top_bone.get_p()
         print "top bone angle: %s" % self.top_bone_target_angle
         self.bottom_bone_target_angle = self.bottom_bone.get_p()
@@ -254,18 +259,14 @@ class LegBones (object):
 
 
     def get_floor_spot(self):
-        l_from = self.foot_bone.get_pos(self.scene)
-        l_to = self.foot_bone.get_pos(self.scene)
-        l_from.y += 1
-        l_to.y -= .7
-        result = self.physics.ray_test_closest(l_from, l_to, MAP_COLLIDE_BIT | SOLID_COLLIDE_BIT)
-        if result.has_hit():
-            return self.foot_ref.get_relative_point(self.scene, result.get_hit_pos())
+        hit = self.controller.floor(self, self.foot_bone.get_pos(self.scene))
+        if hit is not None:
+            return self.foot_ref.get_relative_point(self.scene, hit)
         else:
             return None
 
-    def ik_leg(self):
-        floor_pos = self.get_floor_spot()
+    def ik_leg(self, probe=True):
+        floor_pos = self.get_floor_spot() if probe else None
         target_pos = self._get_target_pos()
         hip_pos = self.hip_bone.get_pos(self.foot_ref)
 
@@ -316,6 +317,8 @@ class Skeleton (object):
         self.walk_playing = False
         self.lf_sound_played = False
         self.rf_sound_played = False
+        self.lf_sound = None
+        self.rf_sound = None
 
 
     def _move_shoulder(self, data, shoulder):
@@ -335,16 +338,20 @@ class Skeleton (object):
 
     def setup_footsteps(self, audio3d):
         if audio3d is not None:
-            self.lf_sound = audio3d.loadSfx('Sounds/step_mono.wav')
+            self.lf_sound = load_sound(audio3d, 'Sounds/step_mono.wav')
             self.lf_sound.set_balance(0)
             audio3d.attachSoundToObject(self.lf_sound, self.left_leg.foot_bone)
             self.lf_played_since = 0
-            self.rf_sound = audio3d.loadSfx('Sounds/step_mono.wav')
+            self.rf_sound = load_sound(audio3d, 'Sounds/step_mono.wav')
             self.rf_sound.set_balance(0)
             audio3d.attachSoundToObject(self.rf_sound, self.right_leg.foot_bone)
             self.rf_played_since = 0
 
-    def update_legs(self, walk, dt, scene, physics):
+    def update_legs(self, walk, dt, scene, physics, probe=True):
+        """
+        Moves the legs along the walk cycle. Unless probe is set, they don't look for the floor to step on, and so
+        never land and make no footstep sounds.
+        """
         if self.crouch_factor > 0:
             self.left_leg.crouch_factor = self.crouch_factor
             self.right_leg.crouch_factor = self.crouch_factor
@@ -356,14 +363,16 @@ class Skeleton (object):
                 leg.walkfunc_sizeparam = MAX_WALKFUNC_SIZE_FACTOR
                 leg._increment_walk_seq_step(walk)
                 leg._recompute_walkfunc_x()
-                leg.ik_leg()
+                leg.ik_leg(probe)
             if self.left_leg.is_on_ground and not self.lf_sound_played:
-                self.lf_sound.play()
+                if self.lf_sound:
+                    self.lf_sound.play()
                 self.lf_sound_played = True
             if not self.left_leg.is_on_ground:
                 self.lf_sound_played = False
             if self.right_leg.is_on_ground and not self.rf_sound_played:
-                self.rf_sound.play()
+                if self.rf_sound:
+                    self.rf_sound.play()
                 self.rf_sound_played = True
             if not self.right_leg.is_on_ground:
                 self.rf_sound_played = False
@@ -372,15 +381,16 @@ class Skeleton (object):
             for leg in [self.left_leg, self.right_leg]:
                 leg.walkfunc_sizeparam = .001
                 leg._recompute_walkfunc_x()
-                leg.ik_leg()
+                leg.ik_leg(probe)
 
 
 class Walker (PhysicalObject):
 
     collide_bits = SOLID_COLLIDE_BIT
+    flags = WALKER_FLAG
 
-    def __init__(self, incarnator, colordict=None, player=False):
-        super(Walker, self).__init__()
+    def __init__(self, incarnator, colordict=None, player=False, name=None):
+        super(Walker, self).__init__(name)
         self.spawn_point = incarnator
         self.on_ground = False
         self.mass = 150.0 # 220.0 for heavy
@@ -412,12 +422,16 @@ class Walker (PhysicalObject):
         self.player = player
         self.can_jump = False
         self.crouch_impulse = 0
+        self.input_driven = False
+        # How far behind the server this walker's player sees the world, for lag compensation.
+        self.view_lag = 0.0
+        self.hit_nodes = []
 
     def get_model_part(self, obj_name):
         return self.actor.find("**/%s" % obj_name)
 
     def create_node(self):
-        self.actor = Actor('walker.egg')
+        self.actor = load_actor('walker.egg')
         if self.colordict:
             self.setup_color(self.colordict)
         self.actor.set_pos(*self.spawn_point.pos)
@@ -432,6 +446,7 @@ class Walker (PhysicalObject):
 
     def create_solid(self):
         walker_capsule = BulletGhostNode(self.name + "_walker_cap")
+        walker_capsule.set_python_tag('handle', self.handle)
         self.walker_capsule_shape = BulletCylinderShape(.7, .2, YUp)
         walker_bullet_np = self.actor.attach_new_node(walker_capsule)
         walker_bullet_np.node().add_shape(self.walker_capsule_shape)
@@ -440,6 +455,7 @@ class Walker (PhysicalObject):
         walker_bullet_np.wrt_reparent_to(self.actor)
         self.world.physics.attach_ghost(walker_capsule)
         walker_bullet_np.node().setIntoCollideMask(GHOST_COLLIDE_BIT)
+        self.hit_nodes.append(walker_bullet_np)
         return None
 
     def setup_shape(self, gnodepath, bone, pname):
@@ -450,11 +466,13 @@ class Walker (PhysicalObject):
         shape.add_geom(geom)
 
         node = BulletRigidBodyNode(self.name + pname)
+        node.set_python_tag('handle', self.handle)
         np = self.actor.attach_new_node(node)
         np.node().add_shape(shape)
         np.node().set_kinematic(True)
         np.wrt_reparent_to(bone)
         self.world.physics.attach_rigid_body(node)
+        self.hit_nodes.append(np)
         return np
 
     def setup_color(self, colordict):
@@ -480,6 +498,8 @@ class Walker (PhysicalObject):
 
     def attached(self):
         self.integrator = Integrator(self.world.gravity)
+        self.controller = CharacterController(self.world, self.walker_capsule_shape, self.collides_with,
+                                              self.head_height)
         #self.world.register_collider(self)
         self.world.register_updater(self)
 
@@ -496,14 +516,14 @@ class Walker (PhysicalObject):
         #pelvis_bone.attach_new_node(right_foot_bone_origin_ref)
 
         left_bones = LegBones(
-            self.world.scene, self.world.physics,
+            self.world.scene, self.controller,
             self.actor.exposeJoint(None, 'modelRoot', 'left_hip_bone'),
             left_foot_bone,
             left_foot_bone_origin_ref,
             *[self.actor.controlJoint(None, 'modelRoot', name) for name in ['left_top_bone', 'left_bottom_bone']]
         )
         right_bones = LegBones(
-            self.world.scene, self.world.physics,
+            self.world.scene, self.controller,
             self.actor.exposeJoint(None, 'modelRoot', 'right_hip_bone'),
             right_foot_bone,
             right_foot_bone_origin_ref,
@@ -560,7 +580,7 @@ class Walker (PhysicalObject):
 
     def handle_fire(self):
         if self.loaded_missile.can_fire():
-            self.loaded_missile.fire(self.world)
+            self.loaded_missile.fire(self.world, self.view_lag, self)
         elif self.loaded_grenade.can_fire():
             walker_v = self.xz_velocity
             walker_v.y = self.y_velocity.y
@@ -583,18 +603,32 @@ class Walker (PhysicalObject):
                     return
                 self.right_gun_charge = 0
             hpr.y += 180
-            plasma = self.world.attach(Plasma(origin, hpr, p_energy))
-
-    def st_result(self, cur_pos, new_pos):
-        return self.world.physics.sweepTestClosest(self.walker_capsule_shape, cur_pos, new_pos, self.collides_with, 0)
-
-    def update(self, dt):
+            self.world.spawn(Plasma, origin, hpr, p_energy, lag=self.view_lag, shooter=self)
+
+    def get_motion_state(self):
+        """
+        Everything simulate() depends on besides input, for client-side prediction to rewind to.
+        """
+        return (self.position(), self.node.get_h(), Vec3(self.xz_velocity), Vec3(self.y_velocity), self.on_ground)
+
+    def set_motion_state(self, state):
+        pos, h, xz_velocity, y_velocity, on_ground = state
+        self.move(pos)
+        self.node.set_h(h)
+        self.xz_velocity = Vec3(xz_velocity)
+        self.y_velocity = Vec3(y_velocity)
+        self.on_ground = on_ground
+
+    def simulate(self, dt):
+        """
+        Moves the walker for dt seconds according to its current movement: turning, walking, falling, landing on
+        the ground and sliding along walls. Has no visual side effects, so it can be replayed for prediction.
+        """
         dt = min(dt, 0.2) # let's just temporarily assume that if we're getting less than 5 fps, dt must be wrong.
         yaw = self.movement['left'] + self.movement['right']
         self.rotate_by(yaw * dt * 60, 0, 0)
         walk = self.movement['forward'] + self.movement['backward']
         start = self.position()
-        cur_pos_ts = TransformState.make_pos(self.position() + self.head_height)
 
         if self.on_ground:
             friction = DEFAULT_FRICTION
@@ -611,51 +645,64 @@ class Walker (PhysicalObject):
         newpos, self.xz_velocity = Friction(direction, friction).integrate(pos, self.xz_velocity, dt)
         self.move(newpos)
 
-        # Cast a ray from just above our feet to just below them, see if anything hits.
-        pt_from = self.position() + Vec3(0, 1, 0)
-        pt_to = pt_from + Vec3(0, -1.1, 0)
-        result = self.world.physics.ray_test_closest(pt_from, pt_to, MAP_COLLIDE_BIT | SOLID_COLLIDE_BIT)
+        # Look from just above our feet to just below them for something to stand on.
+        ground = self.controller.ground(self.position())
 
-        # this should return 'on ground' information
-        self.skeleton.update_legs(walk, dt, self.world.scene, self.world.physics)
-
-        if self.y_velocity.get_y() <= 0 and result.has_hit():
+        if self.y_velocity.get_y() <= 0 and ground is not None:
             self.on_ground = True
             self.crouch_impulse = self.y_velocity.y
             self.y_velocity = Vec3(0, 0, 0)
-            self.move(result.get_hit_pos())
-            self.skeleton.left_leg_on_ground = True
-            self.skeleton.right_leg_on_ground = True
+            self.move(ground)
         else:
             self.on_ground = False
             current_y = Point3(0, self.position().get_y(), 0)
             y, self.y_velocity = self.integrator.integrate(current_y, self.y_velocity, dt)
             self.move(self.position() + (y - current_y))
 
+        #if self.crouch_impulse < 0:
+
+        pos, self.xz_velocity = self.controller.slide(start, self.position(), self.xz_velocity)
+        self.move(pos)
+
+    def detail(self):
+        """
+        How much of this walker's animation is worth doing: DETAIL_FULL close to the camera, DETAIL_REDUCED further
+        off, and DETAIL_FROZEN when it is out of sight or too far away to make out. Walkers in a world with no
+        camera, like the server's, where leg poses decide what shots hit, and our own walker are always animated
+        in full.
+        """
+        camera = self.world.camera
+        if camera is None or self.player:
+            return DETAIL_FULL
+        distance = self.node.get_distance(camera)
+        if distance > FROZEN_DETAIL_DISTANCE or not self.world.in_view(self.node):
+            return DETAIL_FROZEN
+        if distance > REDUCED_DETAIL_DISTANCE:
+            return DETAIL_REDUCED
+        return DETAIL_FULL
+
+    def update(self, dt):
+        dt = min(dt, 0.2) # let's just temporarily assume that if we're getting less than 5 fps, dt must be wrong.
+        # Walkers belonging to remote players are moved as their input arrives, not every frame.
+        if not self.input_driven:
+            self.simulate(dt)
+        walk = self.movement['forward'] + self.movement['backward']
+
+        detail = self.detail()
+        probe = detail == DETAIL_FULL
+
+        # this should return 'on ground' information
+        if detail != DETAIL_FROZEN:
+            self.skeleton.update_legs(walk, dt, self.world.scene, self.world.physics, probe)
+
         if self.crouching and self.skeleton.crouch_factor < 1:
             self.skeleton.crouch_factor += (dt*60)/10
-            self.skeleton.update_legs(0, dt, self.world.scene, self.world.physics)
+            if detail != DETAIL_FROZEN:
+                self.skeleton.update_legs(0, dt, self.world.scene, self.world.physics, probe)
         elif not self.crouching and self.skeleton.crouch_factor > 0:
             self.skeleton.crouch_factor -= (dt*60)/10
-            self.skeleton.update_legs(0, dt, self.world.scene, self.world.physics)
-
-        #if self.crouch_impulse < 0:
-
-        goal = self.position()
-        adj_dist = abs((start - goal).length())
-        new_pos_ts = TransformState.make_pos(self.position() + self.head_height)
-
-        sweep_result = self.st_result(cur_pos_ts, new_pos_ts)
-        count = 0
-        while sweep_result.has_hit() and count < 10:
-            moveby = sweep_result.get_hit_normal()
-            self.xz_velocity = -self.xz_velocity.cross(moveby).cross(moveby)
-            moveby.normalize()
-            moveby *= adj_dist * (1 - sweep_result.get_hit_fraction())
-            self.move(self.position() + moveby)
-            new_pos_ts = TransformState.make_pos(self.position() + self.head_height)
-            sweep_result = self.st_result(cur_pos_ts, new_pos_ts)
-            count += 1
+            if detail != DETAIL_FROZEN:
+                self.skeleton.update_legs(0, dt, self.world.scene, self.world.physics, probe)
 
         if self.energy > WALKER_MIN_CHARGE_ENERGY:
             if self.left_gun_charge < 1:
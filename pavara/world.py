@@ -1,10 +1,19 @@
 from pavara.constants import *
-from pavara.utils.integrator import Integrator, Friction
+from pavara.utils.integrator import Integrator, Friction, BatchIntegrator
 from pavara.base_objects import *
 from pavara.map_objects import Sky, Dome
 from pavara.utils.geom import to_cartesian
-from panda3d.core import AmbientLight, DirectionalLight, VBase4, Vec3, TransparencyAttrib, CompassEffect, NodePath
-from panda3d.bullet import BulletDebugNode, BulletWorld, BulletGhostNode, BulletSphereShape, BulletRigidBodyNode
+from pavara.lag_compensation import LagCompensator
+from pavara.projectiles import Projectile
+from pavara.debris import Debris
+from pavara.pool import ObjectPool
+from pavara.handles import HandleTable
+from pavara.starfield import build_starfield
+from pavara.static import StaticGeometry, batchable
+from pavara.utils.spatial import SpatialGrid
+from panda3d.core import AmbientLight, DirectionalLight, VBase4, Point3, Vec3, TransparencyAttrib, CompassEffect, \
+    NodePath, BoundingVolume
+from panda3d.bullet import BulletDebugNode, BulletWorld, BulletGhostNode, BulletRigidBodyNode
 import math
 import random
 import string
@@ -14,8 +23,13 @@ class World (object):
     The World models basically everything about a map, including gravity, ambient light, the sky, and all map objects.
     """
 
+    # What the world is seen through, if anything.
+    camera = None
+
     def __init__(self, camera, debug=False, audio3d=None, client=None, server=None):
+        # Objects by name, for maps and the network to refer to them by; everything else goes by handle.
         self.objects = {}
+        self.handles = HandleTable()
 
         self.incarnators = []
 
@@ -24,6 +38,17 @@ class World (object):
         self.updatables = set()
         self.updatables_to_add = set()
         self.garbage = set()
+        self.pools = {}
+        self.static = None
+        # Goes up whenever a body that can't move is taken out of the physics world, so anything remembering what
+        # such bodies were where knows to look again.
+        self.static_version = 0
+        # Where every indexed object is, for proximity queries; the moving ones are re-bucketed every step.
+        self.index = SpatialGrid(SPATIAL_CELL_SIZE)
+        self.moving = set()
+        # Projectiles and anything else flying under constant acceleration, moved together every step.
+        self.ballistics = BatchIntegrator()
+        self.sweep_events = []
         self.scene = NodePath('world')
 
 
@@ -31,6 +56,12 @@ class World (object):
         self.gravity = DEFAULT_GRAVITY
         self.physics = BulletWorld()
         self.physics.set_gravity(self.gravity)
+        # Projectiles need to hear about touching the map, solids and ghosts without sharing their collide bits
+        # (which would put them in the way of walkers' ground rays and the like). This takes the groups-mask filter
+        # algorithm, set in panda_config.prc, which otherwise behaves just like the default mask one.
+        projectile_group = PROJECTILE_COLLIDE_BIT.get_lowest_on_bit()
+        for bit in (MAP_COLLIDE_BIT, SOLID_COLLIDE_BIT, GHOST_COLLIDE_BIT):
+            self.physics.set_group_collision_flag(projectile_group, bit.get_lowest_on_bit(), True)
 
         self.debug = debug
 
@@ -45,6 +76,12 @@ class World (object):
             self.physics.set_debug_node(debug_node)
 
 
+    def in_view(self, node):
+        """
+        Whether any of node can be seen by the camera. Without a camera, everything counts as seen.
+        """
+        return True
+
     def get_incarn(self):
         return random.choice(self.incarnators)
 
@@ -53,7 +90,8 @@ class World (object):
         assert hasattr(obj, 'world') and hasattr(obj, 'name')
         assert obj.name not in self.objects
         obj.world = self
-        if obj.name.startswith('Incarnator'):
+        obj.handle = self.handles.add(obj, obj.flags)
+        if obj.flags & INCARNATOR_FLAG:
             self.incarnators.append(obj)
         if hasattr(obj, 'create_node') and hasattr(obj, 'create_solid'):
             # Let each object define it's own NodePath, then reparent them.
@@ -75,13 +113,114 @@ class World (object):
                     obj.node.reparent_to(self.scene)
             elif obj.solid:
                 obj.node = self.scene.attach_new_node(obj.solid)
-            if obj.solid and obj.collide_bits is not None:
-                obj.solid.set_into_collide_mask(obj.collide_bits)
+            if obj.solid:
+                obj.solid.set_python_tag('handle', obj.handle)
+                if obj.collide_bits is not None:
+                    obj.solid.set_into_collide_mask(obj.collide_bits)
         self.objects[obj.name] = obj
         # Let the object know it has been attached.
         obj.attached()
+        self.index_object(obj)
+        return obj
+
+    def index_object(self, obj):
+        """
+        Adds obj to the spatial index, if it is the kind of object that belongs there, as a sphere around its node.
+        """
+        if not getattr(obj, 'indexed', False) or not obj.node:
+            return
+        bounds = obj.node.get_bounds()
+        radius = 0.0
+        if not bounds.is_empty() and not bounds.is_infinite() and hasattr(bounds, 'get_radius'):
+            radius = bounds.get_radius() + Vec3(bounds.get_center()).length()
+        self.index.insert(obj, obj.position(), radius)
+        if obj in self.updatables or obj in self.updatables_to_add or \
+                (isinstance(obj.solid, BulletRigidBodyNode) and obj.solid.get_mass() > 0):
+            self.moving.add(obj)
+
+    def unindex_object(self, obj):
+        self.index.remove(obj)
+        self.moving.discard(obj)
+
+    def objects_near(self, center, radius):
+        """
+        Returns the indexed objects within radius of center.
+        """
+        return self.index.query_sphere(center, radius)
+
+    def nearest_object(self, center, max_distance=None, predicate=None):
+        """
+        Returns the indexed object nearest to center (and satisfying predicate, if given), or None.
+        """
+        return self.index.nearest(center, max_distance, predicate)
+
+    def objects_along(self, start, end, radius=0.0):
+        """
+        Returns the indexed objects within radius of the segment from start to end, nearest start first.
+        """
+        return [obj for t, obj in self.index.query_segment(start, end, radius)]
+
+    def batch_static(self):
+        """
+        Merges the geometry and collision shapes of every piece of the map that never moves into one StaticGeometry
+        object (see pavara.static). Called once the map has loaded.
+        """
+        static = StaticGeometry(self.scene)
+        for obj in self.objects.values():
+            if batchable(obj):
+                static.add(obj)
+        if not static.pieces:
+            return None
+        for obj in static.pieces:
+            self.physics.remove_rigid_body(obj.solid)
+            obj.node.remove_node()
+            del self.objects[obj.name]
+            self.handles.remove(obj.handle)
+            self.unindex_object(obj)
+        self.static_version += 1
+        self.static = self.attach(static)
+        return self.static
+
+    def spawn(self, cls, *args, **kwargs):
+        """
+        Attaches an object of class cls built with the given arguments, reusing one from the pool if there is one.
+        """
+        pool = self.pools.get(cls)
+        obj = pool.acquire() if pool else None
+        if obj is None:
+            return self.attach(cls(*args, **kwargs))
+        obj.reset(*args, **kwargs)
+        assert obj.name not in self.objects
+        obj.world = self
+        obj.handle = self.handles.add(obj, obj.flags)
+        if obj.solid:
+            obj.solid.set_python_tag('handle', obj.handle)
+            if isinstance(obj.solid, BulletRigidBodyNode):
+                self.physics.attach_rigid_body(obj.solid)
+            elif isinstance(obj.solid, BulletGhostNode):
+                self.physics.attach_ghost(obj.solid)
+        if obj.node:
+            obj.node.reparent_to(self.scene)
+        self.objects[obj.name] = obj
+        obj.attached()
+        self.index_object(obj)
         return obj
 
+    def release(self, obj):
+        """
+        Takes a pooled object that has been thrown out of the world and keeps it for the next spawn of its class.
+        Its physics have already been removed.
+        """
+        self.objects.pop(obj.name, None)
+        pool = self.pools.get(obj.__class__)
+        if pool is None:
+            pool = self.pools[obj.__class__] = ObjectPool(obj.__class__)
+        if pool.release(obj):
+            if obj.node:
+                obj.node.detach_node()
+        elif obj.node:
+            obj.node.remove_node()
+
 
 
     def create_hector(self, name=None):
@@ -98,13 +237,150 @@ class World (object):
         assert isinstance(obj, WorldObject)
         self.updatables_to_add.add(obj)
 
+    def register_collider(self, obj):
+        assert isinstance(obj, PhysicalObject)
+        self.collidables.add(obj)
+
+    def do_explosion(self, node, radius, force):
+        """
+        Pushes, damages or decomposes everything within radius of node, found through the spatial index rather than
+        a contact test against a temporary ghost.
+        """
+        center = node.get_pos(self.scene)
+        for obj in self.objects_near(center, radius):
+            if obj.node == node or obj.flags & EXPLOSIONS_DONT_PUSH:
+                continue
+            # Measured to the object's center; anything within a unit of the blast takes the full force.
+            expl_vec = Vec3(obj.node.get_pos(self.scene) - center)
+            magnitude = force * 1.0 / math.sqrt(max(expl_vec.length(), 1.0))
+            if hasattr(obj, 'decompose'):
+                obj.decompose()
+            elif isinstance(obj.solid, BulletRigidBodyNode):
+                if not expl_vec.normalize():
+                    expl_vec = Vec3(0, 1, 0)
+                obj.solid.set_active(True)
+                obj.solid.apply_central_impulse(expl_vec * magnitude)
+            if hasattr(obj, 'damage'):
+                obj.damage(magnitude / 5)
+
+    def do_plasma_push(self, plasma, obj, energy):
+        if not obj.flags & EXPLOSIONS_DONT_PUSH:
+            if hasattr(obj, 'decompose'):
+                obj.decompose()
+            elif isinstance(obj.solid, BulletRigidBodyNode):
+                solid = obj.solid
+                dummy_node = NodePath('tmp')
+                dummy_node.set_hpr(plasma.hpr)
+                dummy_node.set_pos(plasma.pos)
+                f_vec = self.scene.get_relative_vector(dummy_node, Vec3(0,0,1))
+                local_point = (obj.node.get_pos() - dummy_node.get_pos()) *-1
+                f_vec.normalize()
+                solid.set_active(True)
+                try:
+                    solid.apply_impulse(f_vec*(energy*35), Point3(local_point))
+                except:
+                    pass
+                del(dummy_node)
+        if hasattr(obj, 'damage'):
+            obj.damage(energy*5)
+
+    def object_for_node(self, node):
+        """
+        Returns the object a physics node belongs to, or None.
+        """
+        return self.handles.get(node.get_python_tag('handle'))
+
+    def collision_events(self):
+        """
+        Returns (object, object, manifold point) for every pair of objects left touching by the last physics step,
+        where at least one of them is a registered collider. These come straight from Bullet's contact manifolds,
+        so the cost follows the number of actual contacts rather than the number of colliders. Hits found by
+        sweep come after them, with a ray hit in place of the manifold point.
+        """
+        events = []
+        for manifold in self.physics.get_manifolds():
+            if manifold.get_num_manifold_points() < 1:
+                continue
+            obj0 = self.object_for_node(manifold.get_node0())
+            obj1 = self.object_for_node(manifold.get_node1())
+            if obj0 is None or obj1 is None or obj0 is obj1:
+                continue
+            if self.passes_through(obj0, obj1, manifold.get_node1()) or \
+                    self.passes_through(obj1, obj0, manifold.get_node0()):
+                continue
+            if obj0 in self.collidables or obj1 in self.collidables:
+                events.append((obj0, obj1, manifold.get_manifold_point(0)))
+        return events + self.sweep_events
+
+    def sweep(self):
+        """
+        Ray tests the path every swept projectile took in the last ballistics step, all in one pass, and returns
+        (projectile, object, hit) for each that ran into something. A projectile that did is put where it hit, so
+        it goes off there rather than on the far side. What a projectile passes through (see passes_through)
+        doesn't stop the ray.
+        """
+        events = []
+        for obj, start, end in self.ballistics.paths():
+            if not obj.swept or obj not in self.collidables or start == end:
+                continue
+            result = self.physics.ray_test_all(start, end, SWEEP_COLLIDE_BITS)
+            first = None
+            other = None
+            for i in xrange(result.get_num_hits()):
+                hit = result.get_hit(i)
+                if first is not None and hit.get_hit_fraction() >= first.get_hit_fraction():
+                    continue
+                hit_obj = self.object_for_node(hit.get_node())
+                if hit_obj is None or hit_obj is obj or self.passes_through(obj, hit_obj, hit.get_node()):
+                    continue
+                first = hit
+                other = hit_obj
+            if first is None:
+                continue
+            self.ballistics.place(obj, first.get_hit_pos())
+            events.append((obj, other, first))
+        return events
+
+    def passes_through(self, projectile, other, node):
+        """
+        Whether projectile goes through other (whose physics node it touched is node) without hitting it: its own
+        shooter, and ghosts other than walkers, like goodies, which are there to be picked up rather than shot.
+        """
+        if not projectile.flags & PROJECTILE_FLAG:
+            return False
+        if other is getattr(projectile, 'shooter', None):
+            return True
+        return isinstance(node, BulletGhostNode) and not other.flags & WALKER_FLAG
 
+    def dispatch_collisions(self):
+        """
+        Tells both objects in each collision event about it. Objects thrown out by an earlier event in the same
+        pass don't hear about any more.
+        """
+        for obj0, obj1, point in self.collision_events():
+            if obj0 in self.garbage or obj1 in self.garbage:
+                continue
+            if obj0 in self.collidables:
+                obj0.collision(obj1, point, True)
+            if obj1 in self.collidables:
+                obj1.collision(obj0, point, False)
+
+    def create_walker(self, name=None, player=False):
+        from pavara.walker import Walker
+        return self.attach(Walker(self.get_incarn(), player=player, name=name))
 
     def update(self, task):
         """
         Called every frame to update the physics, etc.
         """
-        dt = globalClock.getDt()
+        self.step(globalClock.getDt())
+        return task.cont
+
+    def step(self, dt, substeps=None):
+        """
+        Advances the world by dt seconds. If substeps is given, the physics step is split into that many fixed
+        substeps of dt / substeps each, otherwise Bullet's default stepping is used.
+        """
         for obj in self.updatables_to_add:
             self.updatables.add(obj)
         self.updatables_to_add = set()
@@ -116,110 +392,78 @@ class World (object):
             if len(self.garbage) < 1:
                 break;
             trash = self.garbage.pop()
-            if(isinstance(trash.solid, BulletGhostNode)):
-                self.physics.remove_ghost(trash.solid)
-            if(isinstance(trash.solid, BulletRigidBodyNode)):
-                self.physics.remove_rigid_body(trash.solid)
+            solid = getattr(trash, 'solid', None)
+            if(isinstance(solid, BulletGhostNode)):
+                self.physics.remove_ghost(solid)
+            if(isinstance(solid, BulletRigidBodyNode)):
+                self.physics.remove_rigid_body(solid)
+                if solid.is_static():
+                    self.static_version += 1
             if hasattr(trash, 'dead'):
                 trash.dead()
+            self.unindex_object(trash)
+            self.handles.remove(trash.handle)
+            self.ballistics.remove(trash)
+            if trash.pooled:
+                self.release(trash)
+                continue
             trash.node.remove_node()
             del(trash)
-        self.physics.do_physics(dt)
-        for obj in self.collidables:
-            result = self.physics.contact_test(obj.node.node())
-            for contact in result.get_contacts():
-                obj1 = self.objects.get(contact.get_node0().get_name())
-                obj2 = self.objects.get(contact.get_node1().get_name())
-                if obj1 and obj2:
-                    # Check the collision bits to see if the two objects should collide.
-                    should_collide = obj1.collide_bits & obj2.collide_bits
-                    if not should_collide.is_zero():
-                        pt = contact.get_manifold_point()
-                        if obj1 in self.collidables:
-                            obj1.collision(obj2, pt, True)
-                        if obj2 in self.collidables:
-                            obj2.collision(obj1, pt, False)
-        return task.cont
+        self.ballistics.step(dt)
+        self.sweep_events = self.sweep()
+        if substeps:
+            self.physics.do_physics(dt, substeps, dt / float(substeps))
+        else:
+            self.physics.do_physics(dt)
+        for obj in self.moving:
+            self.index.move(obj, obj.position())
+        self.dispatch_collisions()
 
 class ServerWorld(World):
     """
     The server's view of the world, sans any purely visual information.
     """
     def __init__(self, debug=False):
-        super(ServerWorld, self).__init__(debug)
+        super(ServerWorld, self).__init__(None, debug)
+        self.camera = None
+        self.audio3d = None
+        self.sky = self.attach(Sky())
+        self.lag_compensation = LagCompensator(self)
 
+    def step(self, dt, substeps=None):
+        super(ServerWorld, self).step(dt, substeps)
+        from pavara.walker import Walker
+        walkers = [obj for obj in self.updatables if isinstance(obj, Walker)]
+        self.lag_compensation.record(globalClock.getFrameTime(), walkers)
 
+    def collision_events(self):
+        """
+        Lagged shots hit walkers where the shooter saw them, not where they are now.
+        """
+        events = []
+        for obj0, obj1, point in super(ServerWorld, self).collision_events():
+            if not (self._rewound(obj0, obj1) or self._rewound(obj1, obj0)):
+                events.append((obj0, obj1, point))
+        for obj in self.collidables:
+            if isinstance(obj, Projectile) and obj.lag > 0:
+                for walker, point in self.lag_compensation.rewound_hits(obj, obj.lag):
+                    events.append((obj, walker, point))
+        return events
 
-    def register_collider(self, obj):
-        assert isinstance(obj, PhysicalObject)
-        self.collidables.add(obj)
+    def _rewound(self, shot, target):
+        return isinstance(shot, Projectile) and shot.lag > 0 and target in self.lag_compensation.histories
 
-    def do_explosion(self, node, radius, force):
-        center = node.get_pos(self.scene);
-        expl_body = BulletGhostNode("expl")
-        expl_shape = BulletSphereShape(radius)
-        expl_body.add_shape(expl_shape)
-        expl_bodyNP = self.scene.attach_new_node(expl_body)
-        expl_bodyNP.set_pos(center)
-        self.physics.attach_ghost(expl_body)
-        result = self.physics.contact_test(expl_body)
-        for contact in result.getContacts():
-            n0_name = contact.getNode0().get_name()
-            n1_name = contact.getNode1().get_name()
-            obj = None
-            try:
-                obj = self.objects[n1_name]
-            except:
-                break
-            if n0_name == "expl" and n1_name not in EXPLOSIONS_DONT_PUSH and not n1_name.startswith('Walker'):
-                # repeat contact test with just this pair of objects
-                # otherwise all manifold point values will be the same
-                # for all objects in original result
-                real_c = self.physics.contact_test_pair(expl_body, obj.solid)
-                mpoint = real_c.getContacts()[0].getManifoldPoint()
-                distance = mpoint.getDistance()
-                if distance < 0:
-                    if hasattr(obj, 'decompose'):
-                        obj.decompose()
-                    else:
-                        expl_vec = Vec3(mpoint.getPositionWorldOnA() - mpoint.getPositionWorldOnB())
-                        expl_vec.normalize()
-                        magnitude = force * 1.0/math.sqrt(abs(radius - abs(distance)))
-                        obj.solid.set_active(True)
-                        obj.solid.apply_impulse(expl_vec*magnitude, mpoint.getLocalPointB())
-                    if hasattr(obj, 'damage'):
-                        obj.damage(magnitude/5)
-        self.physics.remove_ghost(expl_body)
-        expl_bodyNP.detach_node()
-        del(expl_body, expl_bodyNP)
-
-
-    def do_plasma_push(self, plasma, node, energy):
-        obj = None
-        try:
-            obj = self.objects[node]
-        except:
-            raise
-
-        if node not in EXPLOSIONS_DONT_PUSH and not node.startswith('Walker'):
-            if hasattr(obj, 'decompose'):
-                obj.decompose()
-            else:
-                solid = obj.solid
-                dummy_node = NodePath('tmp')
-                dummy_node.set_hpr(plasma.hpr)
-                dummy_node.set_pos(plasma.pos)
-                f_vec = scene.get_relative_vector(dummy_node, Vec3(0,0,1))
-                local_point = (obj.node.get_pos() - dummy_node.get_pos()) *-1
-                f_vec.normalize()
-                solid.set_active(True)
-                try:
-                    solid.apply_impulse(f_vec*(energy*35), Point3(local_point))
-                except:
-                    pass
-                del(dummy_node)
-        if hasattr(obj, 'damage'):
-            obj.damage(energy*5)
+    def set_ambient(self, color):
+        pass
+
+    def add_celestial(self, azimuth, elevation, color, intensity, radius, visible):
+        pass
+
+    def add_starfield(self, seed, count, min_color, max_color, min_size, max_size, mode):
+        pass
+
+    def create_celestial_node(self):
+        pass
 
 
 class ClientWorld(World):
@@ -233,7 +477,9 @@ class ClientWorld(World):
         self.audio3d = audio3d
         self.ambient = self._make_ambient()
         self.celestials = CompositeObject()
+        self.starfields = []
         self.sky = self.attach(Sky())
+        self.debris = self.attach(Debris(gravity=self.gravity))
 
     def _make_ambient(self):
         alight = AmbientLight('ambient')
@@ -248,6 +494,13 @@ class ClientWorld(World):
         """
         self.ambient.node().set_color(VBase4(*color))
 
+    def in_view(self, node):
+        bounds = node.get_bounds()
+        if bounds.is_empty():
+            return False
+        bounds.xform(node.get_mat(self.camera))
+        return self.camera.node().get_lens().make_bounds().contains(bounds) != BoundingVolume.IF_no_intersection
+
     def create_celestial_node(self):
         bounds = self.camera.node().get_lens().make_bounds()
         self.celestials = self.celestials.create_node()
@@ -257,9 +510,8 @@ class ClientWorld(World):
         self.celestials.node().set_bounds(bounds)
         self.celestials.node().set_final(True)
         self.celestials.reparent_to(self.scene)
-
-    def register_collider(self, obj):
-        pass
+        for starfield in self.starfields:
+            self.celestials.attach_new_node(starfield)
 
     def add_celestial(self, azimuth, elevation, color, intensity, radius, visible):
         """
@@ -284,4 +536,12 @@ class ClientWorld(World):
                 samples = int(round(((1.5 * radius) * (2 / 3.0)) + 3.75))
             celestial = Dome(radius * 1.5, samples, 2, color, 0, location,
                 ((-(math.degrees(azimuth))), 90 + math.degrees(elevation), 0))
-            self.celestials.attach(celestial)
\ No newline at end of file
+            self.celestials.attach(celestial)
+
+    def add_starfield(self, seed, count, min_color, max_color, min_size, max_size, mode):
+        """
+        Adds a field of count small, unlit stars to the sky (see pavara.starfield).
+        """
+        if not self.camera:
+            return
+        self.starfields.append(build_starfield(seed, count, min_color, max_color, min_size, max_size, mode))
\ No newline at end of file
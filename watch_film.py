@@ -0,0 +1,37 @@
+import sys
+from panda3d.core import *
+from direct.showbase.ShowBase import ShowBase
+from pavara.films import FilmReader, FilmPlayer
+from pavara.maps import load_maps
+from pavara.world import ClientWorld
+
+
+class WatchFilm (ShowBase):
+    def __init__(self, path):
+        ShowBase.__init__(self)
+        self.disableMouse()
+        self.setBackgroundColor(0, 0, 0)
+        self.render.setShaderAuto()
+        self.reader = FilmReader(path)
+        world = ClientWorld(self.cam, debug=False, audio3d=None)
+        self.map = load_maps('Maps/%s' % self.reader.map_name, world)[0]
+        self.map.show(self.render)
+        self.camera.setPos(*self.map.preview_cam[0])
+        self.camera.setH(self.map.preview_cam[1][0])
+        self.camera.setP(self.map.preview_cam[1][1])
+        self.player = FilmPlayer(world, self.reader)
+        taskMgr.add(self.player.update, 'filmPlayerTask')
+        self.accept('escape', sys.exit)
+        self.accept('arrow_left', self.skip, [-10])
+        self.accept('arrow_right', self.skip, [10])
+
+    def skip(self, seconds):
+        self.player.seek(self.player.time + seconds)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print 'usage: watch_film.py <film>'
+        sys.exit(1)
+    loadPrcFile('panda_config.prc')
+    w = WatchFilm(sys.argv[1])
+    w.run()